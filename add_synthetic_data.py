@@ -13,6 +13,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from src.database.session import get_session, close_session
 from src.database.models import User, EmotionEntry, TherapyTheme
+from src.emotion_rollup import rebuild_emotion_rollups
 
 def create_synthetic_emotion_entry(user_id: int, state: str, emotion_type: str, 
                                  created_at: datetime, answer_text: str = None, 
@@ -204,6 +205,7 @@ def generate_synthetic_data_for_user(user_id: int):
         print(f"🧹 Удаляем {existing_entries} существующих записей...")
         session.query(EmotionEntry).filter(EmotionEntry.user_id == user_id).delete()
         session.commit()
+        rebuild_emotion_rollups(user_id)  # Bulk delete bypasses the rollup events
     
     now = datetime.now()
     entries_to_add = []
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the emotion time series
+
+Builds synthetic year-long histories and times the emotion-analysis trends
+(per-day positive/negative counts, 7-day rolling averages, valence trend
+slope, longest logging streak and weekday x hour heatmap) computed by
+src/emotion_timeseries.py against the same numbers from per-entry Python
+loops, and checks that both agree.
+
+Usage:
+    python benchmark_emotion_timeseries.py [--days 365] [--per-day 20] [--users 5] [--repeat 5]
+"""
+
+import time
+import random
+import argparse
+import statistics
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from src.emotion_timeseries import build_emotion_series, ROLLING_WINDOW_DAYS
+
+def make_history(days: int, per_day: int, rng: random.Random):
+    """(created_at, emotion_type) of one user, with some days skipped"""
+    end = datetime.combine(date.today(), datetime.min.time())
+    created_at, emotion_types = [], []
+    for day in range(days):
+        if rng.random() < 0.2:
+            continue
+        for _ in range(rng.randint(1, per_day * 2 - 1)):
+            created_at.append(end - timedelta(days=day) + timedelta(minutes=rng.randint(0, 24 * 60 - 1)))
+            emotion_types.append("positive" if rng.random() < 0.55 else "negative")
+    return created_at, emotion_types
+
+def python_loops(created_at, emotion_types, start_day: date, end_day: date):
+    """The same trends with a Python loop over every entry and day"""
+    days = (end_day - start_day).days + 1
+    positive, negative = Counter(), Counter()
+    heatmap = Counter()
+    for moment, emotion_type in zip(created_at, emotion_types):
+        index = (moment.date() - start_day).days
+        if not 0 <= index < days:
+            continue
+        (positive if emotion_type == "positive" else negative)[index] += 1
+        heatmap[(moment.weekday(), moment.hour)] += 1
+
+    rolling = []
+    for index in range(days):
+        window = range(max(index - ROLLING_WINDOW_DAYS + 1, 0), index + 1)
+        rolling.append(sum(positive[i] for i in window) / len(window))
+
+    points = [(i, (positive[i] - negative[i]) / (positive[i] + negative[i]))
+              for i in range(days) if positive[i] + negative[i]]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    slope = (sum((x - mean_x) * (y - mean_y) for x, y in points)
+             / sum((x - mean_x) ** 2 for x, _ in points))
+
+    longest = current = 0
+    for index in range(days):
+        current = current + 1 if positive[index] + negative[index] else 0
+        longest = max(longest, current)
+    return rolling, slope, longest, heatmap
+
+def vectorized(created_at: np.ndarray, emotion_types: np.ndarray, start_day: date, end_day: date):
+    series = build_emotion_series(created_at, emotion_types, start_day, end_day)
+    rolling_positive, _ = series.rolling()
+    slope, _ = series.valence_trend()
+    return rolling_positive, slope, series.longest_streak(), series.hour_heatmap
+
+def measure(name: str, func, histories, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for history in histories:
+            func(*history)
+        timings.append((time.perf_counter() - started) * 1000 / len(histories))
+    print(f"{name:<24} median {statistics.median(timings):8.2f} ms/user   best {min(timings):8.2f} ms/user")
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion time series")
+    parser.add_argument("--days", type=int, default=365, help="Days of history per user")
+    parser.add_argument("--per-day", type=int, default=20, help="Average entries per active day")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    end_day = date.today()
+    start_day = end_day - timedelta(days=args.days - 1)
+    loops, arrays = [], []
+    for _ in range(args.users):
+        created_at, emotion_types = make_history(args.days, args.per_day, rng)
+        loops.append((created_at, emotion_types, start_day, end_day))
+        # What load_emotion_series hands over after the column query
+        arrays.append((np.array(created_at, dtype='datetime64[m]'), np.array(emotion_types, dtype=object),
+                       start_day, end_day))
+    entries = sum(len(history[0]) for history in loops) // args.users
+    print(f"📊 {args.users} users x {args.days} days (~{entries} entries each): rolling averages, trend, streak, heatmap")
+
+    # Same numbers both ways
+    for loop_history, array_history in zip(loops, arrays):
+        rolling, slope, longest, heatmap = python_loops(*loop_history)
+        np_rolling, np_slope, np_longest, np_heatmap = vectorized(*array_history)
+        assert np.allclose(rolling, np_rolling) and abs(slope - np_slope) < 1e-9 and longest == np_longest
+        assert all(np_heatmap[weekday, hour] == count for (weekday, hour), count in heatmap.items())
+        assert np_heatmap.sum() == sum(heatmap.values())
+
+    before = measure("Python loops", python_loops, loops, args.repeat)
+    after = measure("emotion_timeseries", vectorized, arrays, args.repeat)
+    print(f"⚡ {before / after:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the emotion entry classifier
+
+Builds synthetic 10k-entry histories (quick diary entries, entries marked
+for therapy, "AI рекомендация помогла" notes and multi-message
+conversations) and times preparing the key-moments sections of the
+short, text and PDF reports: the previous per-report passes, which each
+re-sorted, re-split and re-parsed every entry (plus the separate digest
+of the report cache key), against one classify_entries pass shared by
+all three.
+
+Usage:
+    python benchmark_entry_classifier.py [--entries 10000] [--users 5] [--repeat 5]
+"""
+
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from src.entry_classifier import classify_entries, parse_context
+from src.report_cache import data_version
+
+STATES = [f"good_state_{i}" for i in range(1, 6)] + [f"bad_state_{i}" for i in range(1, 6)]
+CONTEXTS = [
+    lambda rng: "Emotion recorded from diary",
+    lambda rng: f"Marked for therapy work: поссорился с коллегой из-за сроков проекта {rng.randint(1, 99)}",
+    lambda rng: f"Отмечено для проработки с терапевтом: тревога перед встречей {rng.randint(1, 99)}",
+    lambda rng: f"AI рекомендация помогла: дыхательная практика перед сном {rng.randint(1, 99)}",
+    lambda rng: "\n".join(f"Сообщение {n}: длинная запись о прошедшем дне и мыслях {rng.randint(1, 99)}"
+                          for n in range(1, rng.randint(2, 5))),
+    lambda rng: "Просто устал после работы и хотел побыть один " * rng.randint(1, 6),
+]
+
+def make_history(user_id: int, entries: int, rng: random.Random):
+    """Entries of one user, newest first like the handler's query"""
+    now = datetime.now()
+    history = []
+    for index in range(entries):
+        state = rng.choice(STATES)
+        history.append(SimpleNamespace(
+            id=user_id * 1_000_000 + index,
+            user_id=user_id,
+            created_at=now - timedelta(minutes=index * 13),
+            emotion_type="positive" if state.startswith("good") else "negative",
+            state=state,
+            option=f"option_{rng.randint(0, 1)}",
+            answer_text=rng.choice(CONTEXTS)(rng),
+        ))
+    return history
+
+def previous_pass(entries, limit: int):
+    """One report's preparation as each report did it before: sort, split, then parse every entry"""
+    all_entries = sorted(entries, key=lambda x: x.created_at)
+    entries_with_context = []
+    simple_diary_entries = []
+    for entry in all_entries:
+        if entry.answer_text and entry.answer_text.strip():
+            if entry.answer_text == "Emotion recorded from diary":
+                simple_diary_entries.append(entry)
+            elif entry.answer_text not in ["Marked for therapy work:"]:
+                entries_with_context.append(entry)
+
+    lines = []
+    for entry in entries_with_context:
+        context, extra_messages, marker = parse_context(entry.answer_text)
+        if context is None:
+            continue
+        lines.append((entry.created_at.strftime("%d.%m.%Y, %H:%M"), entry.state, context[:limit], marker))
+    for entry in simple_diary_entries:
+        lines.append((entry.created_at.strftime("%d.%m.%Y, %H:%M"), entry.state, entry.option.split("_")[1]))
+
+    positive = [e for e in entries if e.emotion_type == "positive"][-5:]
+    negative = [e for e in entries if e.emotion_type == "negative"]
+    contexts = [e.answer_text for e in negative if e.answer_text and len(e.answer_text) > 20][:5]
+    return lines, positive, contexts
+
+def previous(entries):
+    # Short analysis, PDF report and its text fallback each prepared the entries again,
+    # and the PDF report hashed them once more for its cache key
+    for limit in (120, 150, 150):
+        previous_pass(entries, limit)
+    data_version((e.id, e.emotion_type, e.state, e.option, e.answer_text) for e in entries)
+
+def single_pass(entries):
+    digest = classify_entries(entries)
+    for limit in (120, 150, 150):
+        lines = [(note.date_str, note.state, note.context[:limit], note.marker) for note in digest.context_notes]
+        lines += [(note.date_str, note.state, note.option_num) for note in digest.quick_notes]
+
+def measure(name: str, func, histories, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for history in histories:
+            func(history)
+        timings.append((time.perf_counter() - started) * 1000 / len(histories))
+    print(f"{name:<28} median {statistics.median(timings):8.2f} ms/user   best {min(timings):8.2f} ms/user")
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion entry classifier")
+    parser.add_argument("--entries", type=int, default=10000, help="Entries per user history")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    histories = [make_history(user_id, args.entries, rng) for user_id in range(1, args.users + 1)]
+    print(f"📊 {args.users} users x {args.entries} entries, short + PDF + text report preparation")
+
+    before = measure("per-report passes (before)", previous, histories, args.repeat)
+    after = measure("classify_entries (after)", single_pass, histories, args.repeat)
+    print(f"⚡ {before / after:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
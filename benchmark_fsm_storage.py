@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the FSM storage backends
+
+Replays a diary-style handler on many concurrent chats: read the state
+and data, call update_data a few times (e.g. message ids to delete), then
+set the next state. Compares aiogram's MemoryStorage, SQLiteStorage
+writing through on every call and SQLiteStorage with coalesced writes,
+and reports handler latency and the database writes each one needed.
+
+Usage:
+    python benchmark_fsm_storage.py [--chats 500] [--steps 20] [--updates 3]
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from src.fsm_storage import SQLiteStorage
+
+STATES = ["EmotionDiary:waiting_for_emotion", "EmotionDiary:waiting_for_option", "EmotionDiary:waiting_for_note"]
+
+async def handler(storage, key: StorageKey, step: int, updates: int):
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    messages = data.get("messages_to_delete", [])
+    for update in range(updates):
+        messages = messages[-10:] + [step * updates + update]
+        await storage.update_data(key, {"messages_to_delete": messages, "step": step})
+    await storage.set_state(key, STATES[step % len(STATES)])
+
+async def chat(storage, key: StorageKey, steps: int, updates: int, latencies: list):
+    for step in range(steps):
+        started = time.perf_counter()
+        await handler(storage, key, step, updates)
+        latencies.append((time.perf_counter() - started) * 1000)
+        # Let other chats run, as between two Telegram updates
+        await asyncio.sleep(0)
+
+async def run(name: str, storage, chats: int, steps: int, updates: int):
+    keys = [StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id) for chat_id in range(chats)]
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(storage, key, steps, updates, latencies) for key in keys))
+    await storage.close()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    line = (f"{name:<20} {len(latencies) / elapsed:9.0f} handlers/s   "
+            f"p50 {statistics.median(latencies):6.3f} ms   p95 {p95:6.3f} ms")
+    if isinstance(storage, SQLiteStorage):
+        stats = storage.stats()
+        line += f"   writes {stats['writes_requested']} -> rows {stats['rows_written']} in {stats['commits']} commits"
+    print(line)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark FSM storage backends")
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=20, help="Handlers run per chat")
+    parser.add_argument("--updates", type=int, default=3, help="update_data calls per handler")
+    parser.add_argument("--flush-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"📊 {args.chats} chats x {args.steps} handlers, {args.updates} update_data + set_state each")
+    directory = tempfile.mkdtemp()
+    await run("MemoryStorage", MemoryStorage(), args.chats, args.steps, args.updates)
+    await run("SQLite write-through", SQLiteStorage(os.path.join(directory, "through.db"), flush_delay=None),
+              args.chats, args.steps, args.updates)
+    await run("SQLite coalesced", SQLiteStorage(os.path.join(directory, "coalesced.db"), flush_delay=args.flush_delay),
+              args.chats, args.steps, args.updates)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark for ChromaManager.hybrid_search
+
+Compares the previous two-query hybrid search (vector query + Chroma
+query_texts with string-dedup merge) with the BM25 + reciprocal-rank fusion
+search on the books collection.
+
+Each query is a sentence taken from a random chunk; the query embedding is
+that chunk's stored embedding plus noise, so no API calls are needed. Recall@k
+is the share of queries whose source chunk is in the top k results.
+
+Usage:
+    python benchmark_hybrid_search.py [--queries 200] [--k 5] [--noise 0.02]
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.append('src')
+
+from src.aichat.chroma_manager import ChromaManager
+
+def legacy_hybrid_search(manager: ChromaManager, query_text: str, query_embedding, n_results: int):
+    """hybrid_search as it was before BM25 + RRF (kept here only for comparison)"""
+    vector_results = manager.collection.query(query_embeddings=[query_embedding], n_results=n_results)
+    try:
+        text_results = manager.collection.query(query_texts=[query_text], n_results=n_results - 1)
+        combined_docs = vector_results['documents'][0] if vector_results['documents'] else []
+        combined_ids = vector_results['ids'][0] if vector_results['ids'] else []
+        if text_results and text_results['documents']:
+            for i, doc in enumerate(text_results['documents'][0]):
+                if doc not in combined_docs:
+                    combined_docs.append(doc)
+                    combined_ids.append(text_results['ids'][0][i])
+        return combined_ids[:n_results]
+    except Exception:
+        return vector_results['ids'][0]
+
+def build_queries(manager: ChromaManager, count: int, noise: float, seed: int):
+    """Pick random chunks and turn one sentence of each into a query"""
+    data = manager.collection.get(include=["documents", "embeddings"])
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    positions = rng.sample(range(len(data["ids"])), min(count, len(data["ids"])))
+
+    queries = []
+    for position in positions:
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", data["documents"][position]) if len(s.split()) >= 5]
+        if not sentences:
+            continue
+        embedding = np.asarray(data["embeddings"][position], dtype=np.float32)
+        embedding = embedding + np_rng.normal(0, noise, embedding.shape).astype(np.float32)
+        queries.append((data["ids"][position], rng.choice(sentences), embedding.tolist()))
+    return queries
+
+def run(name: str, search, queries, k: int):
+    latencies = []
+    hits = 0
+    for chunk_id, text, embedding in queries:
+        started = time.perf_counter()
+        result_ids = search(text, embedding)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += chunk_id in result_ids
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+    print(f"{name:<22} p50 {statistics.median(latencies):7.2f} ms   p95 {p95:7.2f} ms   "
+          f"recall@{k} {hits / len(queries):.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hybrid search")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.02, help="Gaussian noise added to query embeddings")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    manager = ChromaManager(collection_name="books_pdfs", embedding_model="openai")
+    if manager.get_count() == 0:
+        print("❌ books_pdfs collection is empty, index the books first")
+        return
+
+    queries = build_queries(manager, args.queries, args.noise, args.seed)
+    print(f"📊 {len(queries)} queries over {manager.get_count()} chunks, k={args.k}")
+
+    # Warm up both paths (Chroma's default ONNX embedder, BM25 index build)
+    started = time.perf_counter()
+    legacy_hybrid_search(manager, queries[0][1], queries[0][2], args.k)
+    print(f"legacy warm-up: {(time.perf_counter() - started) * 1000:.0f} ms")
+    started = time.perf_counter()
+    manager.hybrid_search(queries[0][1], queries[0][2], args.k)
+    print(f"bm25+rrf warm-up: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    run("legacy (2 queries)", lambda text, emb: legacy_hybrid_search(manager, text, emb, args.k), queries, args.k)
+    run("bm25 + rrf", lambda text, emb: manager.hybrid_search(text, emb, args.k)['ids'][0], queries, args.k)
+
+if __name__ == "__main__":
+    main()
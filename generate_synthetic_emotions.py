@@ -16,6 +16,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from src.database.session import get_session, close_session
 from src.database.models import User, EmotionEntry, TherapyTheme, WeeklyReflection
+from src.emotion_rollup import rebuild_emotion_rollups
 
 class EmotionPatternGenerator:
     """Advanced emotion pattern generator with realistic behavioral patterns"""
@@ -525,6 +526,9 @@ def clear_user_data(user_id: int, data_types: List[str] = None):
     session.commit()
     close_session(session)
     
+    if "emotions" in counts:
+        rebuild_emotion_rollups(user_id)  # Bulk delete bypasses the rollup events
+    
     return counts
 
 def generate_data_for_user(user_id: int, days: int = 90, include_themes: bool = True, 
@@ -4,10 +4,12 @@ Activity Tracker for PsyBot
 Tracks user interactions to prevent notifications during active sessions
 """
 
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Union
+from typing import Dict, Optional, Union
 from aiogram import types
+from sqlalchemy import bindparam, update
 from src.database.models import User
 from src.database.session import get_session, close_session
 
@@ -16,25 +18,129 @@ logger = logging.getLogger(__name__)
 # Time threshold for considering a user as "actively interacting"
 ACTIVE_INTERACTION_THRESHOLD = timedelta(minutes=15)  # 15 minutes
 
-def update_user_activity(user_id: int) -> None:
+# Seconds between write-behind flushes of buffered activity timestamps
+ACTIVITY_FLUSH_INTERVAL = 5
+
+class ActivityBuffer:
+    """
+    Write-behind buffer of last_activity timestamps keyed by internal user ID.
+
+    Every interaction only updates memory; pending timestamps are written in
+    one executemany UPDATE per flush interval and once more at shutdown.
+    Recent timestamps stay in memory for ACTIVE_INTERACTION_THRESHOLD so the
+    scheduler can read them before they reach the database.
     """
-    Update the last activity timestamp for a user
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, datetime] = {}
+        self._recent: Dict[int, datetime] = {}
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: int, when: datetime = None) -> None:
+        """Remember a user's interaction; persisted on the next flush()"""
+        when = when or datetime.now()
+        self._pending[user_id] = when
+        self._recent[user_id] = when
+
+    def last_activity(self, user_id: int) -> Optional[datetime]:
+        """Latest buffered interaction of a user (None if not seen recently)"""
+        return self._recent.get(user_id)
+
+    def _write(self, pending: Dict[int, datetime]) -> None:
+        """Bulk UPDATE of last_activity; runs in a worker thread and touches no buffer state"""
+        session = get_session()
+        try:
+            # Core executemany: users deleted meanwhile are skipped instead of failing the batch
+            table = User.__table__
+            session.execute(
+                update(table).where(table.c.id == bindparam("user_id")).values(last_activity=bindparam("when")),
+                [{"user_id": user_id, "when": when} for user_id, when in pending.items()]
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            close_session(session)
+
+    async def flush(self) -> int:
+        """
+        Write pending timestamps to the database in one transaction
+        
+        The buffer dicts are only read and changed on the event loop, next
+        to record(); the worker thread gets its own copy for the UPDATE.
+        
+        Returns:
+            Number of users updated
+        """
+        # Drop timestamps too old to count as active interaction
+        cutoff = datetime.now() - ACTIVE_INTERACTION_THRESHOLD
+        self._recent = {user_id: when for user_id, when in self._recent.items() if when >= cutoff}
+
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            logger.error(f"Failed to flush activity timestamps for {len(pending)} users: {e}")
+            # Keep the newest timestamp of each user for the next attempt
+            for user_id, when in pending.items():
+                if self._pending.get(user_id, when) <= when:
+                    self._pending[user_id] = when
+            return 0
+        return len(pending)
+
+    async def run(self) -> None:
+        """Background flush loop"""
+        logger.info("🕒 Activity write-behind buffer started")
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in activity flush loop: {e}")
+
+    def start(self) -> asyncio.Task:
+        """Start the background loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop the loop and write whatever is still pending"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+# Shared buffer fed by the activity middleware and read by the scheduler
+activity_buffer = ActivityBuffer()
+
+async def update_user_activity(user_id: int) -> None:
+    """
+    Update the last activity timestamp for a user (buffered, written by activity_buffer)
     
     Args:
         user_id: Telegram user ID
     """
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == user_id).first()
-        if db_user:
-            db_user.last_activity = datetime.now()
-            session.commit()
-            logger.debug(f"Updated last activity for user {user_id}")
-    except Exception as e:
-        logger.error(f"Failed to update activity for user {user_id}: {e}")
-        session.rollback()
-    finally:
-        close_session(session)
+    # Unknown users are skipped without a query while they are cached as absent
+    from src.user_cache import user_cache
+    profile = await user_cache.get(user_id)
+    if not profile:
+        return
+    
+    activity_buffer.record(profile.id)
+    logger.debug(f"Updated last activity for user {user_id}")
 
 def is_user_actively_interacting(user: User) -> bool:
     """
@@ -46,10 +152,11 @@ def is_user_actively_interacting(user: User) -> bool:
     Returns:
         True if user has interacted within the threshold, False otherwise
     """
-    if not user.last_activity:
+    last_activity = activity_buffer.last_activity(user.id) or user.last_activity
+    if not last_activity:
         return False
     
-    time_since_activity = datetime.now() - user.last_activity
+    time_since_activity = datetime.now() - last_activity
     return time_since_activity <= ACTIVE_INTERACTION_THRESHOLD
 
 def activity_middleware(handler):
@@ -73,7 +180,7 @@ def activity_middleware(handler):
             return await handler(update, *args, **kwargs)
         
         # Update activity before processing
-        update_user_activity(user_id)
+        await update_user_activity(user_id)
         
         # Call the original handler
         return await handler(update, *args, **kwargs)
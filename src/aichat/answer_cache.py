@@ -0,0 +1,162 @@
+"""
+Semantic answer cache for the RAG chat
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from src.database.models import AnswerCacheOptOut
+from src.database.session import engine, get_session, close_session
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity between question embeddings for a cache hit
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# Seconds a cached answer stays valid
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+# Maximum number of cached answers (least recently used are evicted)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray  # Unit-length question embedding
+    context_key: Tuple[str, ...]
+    answer: str
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """
+    Javoblar keshi: o'xshash savol + bir xil kontekst -> saqlangan javob.
+
+    A cached answer is reused only when the new question's embedding is
+    within the cosine threshold of a cached question AND retrieval returned
+    the same chunk IDs, so answers never outlive a change in the books
+    index. Entries expire after the TTL and the least recently used ones
+    are evicted past the size limit.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._by_context: Dict[Tuple[str, ...], Set[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._by_context.get(entry.context_key)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_context[entry.context_key]
+
+    def get(self, embedding, context_ids) -> Optional[str]:
+        """O'xshash savolga saqlangan javobni topish (topilmasa None)"""
+        context_key = tuple(sorted(context_ids))
+        query = self._unit(embedding)
+        now = time.monotonic()
+
+        best_id, best_score = None, self.threshold
+        for entry_id in list(self._by_context.get(context_key, ())):
+            entry = self._entries[entry_id]
+            if now - entry.created_at > self.ttl:
+                self._remove(entry_id)
+                continue
+            score = float(np.dot(query, entry.embedding))
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        logger.info(f"Answer cache hit (similarity {best_score:.3f})")
+        return self._entries[best_id].answer
+
+    def put(self, embedding, context_ids, answer: str) -> None:
+        """Yangi javobni keshga qo'shish"""
+        context_key = tuple(sorted(context_ids))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = CachedAnswer(self._unit(embedding), context_key, answer, time.monotonic())
+        self._by_context.setdefault(context_key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_context.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+class AnswerCacheOptOuts:
+    """Keshlangan javoblardan voz kechgan foydalanuvchilar (DB da saqlanadi, xotirada nusxasi)"""
+
+    def __init__(self):
+        self._telegram_ids: Optional[Set[int]] = None
+
+    def _load(self) -> Set[int]:
+        if self._telegram_ids is None:
+            AnswerCacheOptOut.__table__.create(engine, checkfirst=True)
+            session = get_session()
+            try:
+                self._telegram_ids = {row[0] for row in session.query(AnswerCacheOptOut.telegram_id).all()}
+            finally:
+                close_session(session)
+        return self._telegram_ids
+
+    def is_opted_out(self, telegram_id: int) -> bool:
+        return telegram_id in self._load()
+
+    def set_opted_out(self, telegram_id: int, opted_out: bool) -> None:
+        telegram_ids = self._load()
+        session = get_session()
+        try:
+            if opted_out:
+                session.merge(AnswerCacheOptOut(telegram_id=telegram_id))
+            else:
+                session.query(AnswerCacheOptOut).filter(AnswerCacheOptOut.telegram_id == telegram_id).delete()
+            session.commit()
+        except Exception as e:
+            logger.error(f"Failed to save answer cache opt-out for {telegram_id}: {e}")
+            session.rollback()
+            raise
+        finally:
+            close_session(session)
+
+        if opted_out:
+            telegram_ids.add(telegram_id)
+        else:
+            telegram_ids.discard(telegram_id)
+
+
+answer_cache_opt_outs = AnswerCacheOptOuts()
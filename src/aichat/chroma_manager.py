@@ -3,9 +3,16 @@ ChromaDB Manager for OpenAI RAG functionality
 """
 import logging
 import uuid
+import threading
 from typing import List, Dict, Optional
 import chromadb
 import os
+from .keyword_index import BM25Index
+
+# Reciprocal-rank fusion constant
+RRF_K = 60
+# Candidates taken from each retriever per requested result
+HYBRID_CANDIDATES_FACTOR = 4
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +26,9 @@ class ChromaManager:
         self.embedding_model = embedding_model
         self.client = None
         self.collection = None
+        self.chroma_path = None
+        self._keyword_index: Optional[BM25Index] = None
+        self._keyword_lock = threading.Lock()
         self.initialize()
     
     def initialize(self):
@@ -26,9 +36,9 @@ class ChromaManager:
         try:
             # ChromaDB client yaratish (persistent)
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            chroma_path = os.path.join(base_dir, "chroma_db")
-            print(f"=======================>> ChromaDB path: {chroma_path}")
-            self.client = chromadb.PersistentClient(path=chroma_path)
+            self.chroma_path = os.path.join(base_dir, "chroma_db")
+            print(f"=======================>> ChromaDB path: {self.chroma_path}")
+            self.client = chromadb.PersistentClient(path=self.chroma_path)
             
             # Collection yaratish yoki olish
             self.collection = self.client.get_or_create_collection(
@@ -57,8 +67,9 @@ class ChromaManager:
             logger.error(f"Hujjat qo'shishda xatolik ({doc_id}): {e}")
             raise
     
-    def add_documents(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict]):
-        """Bir nechta hujjatni qo'shish"""
+    def add_documents(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict],
+                      ids: Optional[List[str]] = None):
+        """Bir nechta hujjatni qo'shish (ids berilsa upsert qilinadi)"""
         try:
             if not texts or not embeddings or not metadatas:
                 logger.warning("Bo'sh ma'lumot berildi")
@@ -67,22 +78,39 @@ class ChromaManager:
             if len(texts) != len(embeddings) or len(texts) != len(metadatas):
                 raise ValueError("texts, embeddings va metadatas uzunligi bir xil bo'lishi kerak")
             
-            # ID larni yaratish
-            ids = [str(uuid.uuid4()) for _ in texts]
+            if ids is None:
+                # ID larni yaratish
+                ids = [str(uuid.uuid4()) for _ in texts]
+                write = self.collection.add
+            else:
+                # Barqaror ID lar: qayta yozish xavfsiz
+                write = self.collection.upsert
             
-            self.collection.add(
+            write(
                 ids=ids,
                 documents=texts,
                 embeddings=embeddings,
                 metadatas=metadatas
             )
             
+            self._keyword_index = None
             logger.info(f"{len(texts)} ta hujjat qo'shildi")
             
         except Exception as e:
             logger.error(f"Hujjatlar qo'shishda xatolik: {e}")
             raise
     
+    def get_existing_ids(self, ids: List[str]) -> set:
+        """Berilgan ID lardan bazada mavjudlarini olish"""
+        existing = set()
+        try:
+            for start in range(0, len(ids), 1000):
+                result = self.collection.get(ids=ids[start:start + 1000], include=[])
+                existing.update(result.get('ids', []))
+        except Exception as e:
+            logger.error(f"Mavjud ID larni olishda xatolik: {e}")
+        return existing
+    
     def search(self, query_embedding: List[float], n_results: int = 5) -> Dict:
         """Vector search qilish"""
         try:
@@ -96,42 +124,61 @@ class ChromaManager:
             logger.error(f"Search xatolik: {e}")
             return {"documents": [], "metadatas": [], "distances": []}
     
+    def get_keyword_index(self) -> BM25Index:
+        """BM25 indeksni olish (collection o'zgargan bo'lsa qayta qurish)"""
+        with self._keyword_lock:
+            index = self._keyword_index
+            if index is None or len(index) != self.collection.count():
+                data = self.collection.get(include=["documents", "metadatas"])
+                index = BM25Index(data["ids"], data["documents"], data["metadatas"])
+                self._keyword_index = index
+                logger.info(f"BM25 indeks qurildi: {len(index)} ta chunk")
+            return index
+    
     def hybrid_search(self, query_text: str, query_embedding: List[float], n_results: int = 4) -> Dict:
-        """Hybrid search - text va vector search ni birlashtirish"""
+        """
+        Hybrid search - vector va BM25 natijalarini reciprocal-rank fusion bilan birlashtirish
+        
+        One Chroma query for the vector side; the keyword side runs on the
+        local BM25 index. Results are merged by chunk ID.
+        """
         try:
+            n_candidates = n_results * HYBRID_CANDIDATES_FACTOR
+            
             # Vector search
             vector_results = self.collection.query(
                 query_embeddings=[query_embedding],
-                n_results=n_results
+                n_results=n_candidates
             )
             
-            # Text search ham qo'shamiz (where clause orqali)
+            fused: Dict[str, float] = {}
+            documents: Dict[str, str] = {}
+            metadatas: Dict[str, Dict] = {}
+            
+            vector_ids = vector_results['ids'][0] if vector_results.get('ids') else []
+            for rank, chunk_id in enumerate(vector_ids):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                documents[chunk_id] = vector_results['documents'][0][rank]
+                metadatas[chunk_id] = vector_results['metadatas'][0][rank]
+            
+            # Keyword (BM25) search
             try:
-                text_results = self.collection.query(
-                    query_texts=[query_text],
-                    n_results=n_results -1
-                )
-                
-                # Natijalarni birlashtirish (sodda usul)
-                combined_docs = vector_results['documents'][0] if vector_results['documents'] else []
-                combined_metadata = vector_results['metadatas'][0] if vector_results['metadatas'] else []
-                
-                # Text search natijalarini qo'shish (duplikatsiz)
-                if text_results and text_results['documents']:
-                    for i, doc in enumerate(text_results['documents'][0]):
-                        if doc not in combined_docs:
-                            combined_docs.append(doc)
-                            if text_results['metadatas'] and text_results['metadatas'][0]:
-                                combined_metadata.append(text_results['metadatas'][0][i])
-                
-                return {
-                    'documents': [combined_docs[:n_results]],
-                    'metadatas': [combined_metadata[:n_results]]
-                }
-                
-            except:
-                # Agar text search ishlamasa, faqat vector search natijasini qaytarish
-                return vector_results
+                index = self.get_keyword_index()
+                for rank, position in enumerate(index.search(query_text, n_candidates)):
+                    chunk_id = index.ids[position]
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                    documents.setdefault(chunk_id, index.documents[position])
+                    metadatas.setdefault(chunk_id, index.metadatas[position])
+            except Exception as e:
+                # Agar keyword search ishlamasa, faqat vector search natijasi
+                logger.warning(f"BM25 search xatolik, faqat vector natijalar: {e}")
+            
+            top_ids = sorted(fused, key=fused.get, reverse=True)[:n_results]
+            return {
+                'ids': [top_ids],
+                'documents': [[documents[chunk_id] for chunk_id in top_ids]],
+                'metadatas': [[metadatas[chunk_id] for chunk_id in top_ids]]
+            }
             
         except Exception as e:
             logger.error(f"Hybrid search xatolik: {e}")
@@ -157,6 +204,7 @@ class ChromaManager:
                 metadata={"hnsw:space": "cosine"}
             )
             
+            self._keyword_index = None
             logger.info(f"Collection '{self.collection_name}' tozalandi")
             return True
             
@@ -168,6 +216,7 @@ class ChromaManager:
         """Bitta hujjatni o'chirish"""
         try:
             self.collection.delete(ids=[doc_id])
+            self._keyword_index = None
             logger.info(f"Hujjat o'chirildi: {doc_id}")
             return True
             
@@ -175,6 +224,27 @@ class ChromaManager:
             logger.error(f"Hujjat o'chirishda xatolik ({doc_id}): {e}")
             return False
     
+    def delete_documents(self, ids: List[str]) -> bool:
+        """Bir nechta hujjatni o'chirish"""
+        try:
+            for start in range(0, len(ids), 1000):
+                self.collection.delete(ids=ids[start:start + 1000])
+            self._keyword_index = None
+            logger.info(f"{len(ids)} ta hujjat o'chirildi")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Hujjatlarni o'chirishda xatolik: {e}")
+            return False
+    
+    def get_all_ids(self) -> List[str]:
+        """Collection dagi barcha hujjat ID lari (matn va embeddinglarsiz)"""
+        try:
+            return self.collection.get(include=[])["ids"]
+        except Exception as e:
+            logger.error(f"Hujjat ID larini olishda xatolik: {e}")
+            return []
+    
     def get_all_documents(self) -> Dict:
         """Barcha hujjatlarni olish"""
         try:
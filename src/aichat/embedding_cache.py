@@ -0,0 +1,251 @@
+"""
+Persistent embedding cache shared by books ingestion and chat queries
+"""
+import os
+import re
+import json
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Vectors kept in the in-memory LRU tier
+MEMORY_CACHE_SIZE = 2048
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Kesh kaliti uchun matnni normallashtirish (bo'shliqlar va registr)"""
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def cache_key(model: str, text: str) -> str:
+    """(model, sha256(normalized text)) kalit"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Embedding keshi: LRU xotira qatlami + diskdagi float32 massiv.
+
+    Each model gets its own directory with vectors.f32 (rows of float32,
+    read through np.memmap) and keys.txt (one key per row, appended after
+    the vector so a torn write is simply ignored on load). Writers from
+    all worker processes append under an flock on the directory's lock
+    file and first read the keys the others appended, so rows never
+    interleave. Only texts that miss both tiers are sent to the
+    embeddings API.
+    """
+
+    def __init__(self, cache_dir: str, memory_size: int = MEMORY_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._stores: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _model_dir(self, model: str) -> str:
+        return os.path.join(self.cache_dir, re.sub(r"[^\w.-]", "_", model))
+
+    def _store(self, model: str) -> Dict:
+        """Model uchun disk indeksini yuklash (bir marta)"""
+        store = self._stores.get(model)
+        if store is not None:
+            return store
+
+        store = {"dir": self._model_dir(model), "dim": None, "rows": {}, "memmap": None,
+                 "keys_read": 0, "keys_offset": 0}
+        try:
+            self._read_new_keys(store)
+        except Exception as e:
+            logger.error(f"Embedding kesh indeksini o'qishda xatolik ({model}), bo'sh kesh ishlatiladi: {e}")
+            store.update({"dim": None, "rows": {}, "keys_read": 0, "keys_offset": 0})
+        self._stores[model] = store
+        return store
+
+    def _read_new_keys(self, store: Dict, truncate: bool = False) -> None:
+        """
+        keys.txt dan hali o'qilmagan kalitlarni indeksga qo'shish
+
+        Only keys whose vector is complete are taken. With truncate=True
+        (called under the directory lock) the leftovers of a writer that
+        died mid-append - a partial key line or vectors without a key - are
+        cut off, so the next append starts on an aligned row.
+        """
+        meta_path = os.path.join(store["dir"], "meta.json")
+        keys_path = os.path.join(store["dir"], "keys.txt")
+        vectors_path = os.path.join(store["dir"], "vectors.f32")
+        if store["dim"] is None:
+            if not os.path.exists(meta_path):
+                return
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                store["dim"] = json.load(file)["dim"]
+        row_size = store["dim"] * 4
+
+        complete_rows = os.path.getsize(vectors_path) // row_size if os.path.exists(vectors_path) else 0
+        if os.path.exists(keys_path):
+            with open(keys_path, 'rb') as file:
+                file.seek(store["keys_offset"])
+                data = file.read()
+            for line in data.split(b"\n")[:-1]:
+                if store["keys_read"] >= complete_rows:
+                    break
+                key = line.decode('utf-8').strip()
+                if key:
+                    store["rows"][key] = store["keys_read"]
+                store["keys_read"] += 1
+                store["keys_offset"] += len(line) + 1
+
+        if truncate:
+            if os.path.exists(keys_path) and os.path.getsize(keys_path) > store["keys_offset"]:
+                os.truncate(keys_path, store["keys_offset"])
+            if os.path.exists(vectors_path) and os.path.getsize(vectors_path) > store["keys_read"] * row_size:
+                os.truncate(vectors_path, store["keys_read"] * row_size)
+
+    def _read_row(self, store: Dict, row: int) -> np.ndarray:
+        """Diskdagi qatorni memmap orqali o'qish (fayl o'sganda qayta map qilinadi)"""
+        memmap = store["memmap"]
+        if memmap is None or row >= memmap.shape[0]:
+            vectors_path = os.path.join(store["dir"], "vectors.f32")
+            rows = os.path.getsize(vectors_path) // (store["dim"] * 4)
+            memmap = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, store["dim"]))
+            store["memmap"] = memmap
+        return np.array(memmap[row])
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Keshdan embedding olish (topilmasa None)"""
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+
+            store = self._store(model)
+            row = store["rows"].get(key)
+            if row is not None:
+                try:
+                    vector = self._read_row(store, row)
+                except Exception as e:
+                    logger.error(f"Embedding kesh o'qishda xatolik: {e}")
+                else:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        """Yangi embeddinglarni xotira va diskka yozish"""
+        with self._lock:
+            store = self._store(model)
+            new_keys: List[str] = []
+            new_vectors: List[np.ndarray] = []
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                if key not in store["rows"] and key not in new_keys:
+                    new_keys.append(key)
+                    new_vectors.append(vector)
+
+            if not new_keys:
+                return
+
+            try:
+                os.makedirs(store["dir"], exist_ok=True)
+                # Other worker processes append to the same files
+                with open(os.path.join(store["dir"], "lock"), 'w') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        self._append(model, store, new_keys, new_vectors)
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            except Exception as e:
+                logger.error(f"Embedding keshga yozishda xatolik: {e}")
+
+    def _append(self, model: str, store: Dict, new_keys: List[str], new_vectors: List[np.ndarray]) -> None:
+        """Yangi qatorlarni fayllar oxiriga yozish (katalog qulfi ostida chaqiriladi)"""
+        self._read_new_keys(store, truncate=True)
+        if store["dim"] is None:
+            store["dim"] = int(new_vectors[0].shape[0])
+            with open(os.path.join(store["dir"], "meta.json"), 'w', encoding='utf-8') as file:
+                json.dump({"model": model, "dim": store["dim"]}, file)
+
+        # Keys another process wrote since this one missed them
+        fresh = [(key, vector) for key, vector in zip(new_keys, new_vectors) if key not in store["rows"]]
+        if not fresh:
+            return
+
+        lines = "".join(f"{key}\n" for key, _ in fresh).encode('utf-8')
+        with open(os.path.join(store["dir"], "vectors.f32"), 'ab') as file:
+            np.stack([vector for _, vector in fresh]).astype(np.float32).tofile(file)
+        with open(os.path.join(store["dir"], "keys.txt"), 'ab') as file:
+            file.write(lines)
+
+        first_row = store["keys_read"]
+        for offset, (key, _) in enumerate(fresh):
+            store["rows"][key] = first_row + offset
+        store["keys_read"] += len(fresh)
+        store["keys_offset"] += len(lines)
+
+    async def embed(self, model: str, texts: List[str],
+                    embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+        """
+        Embeddinglarni keshdan olish, faqat topilmaganlarini embed_fn orqali hisoblash
+
+        Args:
+            model: Embedding model (part of the cache key)
+            texts: Texts to embed
+            embed_fn: Async callable embedding a list of texts (called once with the misses)
+
+        Returns:
+            Embeddings in the same order as texts
+        """
+        results: List[Optional[List[float]]] = [self.get(model, text) for text in texts]
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing:
+            fresh = await embed_fn([texts[i] for i in missing])
+            self.put_many(model, [texts[i] for i in missing], fresh)
+            for i, embedding in zip(missing, fresh):
+                results[i] = embedding
+        return results
+
+    def stats(self) -> Dict:
+        """Hit-rate statistikasi"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": sum(len(store["rows"]) for store in self._stores.values())
+        }
+
+
+_base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Shared cache used by both BatchIngestionPipeline and OpenAIRAGService.chat
+embedding_cache = EmbeddingCache(os.path.join(_base_dir, "chroma_db", "embedding_cache"))
@@ -0,0 +1,148 @@
+"""
+Batched embedding ingestion for the books RAG corpus
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from src.broadcast import TokenBucket
+from src.llm_gateway import create_embeddings
+from .chroma_manager import ChromaManager
+from .embedding_cache import EmbeddingCache, embedding_cache
+
+logger = logging.getLogger(__name__)
+
+# Chunks sent in one embeddings request
+EMBEDDING_BATCH_SIZE = 100
+# Embeddings requests in flight at the same time
+EMBEDDING_CONCURRENCY = 3
+# Embeddings requests started per second
+EMBEDDING_REQUESTS_PER_SECOND = 5
+# Attempts per batch before it is reported as failed
+EMBEDDING_MAX_ATTEMPTS = 3
+
+
+@dataclass
+class Chunk:
+    """Bitta chunk: barqaror ID, matn va metadata"""
+    chunk_id: str
+    text: str
+    metadata: Dict
+
+
+@dataclass
+class IngestionResult:
+    """Ingestion natijasi"""
+    total: int = 0
+    embedded: int = 0
+    skipped: int = 0
+    failed_ids: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed_ids
+
+
+class BatchIngestionPipeline:
+    """
+    Chunklarni batch qilib embedding qilish va ChromaDB ga yozish.
+
+    Up to EMBEDDING_BATCH_SIZE chunks go into one embeddings request, a few
+    requests run concurrently under a token-bucket rate limiter, and each
+    batch is upserted with ChromaManager.add_documents. Texts already in the
+    embedding cache are not sent to the API again. Chunk IDs are stable,
+    so chunks already in the collection are skipped and a failed run resumes
+    where it stopped.
+    """
+
+    def __init__(self, chroma_manager: ChromaManager, embedding_model: str, api_key: str = None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, concurrency: int = EMBEDDING_CONCURRENCY,
+                 requests_per_second: float = EMBEDDING_REQUESTS_PER_SECOND,
+                 max_attempts: int = EMBEDDING_MAX_ATTEMPTS, cache: EmbeddingCache = embedding_cache):
+        self.chroma_manager = chroma_manager
+        self.embedding_model = embedding_model
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.cache = cache
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=concurrency)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Keshda topilmagan matnlar uchun embedding olish (retry bilan)"""
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.rate_limiter.acquire()
+            try:
+                return await create_embeddings(
+                    texts,
+                    model=self.embedding_model,
+                    api_key=self.api_key
+                )
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Embedding batch xatolik (attempt {attempt}): {e}. {delay}s dan keyin qayta urinish")
+                await asyncio.sleep(delay)
+
+    async def _process_batch(self, batch: List[Chunk], result: IngestionResult,
+                             on_progress: Optional[Callable[[int, int], None]]) -> None:
+        async with self._semaphore:
+            try:
+                embeddings = await self.cache.embed(
+                    self.embedding_model, [chunk.text for chunk in batch], self._embed_texts
+                )
+                await asyncio.to_thread(
+                    self.chroma_manager.add_documents,
+                    texts=[chunk.text for chunk in batch],
+                    embeddings=embeddings,
+                    metadatas=[chunk.metadata for chunk in batch],
+                    ids=[chunk.chunk_id for chunk in batch]
+                )
+                result.embedded += len(batch)
+            except Exception as e:
+                logger.error(f"Batch ingestion xatolik ({batch[0].chunk_id}..{batch[-1].chunk_id}): {e}")
+                result.failed_ids.extend(chunk.chunk_id for chunk in batch)
+
+            if on_progress:
+                on_progress(result.embedded + result.skipped + len(result.failed_ids), result.total)
+
+    async def ingest(self, chunks: List[Chunk], on_progress: Optional[Callable[[int, int], None]] = None,
+                     skip_existing: bool = True) -> IngestionResult:
+        """
+        Chunklarni ingest qilish
+
+        Args:
+            chunks: Chunks with stable IDs
+            on_progress: Optional callback(done, total) called after every batch
+            skip_existing: Skip chunks whose ID is already in the collection (set False to overwrite changed chunks)
+
+        Returns:
+            IngestionResult; re-running with the same chunks retries only what is missing
+        """
+        result = IngestionResult(total=len(chunks))
+        if not chunks:
+            return result
+
+        pending = chunks
+        if skip_existing:
+            existing = await asyncio.to_thread(
+                self.chroma_manager.get_existing_ids, [chunk.chunk_id for chunk in chunks]
+            )
+            pending = [chunk for chunk in chunks if chunk.chunk_id not in existing]
+            result.skipped = len(chunks) - len(pending)
+            if result.skipped:
+                logger.info(f"{result.skipped} ta chunk allaqachon bazada, o'tkazib yuborildi")
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        await asyncio.gather(*(self._process_batch(batch, result, on_progress) for batch in batches))
+
+        logger.info(
+            f"Ingestion tugadi: {result.embedded} embedded, {result.skipped} skipped, "
+            f"{len(result.failed_ids)} failed / {result.total}"
+        )
+        logger.info(f"Embedding kesh: {self.cache.stats()}")
+        return result
@@ -0,0 +1,77 @@
+"""
+In-memory BM25 keyword index over the books chunks
+"""
+import re
+import math
+import heapq
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Tokens are cut to this many characters: a cheap stemmer for inflected Russian/Uzbek words
+STEM_LENGTH = 6
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Matnni tokenlarga ajratish (kichik harf, qisqa tokenlarsiz)"""
+    return [token[:STEM_LENGTH] for token in _TOKEN.findall(text.casefold()) if len(token) > 1]
+
+
+class BM25Index:
+    """
+    BM25 indeks: token -> [(hujjat, tf)] inverted list.
+
+    Built from the chunk texts already stored in Chroma, so keyword search
+    needs no embedding model. Scoring only touches the posting lists of the
+    query tokens.
+    """
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+
+        for doc_index, document in enumerate(documents):
+            tokens = tokenize(document or "")
+            self.lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self.postings[token].append((doc_index, tf))
+
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.idf = {
+            token: math.log(1 + (len(documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, n_results: int) -> List[int]:
+        """
+        Query uchun eng yaxshi hujjatlar
+
+        Returns:
+            Document positions ordered by descending BM25 score
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for doc_index, tf in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_index] / self.avg_length)
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(n_results, scores, key=scores.get)
@@ -1,6 +1,7 @@
 """
 OpenAI PDF RAG Chatbot - Main application
 """
+import asyncio
 import logging
 import os
 from openai_rag_service import OpenAIRAGService
@@ -13,8 +14,8 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def main():
-    """Main OpenAI PDF RAG chatbot"""
+async def main():
+    """Main OpenAI PDF RAG chatbot (one event loop for the whole session, shared by the LLM clients)"""
     print("🤖 OpenAI PDF RAG Chatbot ishga tushirilmoqda...")
     print("📋 GPT-4o + text-embedding-ada-002 + ChromaDB")
     
@@ -32,7 +33,7 @@ def main():
         
         # Connection tekshirish
         print("🔍 OpenAI connection tekshirilmoqda...")
-        if not rag_service.test_connection():
+        if not await rag_service.test_connection():
             print("❌ OpenAI connection muvaffaqiyatsiz!")
             print("API key va internetni tekshiring.")
             return
@@ -58,7 +59,7 @@ def main():
                 print("\n📁 books/ papkasidagi PDF fayllar processing qilinmoqda...")
                 print("⏳ Bu bir necha daqiqa davom etishi mumkin...")
                 
-                if rag_service.process_books_pdfs():
+                if await rag_service.process_books_pdfs():
                     print("🎉 Barcha PDF fayllar muvaffaqiyatli ChromaDB ga qo'shildi!")
                 else:
                     print("❌ PDF fayllarni processing qilishda xatolik!")
@@ -85,7 +86,7 @@ def main():
                         continue
                     
                     print("🤔 Javob tayyorlanmoqda (GPT-4o)...")
-                    answer = rag_service.chat(question)
+                    answer = await rag_service.chat(question)
                     print(f"\n🤖 Javob:\n{answer}")
             
             elif choice == '3':
@@ -94,6 +95,7 @@ def main():
                 print("\n📊 PDF BAZA STATISTIKASI:")
                 print(f"📄 Jami PDF chunks: {stats['total_pdf_chunks']}")
                 print(f"🔋 Holat: {stats['status']}")
+                print(f"🧠 Embedding kesh: {stats.get('embedding_cache', {})}")
             
             elif choice == '4':
                 # Bazani tozalash
@@ -120,10 +122,11 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 """
 OpenAI PDF RAG Chatbot - Main application
 """
+import asyncio
 import logging
 import os
 from openai_rag_service import OpenAIRAGService
@@ -136,8 +139,8 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def main():
-    """Main OpenAI PDF RAG chatbot"""
+async def main():
+    """Main OpenAI PDF RAG chatbot (one event loop for the whole session, shared by the LLM clients)"""
     print("🤖 OpenAI PDF RAG Chatbot ishga tushirilmoqda...")
     print("📋 GPT-4o + text-embedding-ada-002 + ChromaDB")
     
@@ -155,7 +158,7 @@ def main():
         
         # Connection tekshirish
         print("🔍 OpenAI connection tekshirilmoqda...")
-        if not rag_service.test_connection():
+        if not await rag_service.test_connection():
             print("❌ OpenAI connection muvaffaqiyatsiz!")
             print("API key va internetni tekshiring.")
             return
@@ -181,7 +184,7 @@ def main():
                 print("\n📁 books/ papkasidagi PDF fayllar processing qilinmoqda...")
                 print("⏳ Bu bir necha daqiqa davom etishi mumkin...")
                 
-                if rag_service.process_books_pdfs():
+                if await rag_service.process_books_pdfs():
                     print("🎉 Barcha PDF fayllar muvaffaqiyatli ChromaDB ga qo'shildi!")
                 else:
                     print("❌ PDF fayllarni processing qilishda xatolik!")
@@ -208,7 +211,7 @@ def main():
                         continue
                     
                     print("🤔 Javob tayyorlanmoqda (GPT-4o)...")
-                    answer = rag_service.chat(question)
+                    answer = await rag_service.chat(question)
                     print(f"\n🤖 Javob:\n{answer}")
             
             elif choice == '3':
@@ -217,6 +220,7 @@ def main():
                 print("\n📊 PDF BAZA STATISTIKASI:")
                 print(f"📄 Jami PDF chunks: {stats['total_pdf_chunks']}")
                 print(f"🔋 Holat: {stats['status']}")
+                print(f"🧠 Embedding kesh: {stats.get('embedding_cache', {})}")
             
             elif choice == '4':
                 # Bazani tozalash
@@ -243,4 +247,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Content-hash manifest of the indexed books corpus
+"""
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str) -> str:
+    """Fayl hash ini hisoblash (bo'laklab o'qib)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """Chunk matni hash i"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class BooksManifest:
+    """
+    Indekslangan PDF lar manifesti.
+
+    Stores, per PDF filename, the file hash and the hash of every chunk
+    written to Chroma, so a re-index only embeds new or changed chunks and
+    deletes chunks of removed files. A file hash is recorded only once all
+    its chunks were written, so an interrupted run re-checks that file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Manifestni diskdan o'qish"""
+        if not os.path.exists(self.path):
+            self.files = {}
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.files = json.load(file).get('files', {})
+        except Exception as e:
+            logger.error(f"Manifest o'qishda xatolik, bo'sh manifest ishlatiladi: {e}")
+            self.files = {}
+
+    def save(self) -> None:
+        """Manifestni atomik yozish"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'files': self.files}, file, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Manifestni tozalash (baza tozalanganda)"""
+        self.files = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def file_hash(self, filename: str) -> Optional[str]:
+        return self.files.get(filename, {}).get('file_hash')
+
+    def chunk_hashes(self, filename: str) -> Dict[str, str]:
+        return dict(self.files.get(filename, {}).get('chunks', {}))
+
+    def set_file(self, filename: str, file_hash: Optional[str], chunks: Dict[str, str]) -> None:
+        self.files[filename] = {'file_hash': file_hash, 'chunks': chunks}
+
+    def remove_file(self, filename: str) -> None:
+        self.files.pop(filename, None)
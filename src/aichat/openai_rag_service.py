@@ -1,10 +1,15 @@
 import os
+import asyncio
 import logging
 from typing import List, Dict
-import openai
-    
+
+from src.llm_gateway import get_openai_client, chat_completion, create_embeddings
 from .pdf_processor import PDFProcessor
 from .chroma_manager import ChromaManager
+from .ingestion import BatchIngestionPipeline, Chunk
+from .embedding_cache import embedding_cache
+from .answer_cache import SemanticAnswerCache, answer_cache_opt_outs
+from .manifest import BooksManifest, file_sha256, text_sha256
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +20,7 @@ class OpenAIRAGService:
     def __init__(self, openai_api_key: str):
         """Initialize OpenAI RAG Service"""
         self.openai_api_key = openai_api_key
-        self.client = openai.OpenAI(api_key=openai_api_key)
+        self.client = get_openai_client(openai_api_key)
         
         # Komponenlarni yaratish
         self.pdf_processor = PDFProcessor()
@@ -28,36 +33,49 @@ class OpenAIRAGService:
         self.embedding_model = "text-embedding-ada-002"
         self.llm_model = "gpt-4o"
         
+        # Batch ingestion pipeline
+        self.ingestion = BatchIngestionPipeline(
+            chroma_manager=self.chroma_manager,
+            embedding_model=self.embedding_model,
+            api_key=openai_api_key
+        )
+        
+        # Indekslangan fayl va chunk hashlari
+        self.manifest = BooksManifest(
+            os.path.join(self.chroma_manager.chroma_path, "books_manifest.json")
+        )
+        
+        # O'xshash savollar uchun javob keshi
+        self.answer_cache = SemanticAnswerCache()
+        
         logger.info("OpenAI RAG Service yaratildi")
     
-    def test_connection(self) -> bool:
+    async def test_connection(self) -> bool:
         """OpenAI connection ni tekshirish"""
         try:
             # Test embedding
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input="test"
-            )
+            await create_embeddings(["test"], model=self.embedding_model, api_key=self.openai_api_key)
             logger.info("OpenAI connection muvaffaqiyatli!")
             return True
         except Exception as e:
             logger.error(f"OpenAI connection xatolik: {e}")
             return False
     
-    def _get_openai_embedding(self, text: str) -> List[float]:
-        """OpenAI embedding olish"""
+    async def _get_openai_embedding(self, text: str) -> List[float]:
+        """OpenAI embedding olish (avval keshdan)"""
         try:
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=text.replace("\n", " ")
+            embeddings = await embedding_cache.embed(
+                self.embedding_model,
+                [text],
+                lambda texts: create_embeddings(texts, model=self.embedding_model, api_key=self.openai_api_key)
             )
-            return response.data[0].embedding
+            return embeddings[0]
         except Exception as e:
             logger.error(f"OpenAI embedding xatolik: {e}")
             raise
     
-    def process_books_pdfs(self) -> bool:
-        """books/ papkasidagi PDF fayllarni processing qilish"""
+    async def process_books_pdfs(self) -> bool:
+        """books/ papkasidagi PDF fayllarni inkremental indekslash (faqat yangi/o'zgargan chunklar)"""
         try:
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
             books_dir = os.path.join(base_dir, "books")
@@ -83,16 +101,45 @@ class OpenAIRAGService:
             logger.info(f"{len(pdf_files)} ta PDF fayl topildi")
             print(f"📄 {len(pdf_files)} ta PDF fayl topildi:")
             
-            # Har bir PDF ni processing qilish
+            # O'chirilgan fayllarning chunklarini bazadan olib tashlash
+            current_files = {os.path.basename(pdf_path) for pdf_path in pdf_files}
+            stale_ids: List[str] = []
+            for filename in list(self.manifest.files):
+                if filename not in current_files:
+                    stale_ids.extend(self.manifest.chunk_hashes(filename))
+                    self.manifest.remove_file(filename)
+                    print(f"🗑 {filename} - fayl o'chirilgan, chunklari olib tashlanadi")
+            
+            # Manifestda yo'q chunklar: eski pozitsion ID lar ("<fayl>_chunk_<i>"), manifestsiz
+            # indekslangan yoki keyin o'chirilgan fayllar, to'xtatilgan ishga tushirish qoldiqlari
+            tracked = {chunk_id for filename in self.manifest.files for chunk_id in self.manifest.chunk_hashes(filename)}
+            tracked.update(stale_ids)
+            untracked = [chunk_id for chunk_id in await asyncio.to_thread(self.chroma_manager.get_all_ids)
+                         if chunk_id not in tracked]
+            if untracked:
+                print(f"🗑 {len(untracked)} ta manifestda yo'q chunk olib tashlanadi")
+                stale_ids.extend(untracked)
+            
+            # Yangi yoki o'zgargan fayllarni chunklarga bo'lish (bloklovchi ish - alohida thread da)
+            changed_chunks: List[Chunk] = []
+            file_chunks: Dict[str, Dict[str, str]] = {}
+            file_hashes: Dict[str, str] = {}
             total_processed = 0
             
             for pdf_path in pdf_files:
                 filename = os.path.basename(pdf_path)
-                print(f"⏳ Processing: {filename}...")
                 
                 try:
+                    file_hash = await asyncio.to_thread(file_sha256, pdf_path)
+                    if file_hash == self.manifest.file_hash(filename):
+                        total_processed += 1
+                        print(f"✔️ {filename} - o'zgarmagan")
+                        continue
+                    
+                    print(f"⏳ Processing: {filename}...")
+                    
                     # PDF dan text ajratish
-                    text = self.pdf_processor.extract_text_from_pdf(pdf_path)
+                    text = await asyncio.to_thread(self.pdf_processor.extract_text_from_pdf, pdf_path)
                     
                     if not text or len(text.strip()) < 50:
                         print(f"⚠️ {filename} - kam text yoki bo'sh fayl")
@@ -105,49 +152,80 @@ class OpenAIRAGService:
                         print(f"⚠️ {filename} - chunking muvaffaqiyatsiz")
                         continue
                     
-                    # Har bir chunk uchun embedding va ChromaDB ga qo'shish
-                    for i, chunk in enumerate(chunks):
+                    old_hashes = self.manifest.chunk_hashes(filename)
+                    new_hashes: Dict[str, str] = {}
+                    for chunk in chunks:
                         if len(chunk.strip()) < 20:  # Juda kichik chunkni tashlab yuborish
                             continue
                         
-                        try:
-                            # OpenAI embedding
-                            embedding = self._get_openai_embedding(chunk)
-                            
-                            # ChromaDB ga qo'shish
-                            chunk_id = f"{filename}_chunk_{i}"
-                            metadata = {
+                        # ID chunk matnidan: matn qo'shilsa yoki o'chirilsa, faqat o'zgargan chunklar qayta yoziladi
+                        chunk_hash = text_sha256(chunk)
+                        chunk_id = f"{filename}_{chunk_hash[:16]}"
+                        repeat = 1
+                        while chunk_id in new_hashes:  # Fayl ichida bir xil matnli chunklar
+                            chunk_id = f"{filename}_{chunk_hash[:16]}_{repeat}"
+                            repeat += 1
+                        new_hashes[chunk_id] = chunk_hash
+                        if old_hashes.get(chunk_id) == chunk_hash:
+                            continue
+                        
+                        changed_chunks.append(Chunk(
+                            chunk_id=chunk_id,
+                            text=chunk,
+                            metadata={
                                 "filename": filename,
-                                "chunk_index": i,
-                                "total_chunks": len(chunks),
-                                "file_path": pdf_path
+                                "file_path": pdf_path,
+                                "chunk_hash": chunk_hash
                             }
-                            
-                            self.chroma_manager.add_document(
-                                doc_id=chunk_id,
-                                text=chunk,
-                                embedding=embedding,
-                                metadata=metadata
-                            )
-                            
-                        except Exception as e:
-                            logger.error(f"Chunk embedding xatolik ({filename}): {e}")
-                            continue
+                        ))
                     
-                    total_processed += 1
-                    print(f"✅ {filename} - {len(chunks)} chunks qo'shildi")
+                    stale_ids.extend(chunk_id for chunk_id in old_hashes if chunk_id not in new_hashes)
+                    file_chunks[filename] = new_hashes
+                    file_hashes[filename] = file_hash
                     
                 except Exception as e:
                     logger.error(f"PDF processing xatolik ({filename}): {e}")
                     print(f"❌ {filename} - processing xatolik: {str(e)[:100]}")
                     continue
             
-            if total_processed > 0:
+            if stale_ids:
+                await asyncio.to_thread(self.chroma_manager.delete_documents, stale_ids)
+            
+            # Faqat yangi/o'zgargan chunklar uchun batch embedding + ChromaDB ga yozish
+            def report_progress(done: int, total: int):
+                print(f"📈 Embedding: {done}/{total} chunks")
+            
+            result = await self.ingestion.ingest(changed_chunks, on_progress=report_progress, skip_existing=False)
+            
+            # Manifestni yangilash: xatolik bo'lgan chunklar keyingi safar qayta urinib ko'riladi
+            failed = set(result.failed_ids)
+            for filename, new_hashes in file_chunks.items():
+                written = {chunk_id: chunk_hash for chunk_id, chunk_hash in new_hashes.items() if chunk_id not in failed}
+                failed_count = len(new_hashes) - len(written)
+                if failed_count:
+                    self.manifest.set_file(filename, None, written)
+                    print(f"❌ {filename} - {failed_count} chunks xatolik (qayta ishga tushirilsa davom etadi)")
+                else:
+                    self.manifest.set_file(filename, file_hashes[filename], written)
+                    total_processed += 1
+                    print(f"✅ {filename} - {len(new_hashes)} chunks indekslandi")
+            self.manifest.save()
+            
+            # Chunklar o'zgargan bo'lsa, eski javoblar endi mos emas
+            if result.embedded or stale_ids:
+                self.answer_cache.clear()
+            
+            logger.info(
+                f"Inkremental indekslash: {result.embedded} chunk embedding, {len(stale_ids)} chunk o'chirildi, "
+                f"{len(result.failed_ids)} xatolik"
+            )
+            
+            if total_processed > 0 and result.ok:
                 logger.info(f"{total_processed} ta PDF muvaffaqiyatli processing qilindi")
-                print(f"\n🎉 {total_processed}/{len(pdf_files)} ta PDF muvaffaqiyatli qo'shildi!")
+                print(f"\n🎉 {total_processed}/{len(pdf_files)} ta PDF indekslangan ({result.embedded} ta yangi chunk)!")
                 return True
             else:
-                logger.warning("Hech qanday PDF processing qilinmadi")
+                logger.warning(f"PDF processing to'liq emas: {len(result.failed_ids)} chunk xatolik")
                 return False
                 
         except Exception as e:
@@ -155,14 +233,15 @@ class OpenAIRAGService:
             print(f"❌ PDF processing xatolik: {e}")
             return False
     
-    def chat(self, question: str) -> str:
-        """Chat funksiyasi - hybrid qidiruv bilan"""
+    async def chat(self, question: str, telegram_id: int = None) -> str:
+        """Chat funksiyasi - hybrid qidiruv bilan (o'xshash savollarga keshlangan javob)"""
         try:
             # Question ni embedding qilish
-            question_embedding = self._get_openai_embedding(question)
+            question_embedding = await self._get_openai_embedding(question)
             
             # ChromaDB dan relevant chunklar qidirish (hybrid search)
-            search_results = self.chroma_manager.hybrid_search(
+            search_results = await asyncio.to_thread(
+                self.chroma_manager.hybrid_search,
                 query_text=question,
                 query_embedding=question_embedding,
                 n_results=5
@@ -171,6 +250,14 @@ class OpenAIRAGService:
             if not search_results or not search_results.get('documents'):
                 return "❌ Savolingizga mos hujjatlar topilmadi. Iltimos, boshqa savol bering yoki avval PDF fayllarni yuklashni tekshiring."
             
+            # Semantik javob keshi (foydalanuvchi voz kechmagan bo'lsa)
+            use_cache = telegram_id is None or not answer_cache_opt_outs.is_opted_out(telegram_id)
+            context_ids = (search_results.get('ids') or [[]])[0]
+            if use_cache and context_ids:
+                cached_answer = self.answer_cache.get(question_embedding, context_ids)
+                if cached_answer:
+                    return cached_answer
+            
             # Context tayyorlash
             contexts = []
             for i, doc in enumerate(search_results['documents'][0]):
@@ -218,16 +305,16 @@ class OpenAIRAGService:
 ОТВЕТ:"""
 
             # OpenAI GPT-4o ga so'rov
-            response = self.client.chat.completions.create(
+            answer = await chat_completion(
+                [{"role": "user", "content": prompt}],
                 model=self.llm_model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
+                api_key=self.openai_api_key,
                 max_tokens=500,
                 temperature=0.7
             )
             
-            answer = response.choices[0].message.content.strip()
+            if use_cache and context_ids and answer:
+                self.answer_cache.put(question_embedding, context_ids, answer)
             
             # Qo'shimcha ma'lumot
             # source_files = set()
@@ -250,7 +337,9 @@ class OpenAIRAGService:
             count = self.chroma_manager.get_count()
             return {
                 "total_pdf_chunks": count,
-                "status": "Faol" if count > 0 else "Bo'sh"
+                "status": "Faol" if count > 0 else "Bo'sh",
+                "embedding_cache": embedding_cache.stats(),
+                "answer_cache": self.answer_cache.stats()
             }
         except Exception as e:
             logger.error(f"Database stats xatolik: {e}")
@@ -259,6 +348,8 @@ class OpenAIRAGService:
     def clear_database(self) -> bool:
         """ChromaDB ni tozalash"""
         try:
+            self.manifest.clear()
+            self.answer_cache.clear()
             return self.chroma_manager.clear_collection()
         except Exception as e:
             logger.error(f"Database clear xatolik: {e}")
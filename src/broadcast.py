@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Broadcast Sender for PsyBot
+Concurrent, rate-limit-aware delivery of scheduled messages
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about 1 per second per chat
+GLOBAL_RATE_LIMIT = 30
+PER_CHAT_INTERVAL = 1.0
+MAX_CONCURRENT_SENDS = 20
+MAX_RETRIES = 3
+
+class TokenBucket:
+    """Token bucket limiting how many sends can start per second"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after Telegram asked us to back off"""
+        self._refill()
+        self.tokens = 0
+
+class BroadcastMetrics:
+    """Per-tick delivery counters"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.blocked = 0
+        self.started_at = time.monotonic()
+
+    def as_dict(self) -> Dict[str, float]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'blocked': self.blocked,
+            'elapsed': round(elapsed, 2),
+            'per_second': round(self.sent / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+class BroadcastSender:
+    """
+    Sends messages concurrently while respecting Telegram's limits.
+
+    A semaphore caps in-flight requests, a token bucket keeps the global
+    rate under GLOBAL_RATE_LIMIT and messages to the same chat are spaced
+    by PER_CHAT_INTERVAL. Flood errors (retry-after) pause all sends for
+    the requested time and the message is retried.
+    """
+
+    def __init__(self, bot: Bot, rate: float = GLOBAL_RATE_LIMIT, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 concurrency: int = MAX_CONCURRENT_SENDS, max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.metrics = BroadcastMetrics()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next_send: Dict[int, float] = {}
+        self._paused_until = 0.0
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        """Reserve the next send slot for a chat and wait for it"""
+        now = time.monotonic()
+        slot = max(now, self._chat_next_send.get(chat_id, 0.0))
+        self._chat_next_send[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _wait_for_flood_pause(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        """
+        Send a message through the rate limiter
+
+        Args:
+            chat_id: Telegram chat ID
+            text: Message text
+            **kwargs: Extra arguments for Bot.send_message (e.g. reply_markup)
+
+        Returns:
+            The sent Message
+
+        Raises:
+            TelegramForbiddenError if the user blocked the bot, or the last error once retries are exhausted
+        """
+        await self._wait_for_chat(chat_id)
+
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self._wait_for_flood_pause()
+                await self.bucket.acquire()
+                try:
+                    message = await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    self.metrics.sent += 1
+                    return message
+                except TelegramRetryAfter as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        self.metrics.failed += 1
+                        raise
+                    self.metrics.retried += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                    self.bucket.drain()
+                    logger.warning(f"Flood control for chat {chat_id}: retrying in {e.retry_after}s (attempt {attempt})")
+                except TelegramForbiddenError:
+                    self.metrics.blocked += 1
+                    raise
+                except Exception:
+                    self.metrics.failed += 1
+                    raise
+
+    def start_tick(self) -> None:
+        """Reset per-tick metrics and forget per-chat slots that already passed"""
+        now = time.monotonic()
+        self._chat_next_send = {
+            chat_id: slot for chat_id, slot in self._chat_next_send.items() if slot > now
+        }
+        self.metrics.reset()
+
+    def log_metrics(self, label: str) -> None:
+        """Log throughput of the current tick if anything was attempted"""
+        stats = self.metrics.as_dict()
+        if stats['sent'] or stats['failed'] or stats['blocked']:
+            logger.info(
+                f"{label}: sent={stats['sent']} failed={stats['failed']} blocked={stats['blocked']} "
+                f"retried={stats['retried']} in {stats['elapsed']}s ({stats['per_second']} msg/s)"
+            )
@@ -0,0 +1,103 @@
+"""
+Async database access for aiogram handlers
+
+Built on SQLAlchemy's asyncio extension (aiosqlite for the default SQLite
+database), so DB round-trips no longer block the event loop. Sessions are
+task-scoped: nested `async with db_session()` blocks in the same handler
+task share one session, and concurrent handler tasks never do.
+"""
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from src.database.models import (
+    User, get_database_url, apply_sqlite_pragmas,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, SQLITE_PRAGMAS
+)
+
+logger = logging.getLogger(__name__)
+
+# Async drivers used for each sync backend of DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def get_async_database_url(database_url: str = None) -> str:
+    """Same database as get_engine(), addressed through its async driver"""
+    url = make_url(database_url or get_database_url())
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and url.drivername != ASYNC_DRIVERS[backend]:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+def get_async_engine(database_url: str = None) -> AsyncEngine:
+    """Create the async engine with the same connection profile as get_engine()"""
+    url = make_url(get_async_database_url(database_url))
+
+    if url.get_backend_name() == "sqlite":
+        engine = create_async_engine(
+            url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000},
+        )
+        event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+        return engine
+
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+async_engine = get_async_engine()
+# expire_on_commit=False: handlers keep reading attributes after commit without lazy IO
+AsyncSessionFactory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("current_async_session", default=None)
+
+@asynccontextmanager
+async def db_session() -> AsyncIterator[AsyncSession]:
+    """
+    Task-scoped async session
+
+    The outermost block opens the session and closes it on exit, rolling back
+    on error; inner blocks in the same task reuse it. Commits stay explicit:
+    `await session.commit()`.
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session
+        return
+
+    session = AsyncSessionFactory()
+    token = _current_session.set(session)
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        _current_session.reset(token)
+        await session.close()
+
+async def get_user_by_telegram_id(session: AsyncSession, telegram_id: int) -> Optional[User]:
+    """Load a user by Telegram ID"""
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    return result.scalars().first()
+
+async def dispose_async_engine() -> None:
+    """Close pooled connections on shutdown"""
+    await async_engine.dispose()
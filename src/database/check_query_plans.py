@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN-based check of the hot per-user time-range queries
+
+Runs EXPLAIN QUERY PLAN for the queries used by emotion analysis, therapy
+themes, the thought diary and the notification scheduler, and fails if any
+of them scans a table or sorts in a temp b-tree instead of using its
+composite index.
+
+By default the check runs on a scratch SQLite database seeded with
+synthetic rows and ANALYZEd, so the planner sees a large table; pass
+--database to check the real bot database instead.
+
+Usage:
+    python -m src.database.check_query_plans [--rows 200000] [--database]
+"""
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from src.database.models import (
+    Base, EmotionEntry, ReflectionEntry, TherapySession, WeeklyReflection, TherapyTheme, get_engine
+)
+
+def hot_queries(session):
+    """(name, query, expected index) for every per-user time-range access path"""
+    user_id = 42
+    now = datetime(2026, 1, 1)
+    start, end = now - timedelta(days=30), now
+    return [
+        ("emotion_analysis period entries",
+         session.query(EmotionEntry).filter(
+             EmotionEntry.user_id == user_id,
+             EmotionEntry.created_at >= start,
+             EmotionEntry.created_at <= end
+         ).order_by(EmotionEntry.created_at.desc()),
+         "ix_emotion_entries_user_created"),
+        ("thought_diary latest entry",
+         session.query(EmotionEntry).filter(EmotionEntry.user_id == user_id).order_by(EmotionEntry.created_at.desc()).limit(1),
+         "ix_emotion_entries_user_created"),
+        ("emotion_analysis entry count",
+         session.query(EmotionEntry.id).filter(EmotionEntry.user_id == user_id),
+         "ix_emotion_entries_user_created"),
+        ("therapy_themes period themes",
+         session.query(TherapyTheme).filter(
+             TherapyTheme.user_id == user_id,
+             TherapyTheme.created_at >= start
+         ).order_by(TherapyTheme.created_at.desc()),
+         "ix_therapy_themes_user_created"),
+        ("weekly reflections period",
+         session.query(WeeklyReflection).filter(
+             WeeklyReflection.user_id == user_id,
+             WeeklyReflection.created_at >= start,
+             WeeklyReflection.created_at <= end
+         ).order_by(WeeklyReflection.created_at.desc()),
+         "ix_weekly_reflections_user_created"),
+        ("reflection entries period",
+         session.query(ReflectionEntry).filter(
+             ReflectionEntry.user_id == user_id,
+             ReflectionEntry.created_at >= start
+         ).order_by(ReflectionEntry.created_at.desc()),
+         "ix_reflection_entries_user_created"),
+        ("scheduler pending reflections",
+         session.query(TherapySession).filter(
+             TherapySession.reflection_datetime <= now,
+             TherapySession.reflection_sent == False
+         ),
+         "ix_therapy_sessions_pending_reflection"),
+    ]
+
+def explain(connection, query):
+    sql = str(query.statement.compile(connection.engine, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+def check_plan(details, expected_index):
+    """Return a problem description or None if the plan uses the expected index"""
+    if not any(f"INDEX {expected_index}" in detail for detail in details):
+        return f"does not use {expected_index}"
+    for detail in details:
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            return f"full table scan ({detail})"
+        if "TEMP B-TREE" in detail:
+            return f"sorts in a temp b-tree ({detail})"
+    return None
+
+def seed(engine, rows: int):
+    """Fill the scratch database with synthetic rows spread over many users"""
+    users = max(rows // 200, 1)
+    base = datetime(2025, 1, 1)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(EmotionEntry.__table__.insert(), [
+            {"user_id": rng.randrange(users), "emotion_type": "positive",
+             "created_at": base + timedelta(minutes=rng.randrange(525600))}
+            for _ in range(rows)
+        ])
+        small = max(rows // 10, 1)
+        for model in (TherapyTheme, WeeklyReflection, ReflectionEntry):
+            extra = {"original_text": "-"} if model is TherapyTheme else {}
+            connection.execute(model.__table__.insert(), [
+                {"user_id": rng.randrange(users), "created_at": base + timedelta(minutes=rng.randrange(525600)), **extra}
+                for _ in range(small)
+            ])
+        connection.execute(TherapySession.__table__.insert(), [
+            {"user_id": rng.randrange(users), "session_datetime": base, "reflection_sent": rng.random() < 0.99,
+             "reflection_datetime": base + timedelta(minutes=rng.randrange(525600))}
+            for _ in range(small)
+        ])
+        connection.execute(text("ANALYZE"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check query plans of per-user time-range queries")
+    parser.add_argument("--rows", type=int, default=200000, help="Synthetic emotion entries in the scratch database")
+    parser.add_argument("--database", action="store_true", help="Check the real bot database instead")
+    args = parser.parse_args()
+
+    if args.database:
+        engine = get_engine()
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "query_plans.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        print(f"Seeding scratch database with {args.rows} emotion entries...")
+        seed(engine, args.rows)
+
+    session = sessionmaker(bind=engine)()
+    failures = 0
+    try:
+        with engine.connect() as connection:
+            for name, query, expected_index in hot_queries(session):
+                details = explain(connection, query)
+                problem = check_plan(details, expected_index)
+                status = "❌" if problem else "✅"
+                print(f"{status} {name}: {' | '.join(details)}")
+                if problem:
+                    print(f"   -> {problem}")
+                    failures += 1
+    finally:
+        session.close()
+
+    if failures:
+        print(f"\n{failures} queries are not on index scans (run `alembic upgrade head`)")
+        sys.exit(1)
+    print("\nAll hot queries use their composite indexes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Composite indexes for per-user time-range queries
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+
+Databases created before this revision were built with init_db()
+(Base.metadata.create_all) and have no alembic_version table; this is the
+first revision, so `alembic upgrade head` applies to them directly. New
+databases already get these indexes from the models, hence if_not_exists.
+"""
+from alembic import op
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_emotion_entries_user_created', 'emotion_entries', ['user_id', 'created_at']),
+    ('ix_reflection_entries_user_created', 'reflection_entries', ['user_id', 'created_at']),
+    ('ix_weekly_reflections_user_created', 'weekly_reflections', ['user_id', 'created_at']),
+    ('ix_therapy_themes_user_created', 'therapy_themes', ['user_id', 'created_at']),
+    ('ix_therapy_sessions_pending_reflection', 'therapy_sessions', ['reflection_sent', 'reflection_datetime']),
+]
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+    # Refresh planner statistics so SQLite picks the new indexes right away
+    op.execute('ANALYZE')
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,30 @@
+"""Scheduler lease table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+
+Lets exactly one scheduler instance send each partition of notifications.
+The scheduler also creates the table on startup (checkfirst), so the
+migration skips it when it already exists.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('scheduler_leases'):
+        return
+    op.create_table(
+        'scheduler_leases',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('holder', sa.String(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table('scheduler_leases')
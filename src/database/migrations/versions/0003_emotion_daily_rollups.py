@@ -0,0 +1,54 @@
+"""Daily emotion rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16
+
+Per-user daily counts of emotion entries used by the emotion analytics.
+The table is (re)filled from emotion_entries here; afterwards ORM events
+in src/emotion_rollup.py keep it current.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('emotion_daily_rollups'):
+        op.create_table(
+            'emotion_daily_rollups',
+            sa.Column('user_id', sa.Integer(), primary_key=True),
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('emotion_type', sa.String(), primary_key=True),
+            sa.Column('state', sa.String(), primary_key=True),
+            sa.Column('option', sa.String(), primary_key=True),
+            sa.Column('count', sa.Integer(), nullable=False),
+        )
+
+    entries = sa.table(
+        'emotion_entries',
+        sa.column('user_id'), sa.column('created_at'), sa.column('emotion_type'),
+        sa.column('state'), sa.column('option'),
+    )
+    rollups = sa.table(
+        'emotion_daily_rollups',
+        sa.column('user_id'), sa.column('day'), sa.column('emotion_type'),
+        sa.column('state'), sa.column('option'), sa.column('count'),
+    )
+    day = sa.func.date(entries.c.created_at) if bind.dialect.name == 'sqlite' else sa.cast(entries.c.created_at, sa.Date)
+    state = sa.func.coalesce(entries.c.state, '')
+    option = sa.func.coalesce(entries.c.option, '')
+    op.execute(rollups.delete())
+    op.execute(rollups.insert().from_select(
+        ['user_id', 'day', 'emotion_type', 'state', 'option', 'count'],
+        sa.select(entries.c.user_id, day, entries.c.emotion_type, state, option, sa.func.count())
+        .where(entries.c.created_at.isnot(None))
+        .group_by(entries.c.user_id, day, entries.c.emotion_type, state, option)
+    ))
+
+def downgrade():
+    op.drop_table('emotion_daily_rollups')
@@ -0,0 +1,39 @@
+"""Notification ledger and answer cache opt-out tables
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16
+
+notification_ledger records the notification slots already sent to each
+user per local day, so a restarted scheduler does not send them again.
+answer_cache_opt_outs lists the users who do not want shared cached AI
+answers. Both are also created on first use (checkfirst), so the migration
+skips a table that already exists.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('notification_ledger'):
+        op.create_table(
+            'notification_ledger',
+            sa.Column('user_id', sa.Integer(), primary_key=True),
+            sa.Column('day', sa.Integer(), primary_key=True),
+            sa.Column('sent_slots', sa.Integer(), nullable=False),
+        )
+    if not inspector.has_table('answer_cache_opt_outs'):
+        op.create_table(
+            'answer_cache_opt_outs',
+            sa.Column('telegram_id', sa.Integer(), primary_key=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+        )
+
+def downgrade():
+    op.drop_table('answer_cache_opt_outs')
+    op.drop_table('notification_ledger')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, create_engine, Text
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, create_engine, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import os
@@ -71,6 +71,7 @@ class AdminSession(Base):
 
 class EmotionEntry(Base):
     __tablename__ = 'emotion_entries'
+    __table_args__ = (Index('ix_emotion_entries_user_created', 'user_id', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -83,8 +84,22 @@ class EmotionEntry(Base):
     def __repr__(self):
         return f"<EmotionEntry(user_id={self.user_id}, emotion_type={self.emotion_type}, created_at={self.created_at})>"
 
+class EmotionDailyRollup(Base):
+    __tablename__ = 'emotion_daily_rollups'
+
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)                    # Date of EmotionEntry.created_at
+    emotion_type = Column(String, primary_key=True)
+    state = Column(String, primary_key=True, default='')    # '' for entries without a state
+    option = Column(String, primary_key=True, default='')   # '' for entries without an option
+    count = Column(Integer, nullable=False, default=0)      # Emotion entries with this key
+
+    def __repr__(self):
+        return f"<EmotionDailyRollup(user_id={self.user_id}, day={self.day}, state={self.state}, count={self.count})>"
+
 class ReflectionEntry(Base):
     __tablename__ = 'reflection_entries'
+    __table_args__ = (Index('ix_reflection_entries_user_created', 'user_id', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -100,6 +115,7 @@ class ReflectionEntry(Base):
 
 class TherapySession(Base):
     __tablename__ = 'therapy_sessions'
+    __table_args__ = (Index('ix_therapy_sessions_pending_reflection', 'reflection_sent', 'reflection_datetime'),)  # Scheduler scan of due reflections
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -113,6 +129,7 @@ class TherapySession(Base):
 
 class WeeklyReflection(Base):
     __tablename__ = 'weekly_reflections'
+    __table_args__ = (Index('ix_weekly_reflections_user_created', 'user_id', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -129,6 +146,7 @@ class WeeklyReflection(Base):
 
 class TherapyTheme(Base):
     __tablename__ = 'therapy_themes'
+    __table_args__ = (Index('ix_therapy_themes_user_created', 'user_id', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -158,13 +176,118 @@ class RelaxationMedia(Base):
     def __repr__(self):
         return f"<RelaxationMedia(title={self.title}, media_type={self.media_type}, is_active={self.is_active})>"
 
+class NotificationLedger(Base):
+    __tablename__ = 'notification_ledger'
+
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Integer, primary_key=True)                 # User's local date as date.toordinal()
+    sent_slots = Column(Integer, default=0, nullable=False)  # Bitmap of notification slots already sent that day
+
+    def __repr__(self):
+        return f"<NotificationLedger(user_id={self.user_id}, day={self.day}, sent_slots={self.sent_slots:#x})>"
+
+class AnswerCacheOptOut(Base):
+    __tablename__ = 'answer_cache_opt_outs'
+
+    telegram_id = Column(Integer, primary_key=True)  # User who opted out of shared cached AI answers
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<AnswerCacheOptOut(telegram_id={self.telegram_id})>"
+
+class SchedulerLease(Base):
+    __tablename__ = 'scheduler_leases'
+
+    name = Column(String, primary_key=True)                # Leased job partition, e.g. "notifications:0/2"
+    holder = Column(String, nullable=False)                # host:pid:token of the scheduler instance holding it
+    expires_at = Column(DateTime, nullable=False)          # Other instances may take over after this time
+
+    def __repr__(self):
+        return f"<SchedulerLease(name={self.name}, holder={self.holder}, expires_at={self.expires_at})>"
+
 # Initialize database connection
+import logging
 from pathlib import Path
-def get_engine():
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# SQLite connection profile (applied to every pooled connection)
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),       # Readers no longer block the writer
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),      # Safe with WAL, fsync only at checkpoints
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),  # Wait for the write lock instead of "database is locked"
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),   # Negative value = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Connection pool sizing
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+def get_database_url():
+    """DATABASE_URL from the environment, otherwise the bundled SQLite file"""
     default_path = Path(__file__).parent / "../database/psybot.db"
-    abs_path = default_path.resolve()
-    database_url = f"sqlite:///{abs_path}"
-    return create_engine(database_url)
+    default_url = f"sqlite:///{default_path.resolve()}"
+
+    database_url = os.getenv("DATABASE_URL", "").strip()
+    if not database_url:
+        return default_url
+
+    # .env files copied from the old example carry DATABASE_URL=sqlite:///database/psybot.db,
+    # which used to be ignored. A relative SQLite path would open (or fail to open) a file
+    # relative to the working directory instead of the users' data, so keep the bundled file.
+    url = make_url(database_url)
+    if (url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+            and not url.database.startswith("file:") and not os.path.isabs(url.database)):
+        logging.getLogger(__name__).warning(
+            f"Ignoring relative SQLite DATABASE_URL {database_url!r}, using {default_url}; "
+            f"set an absolute path (sqlite:////path/to/psybot.db) to use another file"
+        )
+        return default_url
+    return database_url
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+def get_engine(database_url=None):
+    """
+    Create the engine with the production connection profile
+
+    SQLite gets WAL journaling and the SQLITE_PRAGMAS on every connection;
+    any other DATABASE_URL (e.g. PostgreSQL) gets a pre-pinged, recycled pool.
+    Pool sizes come from the DB_POOL_* environment variables.
+    """
+    url = make_url(database_url or get_database_url())
+
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return create_engine(url)
+        engine = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000},
+        )
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
 
 def init_db():
     engine = get_engine()
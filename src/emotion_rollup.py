@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Emotion Rollups for PsyBot
+Daily per-user emotion counts maintained as entries are written
+
+Rollup days are server dates of created_at, so they only select the
+period; anything per local day comes from src/emotion_timeseries.py.
+"""
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import and_, event, func, inspect, select
+from src.database.models import EmotionEntry, EmotionDailyRollup
+from src.database.session import engine, get_session, close_session
+
+logger = logging.getLogger(__name__)
+
+RollupKey = Tuple[int, date, str, str, str]  # (user_id, day, emotion_type, state, option)
+
+@dataclass
+class EmotionSummary:
+    """Emotion counts of one user over a range of days"""
+    total: int = 0
+    by_type: Counter = field(default_factory=Counter)                  # emotion_type -> count
+    by_state: Counter = field(default_factory=Counter)                 # state -> count
+    by_type_state: Dict[str, Counter] = field(default_factory=dict)    # emotion_type -> state -> count
+    by_option: Counter = field(default_factory=Counter)                # (state, option) -> count
+
+    @property
+    def positive(self) -> int:
+        return self.by_type["positive"]
+
+    @property
+    def negative(self) -> int:
+        return self.by_type["negative"]
+
+    def states_of(self, emotion_type: str) -> Counter:
+        """State counts of one emotion type"""
+        return self.by_type_state.get(emotion_type, Counter())
+
+    def add(self, emotion_type: str, state: str, option: str, count: int) -> None:
+        self.total += count
+        self.by_type[emotion_type] += count
+        if state:
+            self.by_state[state] += count
+            self.by_type_state.setdefault(emotion_type, Counter())[state] += count
+            if option:
+                self.by_option[(state, option)] += count
+
+def _entry_key(connection, entry_id: int) -> Optional[RollupKey]:
+    """Rollup key of a stored entry (created_at may only be known to the database)"""
+    row = connection.execute(
+        select(EmotionEntry.user_id, EmotionEntry.created_at, EmotionEntry.emotion_type,
+               EmotionEntry.state, EmotionEntry.option).where(EmotionEntry.id == entry_id)
+    ).first()
+    if row is None or row.created_at is None:
+        return None
+    return row.user_id, row.created_at.date(), row.emotion_type, row.state or '', row.option or ''
+
+def _apply(connection, key: RollupKey, delta: int) -> None:
+    """Add delta to a rollup row in the caller's transaction"""
+    table = EmotionDailyRollup.__table__
+    user_id, day, emotion_type, state, option = key
+    match = and_(
+        table.c.user_id == user_id, table.c.day == day, table.c.emotion_type == emotion_type,
+        table.c.state == state, table.c.option == option
+    )
+    updated = connection.execute(table.update().where(match).values(count=table.c.count + delta)).rowcount
+    if not updated and delta > 0:
+        connection.execute(table.insert().values(
+            user_id=user_id, day=day, emotion_type=emotion_type, state=state, option=option, count=delta
+        ))
+    elif delta < 0:
+        connection.execute(table.delete().where(match, table.c.count <= 0))
+
+@event.listens_for(EmotionEntry, "after_insert")
+def _count_inserted_entry(mapper, connection, target):
+    key = _entry_key(connection, target.id)
+    if key is not None:
+        _apply(connection, key, 1)
+
+@event.listens_for(EmotionEntry, "before_delete")
+def _uncount_deleted_entry(mapper, connection, target):
+    key = _entry_key(connection, target.id)
+    if key is not None:
+        _apply(connection, key, -1)
+
+def rebuild_emotion_rollups(user_id: int = None) -> int:
+    """
+    Recount rollups from the raw entries
+
+    Needed after bulk query.delete()/update() on emotion_entries, which
+    bypass the ORM events that keep the rollups current.
+
+    Args:
+        user_id: Only rebuild this user's rollups (None for all users)
+
+    Returns:
+        Number of rollup rows written
+    """
+    # The synthetic data scripts may run before the bot created the table
+    EmotionDailyRollup.__table__.create(engine, checkfirst=True)
+    session = get_session()
+    try:
+        query = session.query(EmotionEntry.user_id, EmotionEntry.created_at, EmotionEntry.emotion_type,
+                              EmotionEntry.state, EmotionEntry.option)
+        stale = session.query(EmotionDailyRollup)
+        if user_id is not None:
+            query = query.filter(EmotionEntry.user_id == user_id)
+            stale = stale.filter(EmotionDailyRollup.user_id == user_id)
+
+        counts = Counter(
+            (row.user_id, row.created_at.date(), row.emotion_type, row.state or '', row.option or '')
+            for row in query.yield_per(5000) if row.created_at is not None
+        )
+        stale.delete(synchronize_session=False)
+        if counts:
+            session.execute(EmotionDailyRollup.__table__.insert(), [
+                {"user_id": uid, "day": day, "emotion_type": etype, "state": state, "option": option, "count": count}
+                for (uid, day, etype, state, option), count in counts.items()
+            ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        close_session(session)
+
+    logger.info(f"Rebuilt {len(counts)} emotion rollup rows" + (f" for user {user_id}" if user_id else ""))
+    return len(counts)
+
+def summarize(rows: Iterable[EmotionDailyRollup]) -> EmotionSummary:
+    summary = EmotionSummary()
+    for row in rows:
+        summary.add(row.emotion_type, row.state, row.option, row.count)
+    return summary
+
+def get_emotion_summary(session, user_id: int, start_day: date, end_day: date) -> EmotionSummary:
+    """
+    Emotion counts of a user between two days (inclusive) from the rollups
+
+    Args:
+        session: Sync database session
+        user_id: Internal user ID
+        start_day: First day of the period
+        end_day: Last day of the period
+    """
+    rows = session.query(EmotionDailyRollup).filter(
+        EmotionDailyRollup.user_id == user_id,
+        EmotionDailyRollup.day >= start_day,
+        EmotionDailyRollup.day <= end_day
+    ).all()
+    return summarize(rows)
+
+def count_emotion_entries(session, user_id: int) -> int:
+    """Total number of a user's emotion entries"""
+    total = session.query(func.sum(EmotionDailyRollup.count)).filter(EmotionDailyRollup.user_id == user_id).scalar()
+    return total or 0
+
+def ensure_rollup_table() -> None:
+    """
+    Create and fill the rollup table of a database not migrated yet
+
+    Called once at bot startup, before entries are written; migration
+    0003 does the same for `alembic upgrade head`.
+    """
+    if inspect(engine).has_table(EmotionDailyRollup.__tablename__):
+        return
+    EmotionDailyRollup.__table__.create(engine, checkfirst=True)
+    if inspect(engine).has_table(EmotionEntry.__tablename__):
+        rebuild_emotion_rollups()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Emotion Time Series for PsyBot
+Per-day emotion arrays with rolling averages, valence trend, logging streaks and hour-of-day heatmap
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+import numpy as np
+from src.database.models import EmotionEntry
+from src.timezone_utils import SERVER_UTC_OFFSET
+
+logger = logging.getLogger(__name__)
+
+# Days averaged by the trend chart's rolling lines
+ROLLING_WINDOW_DAYS = 7
+
+# numpy counts days from 1970-01-01, a Thursday
+_EPOCH_WEEKDAY = 3
+
+@dataclass
+class EmotionSeries:
+    """Emotion entries of one user binned by local day, plus their weekday and hour distribution"""
+    start_day: date
+    positive: np.ndarray        # positive entries per day from start_day
+    negative: np.ndarray        # negative entries per day from start_day
+    hour_heatmap: np.ndarray    # (7, 24) entries per weekday (Monday first) and hour
+
+    @property
+    def days(self) -> np.ndarray:
+        """datetime64[D] of every day in the series"""
+        return np.datetime64(self.start_day, 'D') + np.arange(len(self.positive))
+
+    @property
+    def total(self) -> np.ndarray:
+        return self.positive + self.negative
+
+    @property
+    def valence(self) -> np.ndarray:
+        """Daily (positive - negative) / total in [-1, 1], NaN on days without entries"""
+        total = self.total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, (self.positive - self.negative) / total, np.nan)
+
+    def rolling(self, window: int = ROLLING_WINDOW_DAYS) -> Tuple[np.ndarray, np.ndarray]:
+        """Trailing means of positive and negative entries per day (shorter windows at the start)"""
+        return rolling_mean(self.positive, window), rolling_mean(self.negative, window)
+
+    @property
+    def days_with_entries(self) -> int:
+        return int(np.count_nonzero(self.total))
+
+    def valence_trend(self) -> Optional[Tuple[float, float]]:
+        """
+        Least squares line through the daily valence
+
+        Returns:
+            (slope per day, value at start_day), or None with fewer than two days of entries
+        """
+        valence = self.valence
+        x = np.flatnonzero(~np.isnan(valence))
+        if len(x) < 2:
+            return None
+        slope, intercept = np.polyfit(x, valence[x], 1)
+        return float(slope), float(intercept)
+
+    def longest_streak(self) -> int:
+        """Most consecutive days with at least one entry"""
+        active = np.concatenate(([0], (self.total > 0).astype(np.int8), [0]))
+        edges = np.diff(active)
+        lengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        return int(lengths.max(initial=0))
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of each value and the window - 1 before it"""
+    sums = np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+    index = np.arange(len(values))
+    first = np.maximum(index - window + 1, 0)
+    return (sums[index + 1] - sums[first]) / (index + 1 - first)
+
+def build_emotion_series(created_at: np.ndarray, emotion_types: np.ndarray,
+                         start_day: date, end_day: date) -> EmotionSeries:
+    """
+    Bin entries into the days between start_day and end_day (inclusive)
+
+    Args:
+        created_at: datetime64 entry times, already in the user's local time
+        emotion_types: emotion_type of each entry ("positive" / "negative")
+        start_day: First day of the series
+        end_day: Last day of the series
+    """
+    days = max((end_day - start_day).days + 1, 0)
+    minutes = created_at.astype('datetime64[m]')
+    entry_days = minutes.astype('datetime64[D]')
+    day_index = (entry_days - np.datetime64(start_day, 'D')).astype(np.int64)
+
+    inside = (day_index >= 0) & (day_index < days)
+    day_index, minutes, entry_days = day_index[inside], minutes[inside], entry_days[inside]
+    emotion_types = emotion_types[inside]
+
+    positive = np.bincount(day_index[emotion_types == "positive"], minlength=days)
+    negative = np.bincount(day_index[emotion_types == "negative"], minlength=days)
+
+    hours = (minutes - entry_days).astype(np.int64) // 60
+    weekdays = (entry_days.astype(np.int64) + _EPOCH_WEEKDAY) % 7
+    hour_heatmap = np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+    return EmotionSeries(start_day, positive, negative, hour_heatmap)
+
+def load_emotion_series(session, user_id: int, start: datetime, end: datetime,
+                        timezone_offset: int = 0) -> EmotionSeries:
+    """
+    Emotion time series of a user between two moments
+
+    Only the two needed columns are fetched and handed to numpy as whole
+    arrays, so a year of history takes milliseconds.
+
+    Args:
+        session: Sync database session
+        user_id: Internal user ID
+        start: Period start (server time)
+        end: Period end (server time)
+        timezone_offset: User's UTC offset in hours (User.timezone_offset), for local days and hours
+    """
+    rows = session.query(EmotionEntry.created_at, EmotionEntry.emotion_type).filter(
+        EmotionEntry.user_id == user_id,
+        EmotionEntry.created_at >= start,
+        EmotionEntry.created_at <= end
+    ).all()
+
+    # Server time -> UTC -> user's local time, as the notification scheduler does
+    offset = timedelta(hours=(timezone_offset or 0) - SERVER_UTC_OFFSET)
+    if rows:
+        created_at, emotion_types = zip(*rows)
+        created_at = np.array(created_at, dtype='datetime64[m]') + np.timedelta64(offset, 'm')
+        emotion_types = np.array(emotion_types, dtype=object)
+    else:
+        created_at = np.array([], dtype='datetime64[m]')
+        emotion_types = np.array([], dtype=object)
+
+    return build_emotion_series(created_at, emotion_types, (start + offset).date(), (end + offset).date())
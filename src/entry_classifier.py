@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Entry Classifier for PsyBot
+Single pass over a period's emotion entries that prepares everything the analysis screens show
+"""
+
+import hashlib
+from collections import deque
+from operator import itemgetter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# answer_text written by the emotion diary when the user only picked an emotion
+DIARY_PLACEHOLDER = "Emotion recorded from diary"
+THERAPY_PREFIX = "Marked for therapy work:"
+THERAPY_PREFIX_RU = "Отмечено для проработки с терапевтом"
+AI_HELPED_PREFIX = "AI рекомендация помогла"
+NO_FSM_TEXT_PREFIX = "Marked for work (text not found in FSM)"
+MESSAGE_PREFIX = "Сообщение "
+
+DATE_FORMAT = "%d.%m.%Y, %H:%M"
+
+MARKER_THERAPY = "therapy"
+MARKER_AI_HELPED = "ai_helped"
+
+# Positive entries kept for the "positive moments" sections (the full report shows 5, the short one 3)
+POSITIVE_MOMENTS = 5
+# Contexts kept per negative emotion for the advice prompt
+ADVICE_CONTEXTS = 3
+# Negative contexts kept for the therapy topics prompt
+TOPIC_CONTEXTS = 5
+TOPIC_CONTEXT_MIN_LENGTH = 20
+
+# Weekly reflection answers shown in the reports: (label, WeeklyReflection column)
+REFLECTION_FIELDS = (
+    ("Момент улыбки", "smile_moment"),
+    ("Доброта", "kindness"),
+    ("Спокойствие", "peace_moment"),
+    ("Открытие", "new_discovery"),
+    ("Благодарность", "gratitude"),
+)
+
+class ContextNote(NamedTuple):
+    """Entry with the user's own words, marker prefixes removed"""
+    created_at: datetime
+    date_str: str              # "dd.mm.yyyy, HH:MM", formatted once for every report
+    state: Optional[str]
+    context: str
+    extra_messages: int = 0    # further "Сообщение N:" lines after the first one
+    marker: str = ""           # MARKER_THERAPY, MARKER_AI_HELPED or ""
+
+class QuickNote(NamedTuple):
+    """Emotion picked in the diary without a note"""
+    created_at: datetime
+    date_str: str
+    state: Optional[str]
+    option_num: Optional[int]
+
+class ReflectionNote(NamedTuple):
+    """Filled answers of a weekly reflection"""
+    created_at: datetime
+    moments: Tuple[Tuple[str, str], ...]    # (label, answer)
+
+@dataclass
+class EntryDigest:
+    """Classified entries of one user and period, plain data safe to cache or send to a worker"""
+    context_notes: List[ContextNote] = field(default_factory=list)      # chronological
+    quick_notes: List[QuickNote] = field(default_factory=list)          # chronological
+    positive_moments: List[QuickNote] = field(default_factory=list)     # POSITIVE_MOMENTS of the input's tail
+    reflections: List[ReflectionNote] = field(default_factory=list)     # as given (newest first)
+    negative_contexts: Dict[str, List[str]] = field(default_factory=dict)   # state -> first answer texts
+    topic_contexts: List[str] = field(default_factory=list)             # first longer negative texts, cleaned by topic_context()
+    negative_entries: int = 0
+    version: str = ""    # digest of every field shown, for the report cache
+
+    @property
+    def has_entries(self) -> bool:
+        return bool(self.context_notes or self.quick_notes)
+
+def _strip_marker(answer_text: str) -> Tuple[Optional[str], str]:
+    """Remove the therapy / AI marker prefix; (context or None if only the marker is left, marker)"""
+    context = answer_text.strip()
+    marker = ""
+    if context.startswith(THERAPY_PREFIX):
+        marker = MARKER_THERAPY
+        context = context[len(THERAPY_PREFIX):].strip()
+        if not context or context.startswith(NO_FSM_TEXT_PREFIX):
+            return None, marker
+    elif context.startswith(THERAPY_PREFIX_RU):
+        marker = MARKER_THERAPY
+        if ":" in context:
+            context = context.split(":", 1)[1].strip()
+    elif context.startswith(AI_HELPED_PREFIX):
+        marker = MARKER_AI_HELPED
+        if ":" in context:
+            context = context.split(":", 1)[1].strip()
+    return context, marker
+
+def _conversation_messages(context: str) -> List[str]:
+    """Messages of a formatted conversation ("Сообщение 1: ..." lines), empty for plain text"""
+    messages = []
+    if context.startswith(MESSAGE_PREFIX + "1:"):
+        for line in context.split("\n"):
+            if line.startswith(MESSAGE_PREFIX) and ":" in line:
+                message = line.split(":", 1)[1].strip()
+                if message:
+                    messages.append(message)
+    return messages
+
+def parse_context(answer_text: str) -> Tuple[Optional[str], int, str]:
+    """
+    Split an entry's answer_text into what the reports show
+
+    Returns:
+        (context or None if there is nothing to show, number of extra messages, marker)
+    """
+    context, marker = _strip_marker(answer_text)
+    if context is None:
+        return None, 0, marker
+
+    # Formatted conversation: show the first message and count the rest
+    messages = _conversation_messages(context)
+    if messages:
+        return messages[0], len(messages) - 1, marker
+    return context, 0, marker
+
+def topic_context(answer_text: str) -> Optional[str]:
+    """An entry's text for the therapy topics prompt: marker removed, all messages of a conversation joined"""
+    context, _ = _strip_marker(answer_text)
+    if context is None:
+        return None
+    messages = _conversation_messages(context)
+    return " ".join(messages) if messages else context
+
+def _option_num(option: Optional[str]) -> Optional[int]:
+    if option and option.startswith("option_"):
+        try:
+            return int(option.split("_")[1])
+        except (ValueError, IndexError):
+            return None
+    return None
+
+def classify_entries(entries: Iterable, reflections: Iterable = ()) -> EntryDigest:
+    """
+    Classify a period's emotion entries in one pass
+
+    Args:
+        entries: EmotionEntry rows (or objects with the same attributes), newest first as loaded by the handlers
+        reflections: WeeklyReflection rows of the period
+
+    Returns:
+        EntryDigest used by the short analysis, the text report and the PDF report
+    """
+    digest = EntryDigest()
+    fingerprint = []
+    positive: Deque[QuickNote] = deque(maxlen=POSITIVE_MOMENTS)
+
+    for entry in entries:
+        answer_text = entry.answer_text
+        fingerprint.append(f"{entry.id}\x1f{entry.emotion_type}\x1f{entry.state}\x1f{entry.option}\x1f{answer_text}")
+
+        if entry.emotion_type == "positive":
+            positive.append(entry)
+        elif entry.emotion_type == "negative":
+            digest.negative_entries += 1
+            if answer_text:
+                contexts = digest.negative_contexts.setdefault(entry.state, [])
+                if len(contexts) < ADVICE_CONTEXTS:
+                    contexts.append(answer_text)
+                if len(digest.topic_contexts) < TOPIC_CONTEXTS:
+                    topic = topic_context(answer_text)
+                    if topic and len(topic) > TOPIC_CONTEXT_MIN_LENGTH:
+                        digest.topic_contexts.append(topic)
+
+        if not answer_text or not answer_text.strip():
+            continue
+        if answer_text == DIARY_PLACEHOLDER:
+            digest.quick_notes.append(QuickNote(
+                entry.created_at, entry.created_at.strftime(DATE_FORMAT), entry.state, _option_num(entry.option)
+            ))
+            continue
+        context, extra_messages, marker = parse_context(answer_text)
+        if context is not None:
+            digest.context_notes.append(ContextNote(
+                entry.created_at, entry.created_at.strftime(DATE_FORMAT), entry.state, context, extra_messages, marker
+            ))
+
+    # Lists built newest first are reversed runs, so these sorts are linear
+    digest.context_notes.sort(key=itemgetter(0))
+    digest.quick_notes.sort(key=itemgetter(0))
+    digest.positive_moments = [
+        QuickNote(entry.created_at, entry.created_at.strftime(DATE_FORMAT), entry.state, None) for entry in positive
+    ]
+
+    for reflection in reflections:
+        moments = tuple((label, getattr(reflection, name)) for label, name in REFLECTION_FIELDS
+                        if getattr(reflection, name))
+        fingerprint.append(f"{reflection.id}\x1f{moments!r}")
+        digest.reflections.append(ReflectionNote(reflection.created_at, moments))
+
+    digest.version = hashlib.sha256("\x1e".join(fingerprint).encode("utf-8")).hexdigest()[:32]
+    return digest
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+SQLite FSM Storage for PsyBot
+Durable aiogram FSM storage that coalesces back-to-back writes of a handler
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Set, Tuple
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FSM_DB_PATH = str((Path(__file__).parent / "database" / "fsm_storage.db").resolve())
+
+# Seconds writes to the same or other keys are collected before one transaction is committed
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.05"))
+# Clean records kept in memory (dirty records are never evicted)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+def _key_string(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+class SQLiteStorage(BaseStorage):
+    """
+    aiogram storage backed by a local SQLite file.
+
+    State and data are served from an in-process cache and written back by
+    a single debounced flush: the get/update_data/set_state calls a handler
+    makes in quick succession end up as one upsert per key and one commit.
+    The cache assumes a chat's updates are handled by one process at a time
+    (polling, or chat-partitioned workers); flush_delay=None writes through.
+    """
+
+    def __init__(self, path: str = None, flush_delay: Optional[float] = FSM_FLUSH_DELAY,
+                 cache_size: int = FSM_CACHE_SIZE):
+        self.path = path or os.getenv("FSM_STORAGE_PATH", DEFAULT_FSM_DB_PATH)
+        self.flush_delay = flush_delay
+        self.cache_size = cache_size
+        self._records: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._connection: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.writes_requested = 0
+        self.rows_written = 0
+        self.commits = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._connection is None:
+            async with self._connect_lock:
+                if self._connection is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    connection = await aiosqlite.connect(self.path)
+                    await connection.execute("PRAGMA journal_mode=WAL")
+                    await connection.execute("PRAGMA synchronous=NORMAL")
+                    await connection.execute(
+                        "CREATE TABLE IF NOT EXISTS fsm_storage ("
+                        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+                    )
+                    await connection.commit()
+                    self._connection = connection
+        return self._connection
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Get a record from the cache, reading it from the database once"""
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+            return record
+
+        connection = await self._connect()
+        async with connection.execute("SELECT state, data FROM fsm_storage WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+
+        # Another coroutine may have written the key while we were reading
+        record = self._records.get(key)
+        if record is None:
+            record = (row[0], json.loads(row[1])) if row else (None, {})
+            self._records[key] = record
+            self._evict()
+        return record
+
+    def _evict(self) -> None:
+        while len(self._records) > self.cache_size:
+            for key in self._records:
+                if key not in self._dirty:
+                    del self._records[key]
+                    break
+            else:
+                return
+
+    async def _write(self, key: str, record: Tuple[Optional[str], Dict[str, Any]]) -> None:
+        self._records[key] = record
+        self._records.move_to_end(key)
+        self._dirty.add(key)
+        self.writes_requested += 1
+
+        if self.flush_delay is None:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"FSM storage flush failed: {e}")
+
+    async def flush(self) -> int:
+        """
+        Write all dirty records in one transaction
+
+        Returns:
+            Number of records written
+        """
+        async with self._flush_lock:
+            return await self._flush_dirty()
+
+    async def _flush_dirty(self) -> int:
+        # Records dirtied by callers waiting on the lock are picked up here too
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        deletes = []
+        now = time.time()
+        for key in dirty:
+            state, data = self._records[key]
+            if state is None and not data:
+                deletes.append((key,))
+            else:
+                try:
+                    encoded = json.dumps(data, ensure_ascii=False)
+                except (TypeError, ValueError) as e:
+                    # Retrying would fail the whole batch forever; the record stays in memory only
+                    logger.error(f"Dropping FSM data of {key} that is not JSON serializable: {e}")
+                    continue
+                upserts.append((key, state, encoded, now))
+
+        connection = await self._connect()
+        try:
+            if upserts:
+                await connection.executemany(
+                    "INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                await connection.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
+            await connection.commit()
+        except BaseException:
+            # Retry these records on the next flush (also when the flush task is cancelled)
+            self._dirty |= dirty
+            raise
+
+        written = len(upserts) + len(deletes)
+        self.rows_written += written
+        self.commits += 1
+        self._evict()
+        return written
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key_string = _key_string(key)
+        _, data = await self._load(key_string)
+        await self._write(key_string, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_key_string(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        key_string = _key_string(key)
+        state, _ = await self._load(key_string)
+        await self._write(key_string, (state, deepcopy(dict(data))))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_key_string(key))
+        return deepcopy(data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached": len(self._records),
+            "writes_requested": self.writes_requested,
+            "rows_written": self.rows_written,
+            "commits": self.commits,
+        }
+
+    async def close(self) -> None:
+        """Flush pending writes and close the database"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        try:
+            await self.flush()
+        finally:
+            if self._connection is not None:
+                await self._connection.close()
+                self._connection = None
+        logger.info(f"FSM storage closed: {self.stats()}")
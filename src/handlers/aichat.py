@@ -8,6 +8,8 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from .emotion_diary import start_emotion_diary
 from src.aichat.openai_rag_service import OpenAIRAGService
+from src.aichat.answer_cache import answer_cache_opt_outs
+from src.llm_health import health_monitor
 import os 
 
 
@@ -23,18 +25,13 @@ rag_service = OpenAIRAGService(openai_api_key=os.environ.get("OPENAI_API_KEY"))
 async def handle_reset_books(message: types.Message, state: FSMContext):
     logger.info(f"Handling 'Reset Books' command. message.from_user.id: {message.from_user.id}")
 
-    if not rag_service.test_connection():
+    if not health_monitor.is_available("openai"):
         await message.answer("❌ OpenAI connection muvaffaqiyatsiz! API key va internetni tekshiring.")
         return
 
-    if rag_service.clear_database():
-        print("✅ Baza tozalandi!")
-        await message.answer("✅ Baza tozalandi!")
-    else:
-        await message.answer("❌ Bazani tozalashda xatolik!")
-
-    if rag_service.process_books_pdfs():
-        await message.answer("🎉 Barcha PDF fayllar muvaffaqiyatli ChromaDB ga qo'shildi!")
+    # Inkremental indekslash: faqat yangi/o'zgargan chunklar embedding qilinadi
+    if await rag_service.process_books_pdfs():
+        await message.answer("🎉 Barcha PDF fayllar ChromaDB bilan sinxronlandi!")
     else:
         await message.answer("❌ PDF fayllarni processing qilishda xatolik!")
 
@@ -42,17 +39,38 @@ async def handle_reset_books(message: types.Message, state: FSMContext):
     stats = rag_service.get_database_stats()
     await message.answer("\n📊 PDF BAZA STATISTIKASI:\n"
     f"📄 Jami PDF chunks: {stats['total_pdf_chunks']}\n"
-    f"🔋 Holat: {stats['status']}"
+    f"🔋 Holat: {stats['status']}\n"
+    f"🧠 Embedding kesh hit-rate: {stats['embedding_cache']['hit_rate']:.0%}\n"
+    f"💾 Javob kesh hit-rate: {stats['answer_cache']['hit_rate']:.0%}"
     )
 
 
 
 
+@router.message(Command("answer_cache"))
+async def handle_answer_cache_toggle(message: types.Message, state: FSMContext):
+    """Toggle whether the user's questions are answered from (and stored in) the shared answer cache"""
+    telegram_id = message.from_user.id
+    opted_out = not answer_cache_opt_outs.is_opted_out(telegram_id)
+    try:
+        answer_cache_opt_outs.set_opted_out(telegram_id, opted_out)
+    except Exception:
+        await message.answer("❌ Не удалось сохранить настройку. Попробуйте позже.")
+        return
+
+    if opted_out:
+        await message.answer("🔒 Ваши вопросы больше не будут сохраняться, каждый ответ будет формироваться заново.\n"
+                             "Чтобы снова включить быстрые ответы, отправьте /answer_cache")
+    else:
+        await message.answer("⚡ Быстрые ответы на похожие вопросы включены.\n"
+                             "Чтобы отключить, отправьте /answer_cache")
+
+
 @router.message(F.text)
 async def handle_emotion_diary_button(message: types.Message, state: FSMContext):
     logger.info(f"Handling 'Дневник эмоций' button press. message.from_user.id: {message.from_user.id}")
     
-    if not rag_service.test_connection():
+    if not health_monitor.is_available("openai"):
         await message.answer("❌ OpenAI connection muvaffaqiyatsiz! API key va internetni tekshiring.")
         return
     
@@ -61,7 +79,7 @@ async def handle_emotion_diary_button(message: types.Message, state: FSMContext)
     
     question = message.text.strip()
     
-    answer = rag_service.chat(question)
+    answer = await rag_service.chat(question, telegram_id=message.from_user.id)
 
     if answer:
         await message.answer(answer)
@@ -2,14 +2,13 @@ from aiogram import types, F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import StateFilter
-from src.database.session import get_session, close_session
-from src.database.models import User, EmotionEntry
+from src.database.async_session import db_session
+from src.user_cache import user_cache
+from src.database.models import EmotionEntry
 from src.handlers.thought_diary import handle_emotion_choice
 from .utils import delete_previous_messages
 from src.constants import *
-import os
-from google import genai
-import asyncio
+from src.llm_gateway import generate_content
 import logging
 from src.trial_manager import require_trial_access
 
@@ -17,11 +16,6 @@ from src.trial_manager import require_trial_access
 logger = logging.getLogger(__name__)
 router = Router(name=__name__)
 
-client = genai.Client(
-    api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
-    http_options={"base_url": os.environ.get("API_URL")}
-)
-
 async def return_to_main_menu(message: types.Message, state: FSMContext):
     from src.handlers.main_menu import main_menu
     await delete_previous_messages(message, state)
@@ -31,15 +25,12 @@ async def return_to_main_menu(message: types.Message, state: FSMContext):
 
 async def start_emotion_diary(message: types.Message, state: FSMContext):
     logger.info(f"start_emotion_diary invoked. message.from_user.id: {message.from_user.id}")
-    session = get_session()
-    db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
+    db_user = await user_cache.get(message.from_user.id)
     logger.info(f"db_user: {db_user}")
     if not db_user or not getattr(db_user, 'registration_complete', False) or not db_user.full_name:
-        close_session(session)
         await state.clear()
         await message.answer("Пожалуйста, завершите регистрацию с помощью /start перед использованием дневника эмоций.")
         return MAIN_MENU
-    close_session(session)
     data = await state.get_data()
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
@@ -223,11 +214,9 @@ async def _handle_option_selection_logic(callback: types.CallbackQuery, state: F
     await state.update_data(selected_option=callback.data)
     
     # Save emotion entry to database
-    session = get_session()
-    db_user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
+    db_user = await user_cache.get(callback.from_user.id)
     if db_user:
         await save_emotion_entry_simple(db_user.id, state)
-    close_session(session)
     
     # Генерация и отправка поддерживающего сообщения
     emotion_type = (await state.get_data()).get('selected_emotion')
@@ -266,46 +255,39 @@ async def handle_after_support_choice(callback: types.CallbackQuery, state: FSMC
 
 async def save_emotion_entry_simple(user_id: int, state: FSMContext):
     """Save emotion entry to database from emotion diary flow"""
-    session = get_session()
-    try:
-        data = await state.get_data()
-        
-        # Get emotion data from FSM state
-        selected_emotion = data.get('selected_emotion')  # 'good' or 'bad'
-        selected_state = data.get('selected_state')      # e.g. 'good_state_1', 'bad_state_2'
-        selected_option = data.get('selected_option')    # e.g. 'option_0', 'option_1'
-        
-        # Convert to emotion_type for database
-        emotion_type = "positive" if selected_emotion == "good" else "negative"
-        
-        # Create emotion entry
-        entry = EmotionEntry(
-            user_id=user_id,
-            emotion_type=emotion_type,
-            state=selected_state,
-            option=selected_option,
-            answer_text="Emotion recorded from diary"  # Simple placeholder
-        )
-        
-        session.add(entry)
-        session.commit()
-        logger.info(f"Saved emotion entry for user {user_id}: {emotion_type}, {selected_state}, {selected_option}")
-        
-    except Exception as e:
-        logger.error(f"Error saving emotion entry for user {user_id}: {e}")
-        session.rollback()
-    finally:
-        close_session(session)
+    async with db_session() as session:
+        try:
+            data = await state.get_data()
+            
+            # Get emotion data from FSM state
+            selected_emotion = data.get('selected_emotion')  # 'good' or 'bad'
+            selected_state = data.get('selected_state')      # e.g. 'good_state_1', 'bad_state_2'
+            selected_option = data.get('selected_option')    # e.g. 'option_0', 'option_1'
+            
+            # Convert to emotion_type for database
+            emotion_type = "positive" if selected_emotion == "good" else "negative"
+            
+            # Create emotion entry
+            entry = EmotionEntry(
+                user_id=user_id,
+                emotion_type=emotion_type,
+                state=selected_state,
+                option=selected_option,
+                answer_text="Emotion recorded from diary"  # Simple placeholder
+            )
+            
+            session.add(entry)
+            await session.commit()
+            logger.info(f"Saved emotion entry for user {user_id}: {emotion_type}, {selected_state}, {selected_option}")
+            
+        except Exception as e:
+            logger.error(f"Error saving emotion entry for user {user_id}: {e}")
+            await session.rollback()
 
 async def send_support_message(message: types.Message, state: FSMContext, emotion_text: str):
     ai_prompt = f"Пользователь выбрал эмоцию: '{emotion_text}'. Напиши короткий поддерживающий комментарий, чтобы помочь человеку почувствовать поддержку. Не используй markdown."
     try:
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-2.0-flash",
-            contents=[ai_prompt]
-        )
-        ai_text = response.text if hasattr(response, 'text') else str(response)
+        ai_text = await generate_content([ai_prompt])
     except Exception as e:
         logging.error(f"Failed to get AI-generated support message: {e!r}")
         ai_text = "Спасибо, что поделились своими чувствами. Я рядом!"
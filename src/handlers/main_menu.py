@@ -2,8 +2,7 @@ import logging
 from aiogram import types
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
-from src.database.session import get_session, close_session
-from src.database.models import User
+from src.user_cache import user_cache
 from src.constants import MAIN_MENU
 from aiogram import Router, F
 from aiogram.filters import Command
@@ -39,8 +38,7 @@ async def main_menu(source: types.Message | types.CallbackQuery, state: FSMConte
     if messages_to_delete is None:
         messages_to_delete = []
 
-    session = get_session()
-    db_user = session.query(User).filter(User.telegram_id == actual_user.id).first()
+    db_user = await user_cache.get(actual_user.id)
     
     if db_user:
         logger.info(f"main_menu: Found db_user. ID: {db_user.id}, Telegram ID: {db_user.telegram_id}, Full Name: '{db_user.full_name}', Reg Complete: {getattr(db_user, 'registration_complete', 'N/A')}")
@@ -49,17 +47,15 @@ async def main_menu(source: types.Message | types.CallbackQuery, state: FSMConte
 
     if not db_user or not getattr(db_user, 'registration_complete', False) or not db_user.full_name:
         logger.warning(f"main_menu: Registration incomplete or name missing. db_user: {bool(db_user)}, reg_complete: {getattr(db_user, 'registration_complete', 'N/A') if db_user else 'N/A'}, full_name: {db_user.full_name if db_user else 'N/A'} for User ID: {actual_user.id}")
-        close_session(session)
         await answer_target.answer("Пожалуйста, завершите регистрацию с помощью /start aas")
         return MAIN_MENU
 
     # Check trial status
-    from src.trial_manager import check_trial_status, get_access_denied_message, has_feature_access
-    trial_status, days_remaining = check_trial_status(db_user)
+    from src.trial_manager import check_trial_status_async, get_access_denied_message
+    trial_status, days_remaining = await check_trial_status_async(db_user)
     
     # If trial expired, show expiry message and block access
     if trial_status == 'trial_expired':
-        close_session(session)
         await answer_target.answer(get_access_denied_message('main_menu'))
         return MAIN_MENU
 
@@ -72,8 +68,6 @@ async def main_menu(source: types.Message | types.CallbackQuery, state: FSMConte
     elif trial_status == 'premium':
         trial_info = "\n⭐ Премиум-доступ активен"
     
-    close_session(session)
-    
     current_fsm_state_data = await state.get_data()
     new_fsm_state_data = {'messages_to_delete': current_fsm_state_data.get('messages_to_delete', [])}
     await state.set_data(new_fsm_state_data)
@@ -107,24 +101,26 @@ async def main_menu(source: types.Message | types.CallbackQuery, state: FSMConte
     
     return MAIN_MENU
 
+async def check_feature_access(message: types.Message, feature: str) -> bool:
+    """Check registration and trial access for a main menu feature, answering the user if denied"""
+    db_user = await user_cache.get(message.from_user.id)
+    if not db_user:
+        await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
+        return False
+    
+    from src.trial_manager import has_feature_access_async, get_access_denied_message
+    if not await has_feature_access_async(db_user, feature):
+        await message.answer(get_access_denied_message(feature))
+        return False
+    return True
+
 @router.message(F.text == "Дневник эмоций")
 async def handle_emotion_diary_button(message: types.Message, state: FSMContext):
     logger.info(f"Handling 'Дневник эмоций' button press. message.from_user.id: {message.from_user.id}")
     
     # Check access permissions
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not db_user:
-            await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-            return
-        
-        from src.trial_manager import has_feature_access, get_access_denied_message
-        if not has_feature_access(db_user, 'emotion_diary'):
-            await message.answer(get_access_denied_message('emotion_diary'))
-            return
-    finally:
-        close_session(session)
+    if not await check_feature_access(message, 'emotion_diary'):
+        return
     
     await start_emotion_diary(message, state)
 
@@ -133,19 +129,8 @@ async def handle_emotion_analysis_button(message: types.Message, state: FSMConte
     logger.info(f"Handling 'Аналитика эмоций' button press. message.from_user.id: {message.from_user.id}")
     
     # Check access permissions
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not db_user:
-            await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-            return
-        
-        from src.trial_manager import has_feature_access, get_access_denied_message
-        if not has_feature_access(db_user, 'emotion_analytics'):
-            await message.answer(get_access_denied_message('emotion_analytics'))
-            return
-    finally:
-        close_session(session)
+    if not await check_feature_access(message, 'emotion_analytics'):
+        return
     
     from .emotion_analysis import start_emotion_analysis
     await start_emotion_analysis(message, state)
@@ -155,19 +140,8 @@ async def handle_therapy_themes_button(message: types.Message, state: FSMContext
     logger.info(f"Handling 'Темы для проработки' button press. message.from_user.id: {message.from_user.id}")
     
     # Check access permissions
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not db_user:
-            await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-            return
-        
-        from src.trial_manager import has_feature_access, get_access_denied_message
-        if not has_feature_access(db_user, 'therapy_themes'):
-            await message.answer(get_access_denied_message('therapy_themes'))
-            return
-    finally:
-        close_session(session)
+    if not await check_feature_access(message, 'therapy_themes'):
+        return
     
     from .therapy_themes import start_therapy_themes
     await start_therapy_themes(message, state)
@@ -177,19 +151,8 @@ async def handle_relaxation_methods_button(message: types.Message, state: FSMCon
     logger.info(f"Handling 'Методы релаксации' button press. message.from_user.id: {message.from_user.id}")
     
     # Check access permissions
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not db_user:
-            await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-            return
-        
-        from src.trial_manager import has_feature_access, get_access_denied_message
-        if not has_feature_access(db_user, 'relaxation_methods'):
-            await message.answer(get_access_denied_message('relaxation_methods'))
-            return
-    finally:
-        close_session(session)
+    if not await check_feature_access(message, 'relaxation_methods'):
+        return
     
     from .relaxation import start_relaxation_methods
     await start_relaxation_methods(message, state)
@@ -220,19 +183,8 @@ async def help_callback_handler(callback: types.CallbackQuery, state: FSMContext
 @router.message(F.text == "Рефлексия встречи с психотерапевтом")
 async def reflection_with_psychotherapist_handler(message: types.Message, state: FSMContext) -> None:
     # Check access permissions
-    session = get_session()
-    try:
-        db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not db_user:
-            await message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-            return
-        
-        from src.trial_manager import has_feature_access, get_access_denied_message
-        if not has_feature_access(db_user, 'reflection'):
-            await message.answer(get_access_denied_message('reflection'))
-            return
-    finally:
-        close_session(session)
+    if not await check_feature_access(message, 'reflection'):
+        return
     
     from .reflection import start_reflection
     await start_reflection(message, state)
@@ -17,6 +17,7 @@ from src.constants import NOTIFICATION_FREQUENCY_SELECTION, TIMEZONE_SELECTION_S
 from src.database.models import User
 from src.database.session import get_session, close_session
 from src.handlers.utils import delete_previous_messages
+from src.schedule_index import schedule_index
 from src.trial_manager import require_trial_access
 
 # Initialize logger and router
@@ -128,6 +129,7 @@ async def handle_frequency_selection(callback: types.CallbackQuery, state: FSMCo
     if db_user:
         db_user.notification_frequency = frequency
         session.commit()
+        schedule_index.sync_user(db_user)
         
         # Create confirmation message
         frequency_text = {
@@ -200,6 +202,7 @@ async def handle_timezone_change_from_time(message: types.Message, state: FSMCon
         db_user.timezone_offset = timezone_offset
         db_user.user_timezone = user_timezone
         session.commit()
+        schedule_index.sync_user(db_user)
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="⬅️ Назад к настройкам", callback_data="back_to_notifications")],
@@ -12,10 +12,9 @@ from src.constants import (
     REFLECTION_NEXT_TOPICS,
     REFLECTION_CONFIRMATION
 )
-from google import genai
+from src.llm_gateway import generate_content
 from src.trial_manager import require_trial_access
 
-import os
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,12 +22,6 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 router = Router(name=__name__)
 
-# Initialize Google Generative AI client
-client = genai.Client(
-    api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
-    http_options={"base_url": os.environ.get("API_URL")}
-)
-
 async def delete_previous_messages(message: Message, state: FSMContext, keep_current: bool = False):
     """Helper function to delete previous messages"""
     data = await state.get_data()
@@ -279,19 +272,17 @@ async def generate_ai_transcription(reflection_data: dict, user_name: str = None
 Обрати внимание на правильное согласование глаголов и прилагательных с именем.
 """
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[{
+        return await generate_content(
+            [{
                 "role": "user",
                 "parts": [{"text": prompt}]
             }],
+            model="gemini-1.5-flash",
             config={
                 "max_output_tokens": 200,
                 "temperature": 0.7
             }
         )
-        
-        return response.candidates[0].content.parts[0].text.strip()
     
     except Exception as e:
         logger.error(f"Google Generative AI API error: {e}")
@@ -1,38 +1,24 @@
 import logging
 from aiogram import types, F, Router
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, BufferedInputFile
 from aiogram.filters import StateFilter
 from src.database.session import get_session, close_session
 from src.database.models import User, TherapyTheme
 from .utils import delete_previous_messages
 from src.constants import *
 from datetime import datetime, timedelta
-import os
-import tempfile
 import asyncio
-from google import genai
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from src.llm_gateway import generate_content
 from collections import defaultdict
-from .emotion_analysis import setup_russian_fonts
+from src.report_renderer import report_renderer, render_themes_report
+from src.report_cache import report_cache, data_version, REPORT_THEMES
 from src.trial_manager import require_trial_access
 
 # Initialize logger and router
 logger = logging.getLogger(__name__)
 router = Router(name=__name__)
 
-# Initialize GenAI client
-client = genai.Client(
-    api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
-    http_options={"base_url": os.environ.get("API_URL")}
-)
-
 async def start_therapy_themes(message: types.Message, state: FSMContext):
     """Start therapy themes management flow"""
     logger.info(f"start_therapy_themes called for user {message.from_user.id}")
@@ -187,12 +173,24 @@ async def generate_themes_pdf(callback: types.CallbackQuery, state: FSMContext,
         start_date = (datetime.now() - timedelta(days=period_days)).strftime("%d.%m.%Y")
         end_date = datetime.now().strftime("%d.%m.%Y")
         
-        pdf_path = await create_therapy_themes_pdf(
-            start_date, end_date, period_days, themes, user
+        # Same period and unchanged themes: send the report rendered last time
+        # (with each theme's week, which moves on as time passes)
+        now = datetime.now()
+        version = data_version(
+            (theme.id, (now - theme.created_at).days // 7, theme.original_text, theme.is_shortened, theme.shortened_text)
+            for theme in themes
         )
+        cache_key = report_cache.key(user.id, REPORT_THEMES, f"{period_days}:{start_date}-{end_date}", version)
+        pdf_bytes = await asyncio.to_thread(report_cache.get, user.id, cache_key)
+        
+        if not pdf_bytes:
+            pdf_bytes = await create_therapy_themes_pdf(
+                start_date, end_date, period_days, themes, user
+            )
+            await asyncio.to_thread(report_cache.put, user.id, cache_key, pdf_bytes)
         
         # Send PDF file
-        pdf_file = FSInputFile(pdf_path, filename=f"therapy_themes_{start_date}_{end_date}.pdf")
+        pdf_file = BufferedInputFile(pdf_bytes, filename=f"therapy_themes_{start_date}_{end_date}.pdf")
         await callback.message.answer_document(
             pdf_file,
             caption=f"📋 Темы для проработки за период {start_date} - {end_date}"
@@ -207,9 +205,6 @@ async def generate_themes_pdf(callback: types.CallbackQuery, state: FSMContext,
         await callback.message.answer("Отчет готов! 📄", reply_markup=keyboard)
         await state.set_state(THERAPY_THEMES_VIEWING)
         
-        # Clean up temporary file
-        os.unlink(pdf_path)
-        
     except Exception as e:
         logger.error(f"Error generating PDF: {e}")
         # Fallback to text report
@@ -478,17 +473,15 @@ async def generate_shortened_theme(text: str) -> str:
 
 Ответь только сокращенным текстом без дополнительных комментариев."""
         
-        response = client.models.generate_content(
+        return await generate_content(
+            prompt,
             model="gemini-1.5-flash",
-            contents=prompt,
-            config=genai.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=150
-            )
+            config={
+                "temperature": 0.3,
+                "max_output_tokens": 150
+            }
         )
         
-        return response.text.strip()
-        
     except Exception as e:
         logger.error(f"Error generating shortened theme: {e}")
         return text
@@ -532,70 +525,10 @@ async def back_to_main_from_themes(callback: types.CallbackQuery, state: FSMCont
     await main_menu(callback, state)
 
 async def create_therapy_themes_pdf(start_date: str, end_date: str, period_days: int,
-                                  themes: list, user) -> str:
-    """Create PDF report for therapy themes and return file path"""
-    
-    # Setup Russian fonts
-    fonts_available = setup_russian_fonts()
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        pdf_path = tmp_file.name
-    
-    # Create PDF document
-    doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Define custom styles with Russian font support
-    if fonts_available:
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1,  # Center alignment
-            fontName='RussianFont-Bold'
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            fontName='RussianFont-Bold'
-        )
-        
-        normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=styles['Normal'],
-            fontSize=10,
-            fontName='RussianFont'
-        )
-        
-        week_style = ParagraphStyle(
-            'WeekStyle',
-            parent=styles['Heading3'],
-            fontSize=12,
-            fontName='RussianFont-Bold',
-            spaceAfter=8,
-            spaceBefore=16
-        )
-    else:
-        # Fallback to default styles if fonts are not available
-        title_style = styles['Heading1']
-        heading_style = styles['Heading2']
-        normal_style = styles['Normal']
-        week_style = styles['Heading3']
-    
-    # Title
-    story.append(Paragraph("Темы для проработки с психотерапевтом", title_style))
-    story.append(Paragraph(f"Период: {start_date} - {end_date}", normal_style))
-    story.append(Spacer(1, 20))
+                                  themes: list, user) -> bytes:
+    """Create PDF report for therapy themes and return its bytes; the PDF is built by the report renderer pool"""
     
     # 1. General summary (2-3 sentences)
-    story.append(Paragraph("1. Общее краткое содержание", heading_style))
-    
     total_themes = len(themes)
     summary = f"За период с {start_date} по {end_date} было добавлено {total_themes} тем для проработки с психотерапевтом. "
     
@@ -607,12 +540,7 @@ async def create_therapy_themes_pdf(start_date: str, end_date: str, period_days:
     else:
         summary += "Основные направления работы включают личностное развитие и эмоциональную регуляцию. не используй markdown."
     
-    story.append(Paragraph(summary, normal_style))
-    story.append(Spacer(1, 20))
-    
     # 2. Weekly breakdown
-    story.append(Paragraph("2. По неделям", heading_style))
-    
     # Group themes by week
     themes_by_week = defaultdict(list)
     
@@ -623,6 +551,7 @@ async def create_therapy_themes_pdf(start_date: str, end_date: str, period_days:
         themes_by_week[week_num].append(theme)
     
     # Process each week
+    weeks = []
     for week_num in sorted(themes_by_week.keys()):
         week_themes = sorted(themes_by_week[week_num], key=lambda x: x.created_at, reverse=True)
         
@@ -634,15 +563,12 @@ async def create_therapy_themes_pdf(start_date: str, end_date: str, period_days:
         else:
             week_title = f"{week_num} недель назад"
         
-        story.append(Paragraph(week_title, week_style))
-        
         # Generate weekly theme using AI
         week_theme_texts = [theme.original_text for theme in week_themes]
         weekly_common_theme = await generate_weekly_theme(week_theme_texts)
-        story.append(Paragraph(f"Общая тема: {weekly_common_theme}", normal_style))
-        story.append(Spacer(1, 8))
         
         # 3. Individual entries with date, time: brief content
+        lines = []
         for theme in week_themes:
             date_str = theme.created_at.strftime("%d.%m.%Y, %H:%M")
             theme_text = theme.shortened_text if theme.is_shortened and theme.shortened_text else theme.original_text
@@ -651,19 +577,12 @@ async def create_therapy_themes_pdf(start_date: str, end_date: str, period_days:
             if len(theme_text) > 120:
                 theme_text = theme_text[:117] + "..."
             
-            story.append(Paragraph(f"{date_str}: {theme_text}", normal_style))
+            lines.append(f"{date_str}: {theme_text}")
         
-        story.append(Spacer(1, 12))
-    
-    # Additional recommendations section
-    story.append(Paragraph("Рекомендации", heading_style))
-    recommendations = "Рекомендуется обсудить выделенные темы с психотерапевтом в порядке их актуальности. " \
-                     "Особое внимание стоит уделить повторяющимся паттернам и эмоциональным реакциям."
-    story.append(Paragraph(recommendations, normal_style))
+        weeks.append({'title': week_title, 'common_theme': weekly_common_theme, 'lines': lines})
     
-    # Build PDF
-    doc.build(story)
-    return pdf_path
+    report = {'start_date': start_date, 'end_date': end_date, 'summary': summary, 'weeks': weeks}
+    return await report_renderer.render(render_themes_report, report)
 
 async def generate_themes_summary(theme_texts: list) -> str:
     """Generate AI summary of common themes"""
@@ -679,12 +598,7 @@ async def generate_themes_summary(theme_texts: list) -> str:
     """
     
     try:
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-2.0-flash",
-            contents=[prompt]
-        )
-        summary = response.text if hasattr(response, 'text') else str(response)
+        summary = await generate_content([prompt])
         return summary.strip()
     except Exception as e:
         logger.error(f"Error generating themes summary: {e}")
@@ -718,12 +632,7 @@ async def generate_weekly_theme(week_theme_texts: list) -> str:
     """
     
     try:
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-2.0-flash",
-            contents=[prompt]
-        )
-        theme = response.text if hasattr(response, 'text') else str(response)
+        theme = await generate_content([prompt])
         return theme.strip().lower()
     except Exception as e:
         logger.error(f"Error generating weekly theme: {e}")
@@ -4,10 +4,11 @@ from aiogram import types, F, Router
 from aiogram.filters import StateFilter
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
-from src.database.session import get_session, close_session
-from src.database.models import User, EmotionEntry
-import os
-from google import genai
+from sqlalchemy import select
+from src.database.async_session import db_session
+from src.user_cache import user_cache
+from src.database.models import EmotionEntry
+from src.llm_gateway import generate_content
 from .utils import delete_previous_messages
 from src.constants import (
     MAIN_MENU,
@@ -21,11 +22,6 @@ from src.trial_manager import require_trial_access
 logger = logging.getLogger(__name__)
 router = Router(name=__name__) # New router for thought diary
 
-client = genai.Client(
-    api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
-    http_options={"base_url": os.environ.get("API_URL")}
-)
-
 # Dictionary mapping state and option to messages
 final_messages = {
     "bad_state_1": {
@@ -116,16 +112,13 @@ async def handle_emotion_choice(callback_query: types.CallbackQuery, state: FSMC
     current_fsm_state_at_entry = await state.get_state()
     logger.info(f"User {user_id}: Entering handle_emotion_choice. Current FSM state: {current_fsm_state_at_entry}. Transitioning to thought diary.")
     
-    session = get_session()
-    db_user = session.query(User).filter(User.telegram_id == user_id).first()
+    db_user = await user_cache.get(user_id)
     if not db_user or not db_user.registration_complete:
-        close_session(session)
         await callback_query.message.answer("Пожалуйста, завершите регистрацию с помощью /start перед использованием дневника мыслей.")
         await delete_previous_messages(callback_query.message, state)
         await state.clear()
         await main_menu(callback_query, state)
         return
-    close_session(session)
 
     data = await state.get_data()
     # selected_emotion, selected_state, selected_option are passed from emotion_diary via FSM data
@@ -149,8 +142,7 @@ async def handle_emotion_choice(callback_query: types.CallbackQuery, state: FSMC
         return
 
     try:
-        response = client.models.generate_content(model="gemini-2.0-flash", contents=[prompt_text])
-        ai_text = response.text if hasattr(response, 'text') else str(response)
+        ai_text = await generate_content([prompt_text])
     except Exception as e:
         logger.error(f"Error generating AI content for emotion type {emotion_type}: {e}")
         ai_text = "Рад, что вы готовы поделиться. Давайте продолжим." if emotion_type == 'good' else "Я здесь, чтобы помочь. Давайте разберемся."
@@ -334,8 +326,7 @@ async def process_get_recommendation(callback_query: types.CallbackQuery, state:
         prompt = f"Пользователь рассказал о проблеме в ходе разговора:\n{conversation_context}\n\n(Эмоция/состояние не найдено для специфического промпта, используем стандартный). Дай короткую поддерживающую рекомендацию на основе всей информации. Не используй markdown."
     
     try:
-        response_content = client.models.generate_content(model="gemini-2.0-flash", contents=[prompt])
-        ai_text = response_content.text if hasattr(response_content, 'text') else str(response_content)
+        ai_text = await generate_content([prompt])
     except Exception as e:
         logger.error(f"Error generating AI recommendation for user {user_id}: {e}")
         ai_text = "Вот рекомендация: попробуйте посмотреть на ситуацию с другой стороны и поддержать себя."
@@ -382,36 +373,31 @@ async def process_mark_for_work(callback_query: types.CallbackQuery, state: FSMC
         logger.info(f"User {user_id}: Saved emotion entry with full conversation history for marking as therapy work")
     
     # Get user from database for therapy theme
-    session_db = get_session()
-    try:
-        db_user = session_db.query(User).filter(User.telegram_id == user_id).first()
-        if db_user:
-            # Add to therapy themes
-            await add_theme_from_thought_diary(db_user.id, entry_text)
-            logger.info(f"User {user_id}: Added therapy theme from thought diary: {entry_text[:50]}...")
-            
-            # Update the emotion entry with therapy work marker
-            if conversation_history:
-                # Requery the latest entry in the current session to avoid session mixing
-                latest_entry_in_session = session_db.query(EmotionEntry).filter(
-                    EmotionEntry.user_id == db_user.id
-                ).order_by(EmotionEntry.created_at.desc()).first()
+    async with db_session() as session_db:
+        try:
+            db_user = await user_cache.get(user_id)
+            if db_user:
+                # Add to therapy themes
+                await add_theme_from_thought_diary(db_user.id, entry_text)
+                logger.info(f"User {user_id}: Added therapy theme from thought diary: {entry_text[:50]}...")
                 
-                if latest_entry_in_session:
-                    # Keep the full conversation but mark it for therapy
-                    updated_text = f"Отмечено для проработки с терапевтом:\n{full_conversation_text}"
-                    latest_entry_in_session.answer_text = updated_text
-                    session_db.add(latest_entry_in_session)
-                    session_db.commit()
-                    logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} marked for work with full conversation.")
-        else:
-            logger.warning(f"User {user_id}: No db_user found for marking therapy theme.")
-            
-    except Exception as e:
-        logger.error(f"Error processing mark_for_work for user {user_id}: {e}")
-        session_db.rollback()
-    finally:
-        close_session(session_db)
+                # Update the emotion entry with therapy work marker
+                if conversation_history:
+                    # Requery the latest entry in the current session to avoid session mixing
+                    latest_entry_in_session = await latest_emotion_entry(session_db, db_user.id)
+                    
+                    if latest_entry_in_session:
+                        # Keep the full conversation but mark it for therapy
+                        updated_text = f"Отмечено для проработки с терапевтом:\n{full_conversation_text}"
+                        latest_entry_in_session.answer_text = updated_text
+                        await session_db.commit()
+                        logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} marked for work with full conversation.")
+            else:
+                logger.warning(f"User {user_id}: No db_user found for marking therapy theme.")
+                
+        except Exception as e:
+            logger.error(f"Error processing mark_for_work for user {user_id}: {e}")
+            await session_db.rollback()
 
     await callback_query.message.edit_text("Ваша запись отмечена для проработки с психотерапевтом.") # Edit previous message
     await delete_previous_messages(callback_query.message, state, keep_current=True) # Keep the edited message
@@ -433,36 +419,31 @@ async def process_recommendation_helped(callback_query: types.CallbackQuery, sta
     last_entry = await get_latest_emotion_entry(user_id) # Or pass entry ID
 
     if last_entry:
-        session_db = get_session()
-        try:
-            # Get the database user to get the correct internal user_id
-            db_user = session_db.query(User).filter(User.telegram_id == user_id).first()
-            if not db_user:
-                logger.error(f"User with telegram_id {user_id} not found in database")
-                return
-            
-            # Requery the latest entry in the current session to avoid session mixing
-            latest_entry_in_session = session_db.query(EmotionEntry).filter(
-                EmotionEntry.user_id == db_user.id
-            ).order_by(EmotionEntry.created_at.desc()).first()
-            
-            if latest_entry_in_session:
-                # Store conversation history with note that AI recommendation helped
-                if conversation_history:
-                    full_conversation_text = "\n".join([f"Сообщение {i+1}: {msg}" for i, msg in enumerate(conversation_history)])
-                    latest_entry_in_session.answer_text = f"AI рекомендация помогла:\n{full_conversation_text}"
+        async with db_session() as session_db:
+            try:
+                # Get the database user to get the correct internal user_id
+                db_user = await user_cache.get(user_id)
+                if not db_user:
+                    logger.error(f"User with telegram_id {user_id} not found in database")
+                    return
+                
+                # Requery the latest entry in the current session to avoid session mixing
+                latest_entry_in_session = await latest_emotion_entry(session_db, db_user.id)
+                
+                if latest_entry_in_session:
+                    # Store conversation history with note that AI recommendation helped
+                    if conversation_history:
+                        full_conversation_text = "\n".join([f"Сообщение {i+1}: {msg}" for i, msg in enumerate(conversation_history)])
+                        latest_entry_in_session.answer_text = f"AI рекомендация помогла:\n{full_conversation_text}"
+                    else:
+                        latest_entry_in_session.answer_text = f"AI рекомендация помогла: {last_ai_recommendation[:200]}"
+                    await session_db.commit()
+                    logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} updated with conversation history and AI helped marker.")
                 else:
-                    latest_entry_in_session.answer_text = f"AI рекомендация помогла: {last_ai_recommendation[:200]}"
-                session_db.add(latest_entry_in_session)
-                session_db.commit()
-                logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} updated with conversation history and AI helped marker.")
-            else:
-                logger.warning(f"User {user_id}: No latest entry found for recommendation_helped.")
-        except Exception as e:
-            logger.error(f"Error updating DB for recommendation_helped for user {user_id}: {e}")
-            session_db.rollback()
-        finally:
-            close_session(session_db)
+                    logger.warning(f"User {user_id}: No latest entry found for recommendation_helped.")
+            except Exception as e:
+                logger.error(f"Error updating DB for recommendation_helped for user {user_id}: {e}")
+                await session_db.rollback()
     else:
         logger.warning(f"User {user_id}: No last_entry found for recommendation_helped.")
     
@@ -529,8 +510,7 @@ async def process_reconsider_advice(callback_query: types.CallbackQuery, state:
         prompt = f"Пользователь рассказал о проблеме в ходе разговора:\n{conversation_context}\n\nПредыдущий совет был: '{last_ai_recommendation}'. (Эмоция/состояние не найдено для специфического промпта). Пожалуйста, дай ДРУГОЙ совет на основе всей информации. Не используй markdown."
     
     try:
-        response_content = client.models.generate_content(model="gemini-2.0-flash", contents=[prompt])
-        ai_text = response_content.text if hasattr(response_content, 'text') else str(response_content)
+        ai_text = await generate_content([prompt])
     except Exception as e:
         logger.error(f"Error generating AI reconsideration for user {user_id}: {e}")
         ai_text = "Вот еще один совет: попробуйте сфокусироваться на маленьких шагах, которые вы можете предпринять прямо сейчас."
@@ -572,51 +552,39 @@ async def process_mark_for_work_after_not_helped(callback_query: types.CallbackQ
     ai_text_that_did_not_help = data.get('last_ai_recommendation', 'AI advice not found') 
 
     # Get user from database for therapy theme
-    session_db = get_session()
-    try:
-        db_user = session_db.query(User).filter(User.telegram_id == user_id).first()
-        if db_user:
-            # Add to therapy themes with context that AI didn't help (using only first message)
-            theme_text = f"{first_message} (AI совет не помог: {ai_text_that_did_not_help[:100]})"
-            await add_theme_from_thought_diary(db_user.id, theme_text)
-            logger.info(f"User {user_id}: Added therapy theme after AI not helpful: {first_message[:50]}...")
-            
-            # Update the emotion entry with full conversation history
-            if conversation_history:
-                full_conversation_text = "\n".join([f"Сообщение {i+1}: {msg}" for i, msg in enumerate(conversation_history)])
-                
-                # Check if entry exists, if not create it first
-                latest_entry_in_session = session_db.query(EmotionEntry).filter(
-                    EmotionEntry.user_id == db_user.id
-                ).order_by(EmotionEntry.created_at.desc()).first()
-                
-                if not latest_entry_in_session:
-                    # Create new entry if none exists
-                    await save_emotion_entry(callback_query, state, emotion_type_from_flow="negative", text_entry=full_conversation_text)
-                    # Requery after creation
-                    latest_entry_in_session = session_db.query(EmotionEntry).filter(
-                        EmotionEntry.user_id == db_user.id
-                    ).order_by(EmotionEntry.created_at.desc()).first()
+    async with db_session() as session_db:
+        try:
+            db_user = await user_cache.get(user_id)
+            if db_user:
+                # Add to therapy themes with context that AI didn't help (using only first message)
+                theme_text = f"{first_message} (AI совет не помог: {ai_text_that_did_not_help[:100]})"
+                await add_theme_from_thought_diary(db_user.id, theme_text)
+                logger.info(f"User {user_id}: Added therapy theme after AI not helpful: {first_message[:50]}...")
                 
-                # Requery the latest entry in the current session to avoid session mixing
-                latest_entry_in_session = session_db.query(EmotionEntry).filter(
-                    EmotionEntry.user_id == db_user.id
-                ).order_by(EmotionEntry.created_at.desc()).first()
+                # Update the emotion entry with full conversation history
+                if conversation_history:
+                    full_conversation_text = "\n".join([f"Сообщение {i+1}: {msg}" for i, msg in enumerate(conversation_history)])
+                    
+                    # Check if entry exists, if not create it first (save_emotion_entry shares this task's session)
+                    latest_entry_in_session = await latest_emotion_entry(session_db, db_user.id)
+                    
+                    if not latest_entry_in_session:
+                        # Create new entry if none exists
+                        await save_emotion_entry(callback_query, state, emotion_type_from_flow="negative", text_entry=full_conversation_text)
+                        # Requery after creation
+                        latest_entry_in_session = await latest_emotion_entry(session_db, db_user.id)
+                    
+                    if latest_entry_in_session:
+                        updated_text = f"Отмечено для проработки с терапевтом (AI совет не помог):\n{full_conversation_text}"
+                        latest_entry_in_session.answer_text = updated_text
+                        await session_db.commit()
+                        logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} marked for work after AI not helpful with full conversation.")
+            else:
+                logger.warning(f"User {user_id}: No db_user found for marking therapy theme after not helped.")
                 
-                if latest_entry_in_session:
-                    updated_text = f"Отмечено для проработки с терапевтом (AI совет не помог):\n{full_conversation_text}"
-                    latest_entry_in_session.answer_text = updated_text
-                    session_db.add(latest_entry_in_session)
-                    session_db.commit()
-                    logger.info(f"User {user_id}: DB entry {latest_entry_in_session.id} marked for work after AI not helpful with full conversation.")
-        else:
-            logger.warning(f"User {user_id}: No db_user found for marking therapy theme after not helped.")
-            
-    except Exception as e:
-        logger.error(f"Error processing mark_for_work_after_not_helped for user {user_id}: {e}")
-        session_db.rollback()
-    finally:
-        close_session(session_db)
+        except Exception as e:
+            logger.error(f"Error processing mark_for_work_after_not_helped for user {user_id}: {e}")
+            await session_db.rollback()
 
     await callback_query.message.edit_text("Ваш опыт отмечен для проработки с психотерапевтом.")
     await delete_previous_messages(callback_query.message, state, keep_current=True)
@@ -651,44 +619,41 @@ async def process_generic_back_to_main(callback_query: types.CallbackQuery, stat
 
 
 async def save_emotion_entry(source_event: types.Message | types.CallbackQuery, state: FSMContext, emotion_type_from_flow: str = None, text_entry: str = None):
-    session = get_session()
-    try:
-        telegram_user_id = source_event.from_user.id
-        data = await state.get_data()
-        
-        # Get the database user to get the correct internal user_id
-        db_user = session.query(User).filter(User.telegram_id == telegram_user_id).first()
-        if not db_user:
-            logger.error(f"User with telegram_id {telegram_user_id} not found in database")
-            return
-        
-        # From emotion diary flow (passed via FSM data)
-        selected_state_from_emotion_diary = data.get('selected_state') 
-        selected_option_from_emotion_diary = data.get('selected_option')
-        
-        # This is 'positive' or 'negative', set in handle_emotion_choice or process_entry
-        current_emotion_category = data.get('current_emotion_type', emotion_type_from_flow)
-
-        # The detailed text provided by the user in the thought diary
-        final_answer_text = text_entry if text_entry is not None else data.get('negative_entry_text', "No detailed text provided.")
-
-        entry = EmotionEntry(
-            user_id=db_user.id,  # Use database internal user_id, not telegram_user_id
-            emotion_type=current_emotion_category, # 'positive'/'negative'
-            answer_text=final_answer_text, # User's detailed text
-            state=selected_state_from_emotion_diary, # e.g. "bad_state_1"
-            option=selected_option_from_emotion_diary # e.g. "option_0"
-        )
-        session.add(entry)
-        session.commit()
-        session.refresh(entry) # To get the ID if needed
-        await state.update_data(current_emotion_entry_id=entry.id) # Store current entry ID
-        logger.info(f"Saved emotion entry ID {entry.id} for user {db_user.id} (telegram_id: {telegram_user_id}): category={current_emotion_category}, state={selected_state_from_emotion_diary}, option={selected_option_from_emotion_diary}")
-    except Exception as e:
-        logger.error(f"Error saving emotion entry for user {telegram_user_id}: {e}")
-        session.rollback()
-    finally:
-        close_session(session)
+    telegram_user_id = source_event.from_user.id
+    async with db_session() as session:
+        try:
+            data = await state.get_data()
+            
+            # Get the database user to get the correct internal user_id
+            db_user = await user_cache.get(telegram_user_id)
+            if not db_user:
+                logger.error(f"User with telegram_id {telegram_user_id} not found in database")
+                return
+            
+            # From emotion diary flow (passed via FSM data)
+            selected_state_from_emotion_diary = data.get('selected_state') 
+            selected_option_from_emotion_diary = data.get('selected_option')
+            
+            # This is 'positive' or 'negative', set in handle_emotion_choice or process_entry
+            current_emotion_category = data.get('current_emotion_type', emotion_type_from_flow)
+
+            # The detailed text provided by the user in the thought diary
+            final_answer_text = text_entry if text_entry is not None else data.get('negative_entry_text', "No detailed text provided.")
+
+            entry = EmotionEntry(
+                user_id=db_user.id,  # Use database internal user_id, not telegram_user_id
+                emotion_type=current_emotion_category, # 'positive'/'negative'
+                answer_text=final_answer_text, # User's detailed text
+                state=selected_state_from_emotion_diary, # e.g. "bad_state_1"
+                option=selected_option_from_emotion_diary # e.g. "option_0"
+            )
+            session.add(entry)
+            await session.commit() # expire_on_commit=False keeps entry.id loaded
+            await state.update_data(current_emotion_entry_id=entry.id) # Store current entry ID
+            logger.info(f"Saved emotion entry ID {entry.id} for user {db_user.id} (telegram_id: {telegram_user_id}): category={current_emotion_category}, state={selected_state_from_emotion_diary}, option={selected_option_from_emotion_diary}")
+        except Exception as e:
+            logger.error(f"Error saving emotion entry for user {telegram_user_id}: {e}")
+            await session.rollback()
 
 
 async def generate_follow_up_question(conversation_history: list) -> str:
@@ -721,13 +686,7 @@ async def generate_follow_up_question(conversation_history: list) -> str:
 - "Как долго вы это переживаете?"
 """
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=[prompt]
-        )
-        
-        question = response.text if hasattr(response, 'text') else str(response)
-        return question.strip()
+        return await generate_content([prompt])
         
     except Exception as e:
         logger.error(f"Error generating follow-up question: {e}")
@@ -740,28 +699,34 @@ async def generate_follow_up_question(conversation_history: list) -> str:
         ]
         return random.choice(fallback_questions)
 
+async def latest_emotion_entry(session, user_id: int):
+    """Latest emotion entry of a user (internal user ID) in the given async session"""
+    result = await session.execute(
+        select(EmotionEntry).where(EmotionEntry.user_id == user_id).order_by(EmotionEntry.created_at.desc()).limit(1)
+    )
+    return result.scalars().first()
+
 async def get_latest_emotion_entry(telegram_user_id: int, entry_id: int = None):
-    session = get_session()
-    try:
-        # Get the database user to get the correct internal user_id
-        db_user = session.query(User).filter(User.telegram_id == telegram_user_id).first()
-        if not db_user:
-            logger.error(f"User with telegram_id {telegram_user_id} not found in database")
+    async with db_session() as session:
+        try:
+            # Get the database user to get the correct internal user_id
+            db_user = await user_cache.get(telegram_user_id)
+            if not db_user:
+                logger.error(f"User with telegram_id {telegram_user_id} not found in database")
+                return None
+            
+            if entry_id:
+                result = await session.execute(
+                    select(EmotionEntry).where(EmotionEntry.id == entry_id, EmotionEntry.user_id == db_user.id)
+                )
+                entry = result.scalars().first()
+            else: # Fallback to latest if no ID provided, though using ID is safer
+                entry = await latest_emotion_entry(session, db_user.id)
+            
+            return entry
+        except Exception as e:
+            logger.error(f"Error fetching emotion entry for user {telegram_user_id} (entry_id: {entry_id}): {e}")
             return None
-        
-        if entry_id:
-            entry = session.query(EmotionEntry).filter_by(id=entry_id, user_id=db_user.id).first()
-        else: # Fallback to latest if no ID provided, though using ID is safer
-            entry = session.query(EmotionEntry).filter_by(user_id=db_user.id).order_by(EmotionEntry.created_at.desc()).first()
-        
-        if entry:
-             session.expunge(entry) # Detach from session before returning
-        return entry
-    except Exception as e:
-        logger.error(f"Error fetching emotion entry for user {telegram_user_id} (entry_id: {entry_id}): {e}")
-        return None
-    finally:
-        close_session(session)
 
 # The old thought_diary_handler is no longer needed as its logic is distributed
 # among the new state-specific handlers.
@@ -14,7 +14,6 @@ from aiogram import Router, F, types
 from aiogram.types import Message, Voice, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
-import openai
 from dotenv import load_dotenv
 from pydub import AudioSegment
 from src.constants import VOICE_TRANSCRIPTION_CONFIRMATION
@@ -22,46 +21,19 @@ from src.database.models import User
 from src.database.session import get_session, close_session
 from src.handlers.utils import delete_previous_messages
 from src.trial_manager import require_trial_access
+from src.llm_gateway import get_voice_client, transcribe_audio
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 router = Router(name=__name__)
 
-# Configure OpenAI client with proxy support
-def get_openai_client():
-    """Get OpenAI client with proxy configuration if available"""
-    api_key = os.getenv("GOOGLE_GENAI_API_KEY")
-    if not api_key:
-        logger.error("GOOGLE_GENAI_API_KEY not found in environment variables")
-        return None
-    
-    # Check for proxy configuration
-    proxy_url = os.getenv("VOICE_API_URL")
-    
-    if proxy_url:
-        # Configure client with proxy
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url=proxy_url,
-            # Add timeout and other configurations as needed
-            timeout=60.0
-        )
-        logger.info(f"OpenAI client configured with voice proxy: {proxy_url}")
-    else:
-        # Standard OpenAI client
-        client = openai.OpenAI(api_key=api_key)
-        logger.info("OpenAI client configured with standard endpoint")
-    
-    return client
-
 async def transcribe_voice_message(voice: Voice, bot) -> Optional[str]:
     """
     Download voice message, convert to MP3, and transcribe it using OpenAI
     Returns transcribed text or None if transcription fails
     """
-    client = get_openai_client()
-    if not client:
+    if not get_voice_client():
         return None
     
     oga_temp_path = None
@@ -90,14 +62,7 @@ async def transcribe_voice_message(voice: Voice, bot) -> Optional[str]:
         
         try:
             # Transcribe using the MP3 file
-            with open(mp3_temp_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="gpt-4o-transcribe",
-                    file=audio_file,
-                    language="ru"
-                )
-            
-            transcribed_text = transcription.text.strip()
+            transcribed_text = await transcribe_audio(mp3_temp_path, language="ru")
             logger.info(f"Voice message transcribed successfully. Length: {len(transcribed_text)} characters")
             return transcribed_text
             
@@ -13,11 +13,10 @@ from src.constants import (
     WEEKLY_REFLECTION_NEW_DISCOVERY,
     WEEKLY_REFLECTION_GRATITUDE
 )
-from google import genai
+from src.llm_gateway import generate_content
 from src.handlers.utils import delete_previous_messages
 from src.trial_manager import require_trial_access
 
-import os
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,12 +24,6 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 router = Router(name=__name__)
 
-# Initialize Google Generative AI client
-client = genai.Client(
-    api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
-    http_options={"base_url": os.environ.get("API_URL")}
-)
-
 async def delete_previous_messages(message: Message, state: FSMContext, keep_current: bool = False):
     """Helper function to delete previous messages"""
     data = await state.get_data()
@@ -469,19 +462,17 @@ async def generate_ai_summary(weekly_reflection_data: dict) -> str:
 Пиши от третьего лица, используя прошедшее время.
 """
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[{
+        return await generate_content(
+            [{
                 "role": "user",
                 "parts": [{"text": prompt}]
             }],
+            model="gemini-1.5-flash",
             config={
                 "max_output_tokens": 200,
                 "temperature": 0.7
             }
         )
-        
-        return response.candidates[0].content.parts[0].text.strip()
     
     except Exception as e:
         logger.error(f"Google Generative AI API error: {e}")
@@ -507,19 +498,17 @@ async def generate_ai_completion_message(weekly_reflection_data: dict, user_name
 Добавь подходящий эмодзи в конце.
 """
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[{
+        return await generate_content(
+            [{
                 "role": "user",
                 "parts": [{"text": prompt}]
             }],
+            model="gemini-1.5-flash",
             config={
                 "max_output_tokens": 150,
                 "temperature": 0.8
             }
         )
-        
-        return response.candidates[0].content.parts[0].text.strip()
     
     except Exception as e:
         logger.error(f"Google Generative AI API error: {e}")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+LLM Gateway for PsyBot
+Shared async Gemini and OpenAI clients with per-call timeouts and a concurrency cap
+"""
+
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+import httpx
+import openai
+from dotenv import load_dotenv
+from google import genai
+from src.llm_health import health_monitor, ProviderUnavailableError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = "gemini-2.0-flash"
+OPENAI_CHAT_MODEL = "gpt-4o"
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+TRANSCRIPTION_MODEL = "gpt-4o-transcribe"
+
+# Seconds before a single LLM call is abandoned
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+TRANSCRIPTION_TIMEOUT = float(os.getenv("TRANSCRIPTION_TIMEOUT", "60"))
+# Maximum number of LLM calls in flight across all handlers
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "10"))
+
+class EmptyResponseError(Exception):
+    """Raised when a model returns no text (empty or safety-blocked response)"""
+
+_gemini_client: Optional[genai.Client] = None
+_openai_clients: Dict[str, openai.AsyncOpenAI] = {}
+_voice_client: Optional[openai.AsyncOpenAI] = None
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+def get_gemini_client() -> genai.Client:
+    """Get the shared Gemini client (its .aio interface is used for async calls)"""
+    global _gemini_client
+    if _gemini_client is None:
+        _gemini_client = genai.Client(
+            api_key=os.environ.get("GOOGLE_GENAI_API_KEY"),
+            http_options={"base_url": os.environ.get("API_URL")}
+        )
+    return _gemini_client
+
+def get_openai_client(api_key: str = None) -> openai.AsyncOpenAI:
+    """Get a shared async OpenAI client, one per API key so connections are reused"""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    client = _openai_clients.get(api_key)
+    if client is None:
+        client = openai.AsyncOpenAI(api_key=api_key, timeout=LLM_TIMEOUT)
+        _openai_clients[api_key] = client
+    return client
+
+def get_voice_client() -> Optional[openai.AsyncOpenAI]:
+    """Get the shared async client for voice transcription (optionally behind VOICE_API_URL)"""
+    global _voice_client
+    if _voice_client is None:
+        api_key = os.getenv("GOOGLE_GENAI_API_KEY")
+        if not api_key:
+            logger.error("GOOGLE_GENAI_API_KEY not found in environment variables")
+            return None
+
+        proxy_url = os.getenv("VOICE_API_URL")
+        if proxy_url:
+            _voice_client = openai.AsyncOpenAI(api_key=api_key, base_url=proxy_url, timeout=TRANSCRIPTION_TIMEOUT)
+            logger.info(f"OpenAI client configured with voice proxy: {proxy_url}")
+        else:
+            _voice_client = openai.AsyncOpenAI(api_key=api_key, timeout=TRANSCRIPTION_TIMEOUT)
+            logger.info("OpenAI client configured with standard endpoint")
+    return _voice_client
+
+def is_provider_failure(error: Exception) -> bool:
+    """
+    Whether an error means the provider itself is struggling
+
+    Only timeouts, connection errors, rate limits (429) and server errors (5xx)
+    count towards opening a provider's circuit; bad requests, auth errors and
+    rejected prompts are the caller's problem and must not block other users.
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    # openai.APIStatusError has status_code, google.genai.errors.APIError has code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+async def _call(coro, timeout: float, provider: str):
+    """Run an LLM request under the concurrency cap with a timeout, reporting the outcome to the health monitor"""
+    if not health_monitor.allow_request(provider):
+        coro.close()
+        raise ProviderUnavailableError(f"LLM provider {provider} is unavailable (circuit open)")
+    trial = health_monitor.is_half_open(provider)
+    async with _semaphore:
+        try:
+            result = await asyncio.wait_for(coro, timeout=timeout)
+        except Exception as e:
+            if is_provider_failure(e):
+                health_monitor.record_failure(provider, e)
+            elif trial:
+                health_monitor.end_trial(provider)
+            raise
+        except asyncio.CancelledError:
+            if trial:
+                health_monitor.end_trial(provider)
+            raise
+    health_monitor.record_success(provider)
+    return result
+
+async def generate_content(contents, model: str = GEMINI_MODEL, config: dict = None,
+                           timeout: float = LLM_TIMEOUT) -> str:
+    """
+    Generate text with Gemini without blocking the event loop
+
+    Args:
+        contents: Prompt string or list of contents
+        model: Gemini model name
+        config: Optional generation config (e.g. max_output_tokens, temperature)
+        timeout: Seconds before the call is abandoned
+
+    Returns:
+        Generated text
+
+    Raises:
+        asyncio.TimeoutError, the client error or EmptyResponseError; callers keep their own fallbacks
+    """
+    response = await _call(
+        get_gemini_client().aio.models.generate_content(model=model, contents=contents, config=config),
+        timeout,
+        "gemini"
+    )
+    text = (response.text or "").strip()
+    if not text:
+        raise EmptyResponseError(f"Gemini returned no text ({model})")
+    return text
+
+async def chat_completion(messages: List[dict], model: str = OPENAI_CHAT_MODEL, api_key: str = None,
+                          timeout: float = LLM_TIMEOUT, **kwargs) -> str:
+    """
+    Run an OpenAI chat completion and return the answer text
+
+    Args:
+        messages: Chat messages
+        model: OpenAI chat model
+        api_key: Optional API key (defaults to OPENAI_API_KEY)
+        timeout: Seconds before the call is abandoned
+        **kwargs: Extra completion parameters (max_tokens, temperature, ...)
+    """
+    response = await _call(
+        get_openai_client(api_key).chat.completions.create(model=model, messages=messages, **kwargs),
+        timeout,
+        "openai"
+    )
+    return response.choices[0].message.content.strip()
+
+async def create_embeddings(texts: List[str], model: str = OPENAI_EMBEDDING_MODEL, api_key: str = None,
+                            timeout: float = LLM_TIMEOUT) -> List[List[float]]:
+    """
+    Embed texts with OpenAI in a single request
+
+    Returns:
+        Embeddings in the same order as texts
+    """
+    response = await _call(
+        get_openai_client(api_key).embeddings.create(
+            model=model,
+            input=[text.replace("\n", " ") for text in texts]
+        ),
+        timeout,
+        "openai"
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def transcribe_audio(path: str, language: str = "ru", model: str = TRANSCRIPTION_MODEL,
+                           timeout: float = TRANSCRIPTION_TIMEOUT) -> Optional[str]:
+    """
+    Transcribe an audio file
+
+    Returns:
+        Transcribed text or None if no voice client is configured
+    """
+    client = get_voice_client()
+    if not client:
+        return None
+
+    with open(path, "rb") as audio_file:
+        transcription = await _call(
+            client.audio.transcriptions.create(model=model, file=audio_file, language=language),
+            timeout,
+            "voice"
+        )
+    return transcription.text.strip()
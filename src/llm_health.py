@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+LLM Health Monitor for PsyBot
+Cached provider status with circuit-breaker semantics, refreshed in the background
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a probe result stays fresh
+HEALTH_TTL = 60
+# Consecutive failures that open the circuit
+FAILURE_THRESHOLD = 3
+# Seconds an open circuit waits before letting a trial request through
+OPEN_COOLDOWN = 30
+# Seconds after which a trial request that never reported back no longer blocks the next one
+TRIAL_TIMEOUT = 120
+
+class ProviderUnavailableError(Exception):
+    """Raised instead of calling a provider whose circuit is open"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class ProviderHealth:
+    """Circuit breaker state of a single LLM provider"""
+
+    def __init__(self, name: str, probe: Callable[[], Awaitable[None]],
+                 failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = OPEN_COOLDOWN):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def is_available(self) -> bool:
+        """Check cached status; an open circuit lets requests through again after the cooldown"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            logger.info(f"LLM provider {self.name}: circuit half-open, allowing a trial request")
+        return self.state != OPEN
+
+    def allow_request(self) -> bool:
+        """Admit a real request: all of them while closed, one trial at a time while half-open"""
+        if not self.is_available():
+            return False
+        if self.state == HALF_OPEN:
+            now = time.monotonic()
+            if self.trial_started is not None and now - self.trial_started < TRIAL_TIMEOUT:
+                return False
+            self.trial_started = now
+        return True
+
+    def end_trial(self) -> None:
+        """Free the trial slot after a request that told nothing about the provider's health"""
+        self.trial_started = None
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info(f"LLM provider {self.name}: circuit closed")
+        self.state = CLOSED
+        self.failures = 0
+        self.trial_started = None
+        self.last_error = None
+        self.checked_at = time.monotonic()
+
+    def record_failure(self, error: Exception) -> None:
+        self.failures += 1
+        self.trial_started = None
+        self.last_error = str(error)[:200]
+        self.checked_at = time.monotonic()
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"LLM provider {self.name}: circuit opened after {self.failures} failures ({self.last_error})")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def is_stale(self, ttl: float) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at >= ttl
+
+    async def check(self) -> bool:
+        """Run the probe and update the cached state"""
+        try:
+            await self.probe()
+            self.record_success()
+        except Exception as e:
+            self.record_failure(e)
+        return self.state != OPEN
+
+async def _probe_openai() -> None:
+    """Lightweight OpenAI probe: model metadata lookup, no tokens billed"""
+    from src.llm_gateway import get_openai_client, OPENAI_CHAT_MODEL, LLM_TIMEOUT
+    await asyncio.wait_for(get_openai_client().models.retrieve(OPENAI_CHAT_MODEL), timeout=LLM_TIMEOUT)
+
+async def _probe_gemini() -> None:
+    """Lightweight Gemini probe: model metadata lookup, no tokens billed"""
+    from src.llm_gateway import get_gemini_client, GEMINI_MODEL, LLM_TIMEOUT
+    await asyncio.wait_for(get_gemini_client().aio.models.get(model=GEMINI_MODEL), timeout=LLM_TIMEOUT)
+
+class HealthMonitor:
+    """
+    Keeps provider health cached so handlers never probe inline.
+
+    Real LLM calls made through the gateway also report success/failure,
+    so probes only run for providers that have been idle longer than the TTL.
+    """
+
+    def __init__(self, ttl: float = HEALTH_TTL):
+        self.ttl = ttl
+        self.providers: Dict[str, ProviderHealth] = {
+            "openai": ProviderHealth("openai", _probe_openai),
+            "gemini": ProviderHealth("gemini", _probe_gemini),
+        }
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+
+    def is_available(self, provider: str) -> bool:
+        """Cached availability of a provider (unknown providers count as available)"""
+        health = self.providers.get(provider)
+        return health.is_available() if health else True
+
+    def allow_request(self, provider: str) -> bool:
+        """
+        Admit a real LLM call (unknown providers are always admitted)
+
+        A half-open circuit admits a single trial request; the others are
+        refused until it reports a success or failure.
+        """
+        health = self.providers.get(provider)
+        return health.allow_request() if health else True
+
+    def is_half_open(self, provider: str) -> bool:
+        health = self.providers.get(provider)
+        return health is not None and health.state == HALF_OPEN
+
+    def end_trial(self, provider: str) -> None:
+        health = self.providers.get(provider)
+        if health:
+            health.end_trial()
+
+    def record_success(self, provider: str) -> None:
+        health = self.providers.get(provider)
+        if health:
+            health.record_success()
+
+    def record_failure(self, provider: str, error: Exception) -> None:
+        health = self.providers.get(provider)
+        if health:
+            health.record_failure(error)
+
+    def status(self) -> Dict[str, dict]:
+        return {
+            name: {"state": health.state, "failures": health.failures, "last_error": health.last_error}
+            for name, health in self.providers.items()
+        }
+
+    async def refresh(self) -> None:
+        """Probe providers whose cached status is older than the TTL"""
+        stale = [health for health in self.providers.values() if health.is_stale(self.ttl)]
+        if stale:
+            await asyncio.gather(*(health.check() for health in stale))
+
+    async def run(self) -> None:
+        """Background refresh loop"""
+        logger.info("🩺 LLM health monitor started")
+        self.running = True
+        while self.running:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error in LLM health monitor: {e}")
+            await asyncio.sleep(self.ttl / 2)
+
+    def start(self) -> asyncio.Task:
+        """Start the background loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# Shared monitor read by handlers and fed by the LLM gateway
+health_monitor = HealthMonitor()
@@ -5,7 +5,6 @@ from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BotCommand
 from src.database.models import User
 from src.database.session import get_session, close_session
@@ -24,7 +23,16 @@ from src.handlers.therapy_themes import router as therapy_themes_router
 from src.handlers.relaxation import router as relaxation_router
 from src.handlers.voice_handler import router as voice_handler_router
 from src.notification_scheduler import NotificationScheduler
-from src.activity_tracker import update_user_activity
+from src.activity_tracker import update_user_activity, activity_buffer
+from src.schedule_index import schedule_index
+from src.llm_health import health_monitor
+from src.user_cache import user_cache
+from src.database.async_session import dispose_async_engine
+from src.fsm_storage import SQLiteStorage
+from src.report_renderer import report_renderer
+from src.report_precompute import ReportPrecomputer, REPORT_PRECOMPUTE
+# Also registers the ORM events that count new emotion entries into the daily rollups
+from src.emotion_rollup import ensure_rollup_table
 
 # Load environment variables
 load_dotenv()
@@ -36,8 +44,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# "polling" (default, for development) or "webhook" (see src/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Run the notification scheduler inside the bot process; set to false when
+# it runs as its own worker (python -m src.scheduler_worker)
+SCHEDULER_EMBEDDED = os.getenv("SCHEDULER_EMBEDDED", "true").lower() in ("1", "true", "yes")
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# FSM state survives restarts; flushed and closed by the dispatcher on shutdown
+dp = Dispatcher(storage=SQLiteStorage())
 
 # Activity tracking middleware
 from aiogram.types import TelegramObject
@@ -47,7 +61,7 @@ class ActivityTrackingMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: TelegramObject, data: dict):
         # Track activity for messages and callback queries
         if hasattr(event, 'from_user') and event.from_user:
-            update_user_activity(event.from_user.id)
+            await update_user_activity(event.from_user.id)
         
         # Call the next handler
         return await handler(event, data)
@@ -126,11 +140,9 @@ async def delete_previous_messages(message: types.Message, state: FSMContext, ke
 
 @dp.message(CommandStart())
 async def cmd_start(message: types.Message, state: FSMContext):
-    session = get_session()
-    db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
+    profile = await user_cache.get(message.from_user.id)
 
-    if db_user and getattr(db_user, "registration_complete", False):
-        close_session(session)
+    if profile and getattr(profile, "registration_complete", False):
         await state.clear()  # Clear previous state for a registered user
 
         # main_menu will add the /start message (message.message_id)
@@ -142,6 +154,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
         return
 
     # Path for new users or users with incomplete registration
+    session = get_session()
+    db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
     if not db_user:
         db_user = User(
             telegram_id=message.from_user.id,
@@ -377,6 +391,7 @@ async def save_timezone_from_time(message: types.Message, state: FSMContext):
     db_user.timezone_offset = timezone_offset
     db_user.user_timezone = user_timezone
     session.commit()
+    schedule_index.sync_user(db_user)
     close_session(session)
     
     # Ask for notification frequency preference
@@ -411,6 +426,7 @@ async def save_notification_frequency(callback: types.CallbackQuery, state: FSMC
     db_user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
     db_user.notification_frequency = frequency
     session.commit()
+    schedule_index.sync_user(db_user)
     close_session(session)
     
     # Create personalized message based on notification preference
@@ -533,6 +549,7 @@ async def save_referral_and_complete_registration(message_or_callback, state: FS
     start_trial_period(db_user)
     
     session.commit()
+    schedule_index.sync_user(db_user)
     
     # Save important details before closing the session
     committed_full_name = db_user.full_name
@@ -612,6 +629,7 @@ async def reset_user(message: types.Message, state: FSMContext):
     session = get_session()
     db_user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
     if db_user:
+        schedule_index.remove_user(db_user.id)
         session.delete(db_user)
         session.commit()
     close_session(session)
@@ -639,25 +657,54 @@ async def main():
     # Set up bot commands
     await setup_bot_commands()
     
+    # Daily emotion rollups of databases not migrated yet (before webhook workers start)
+    await asyncio.to_thread(ensure_rollup_table)
+    
     # Initialize and start the notification scheduler as a background task
-    scheduler = NotificationScheduler()
-    scheduler_task = asyncio.create_task(scheduler.run_scheduler())
+    # (leased, so only one bot replica or scheduler worker sends each reminder)
+    scheduler = scheduler_task = None
+    if SCHEDULER_EMBEDDED:
+        scheduler = NotificationScheduler()
+        scheduler_task = asyncio.create_task(scheduler.run_scheduler())
     
-    logger.info("🤖 Starting PsyBot with notification scheduler...")
+    # Keep LLM provider health cached so handlers don't probe inline
+    health_monitor.start()
+    
+    # Write last_activity timestamps in the background instead of once per update
+    activity_buffer.start()
+    
+    # Prepare weekly emotion reports during users' quiet hours (leased like the scheduler)
+    precomputer = ReportPrecomputer() if REPORT_PRECOMPUTE else None
+    if precomputer:
+        precomputer.start()
+    
+    logger.info(f"🤖 Starting PsyBot ({BOT_MODE}) with notification scheduler...")
     
     try:
-        # Start the bot polling
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            # Updates are handled by chat-partitioned worker processes
+            from src.webhook import run_webhook
+            await run_webhook(bot, dp)
+        else:
+            # Start the bot polling
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     finally:
         # Stop the scheduler when bot is shutting down
-        scheduler.stop()
-        scheduler_task.cancel()
-        try:
-            await scheduler_task
-        except asyncio.CancelledError:
-            logger.info("Notification scheduler stopped")
+        await health_monitor.stop()
+        await activity_buffer.stop()
+        if precomputer:
+            await precomputer.stop()
+        if scheduler_task:
+            scheduler.stop()
+            scheduler_task.cancel()
+            try:
+                await scheduler_task
+            except asyncio.CancelledError:
+                logger.info("Notification scheduler stopped")
+        await report_renderer.shutdown()
+        await dispose_async_engine()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Notification Ledger for PsyBot
+Persistent per-day bitmap of notifications already sent to each user
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Set, Tuple
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from src.database.models import NotificationLedger as LedgerRow
+from src.database.session import engine, get_session, close_session
+
+logger = logging.getLogger(__name__)
+
+# Bits 0-23 hold the hourly emotion diary reminder slots (user's local hour)
+SLOT_WEEKLY_MOTIVATION = 24
+SLOT_WEEKLY_REFLECTION = 25
+
+# Days kept before a user's ledger row expires
+RETENTION_DAYS = 2
+
+def day_key(local_time: datetime) -> int:
+    """Ledger day key for a user's local time"""
+    return local_time.date().toordinal()
+
+def reminder_slot(local_time: datetime) -> int:
+    """Ledger slot of an emotion diary reminder (reminders are scheduled on the hour)"""
+    return local_time.hour
+
+class NotificationLedger:
+    """
+    Dedup store of sent notifications keyed by (user_id, day) integers.
+
+    Each user has at most one row per local day holding a bitmap of sent
+    slots, mirrored in memory for the days still inside RETENTION_DAYS.
+    Marks are written back in one transaction per scheduler tick, so the
+    ledger survives restarts and old days expire on their own.
+    """
+
+    def __init__(self):
+        self._days: Dict[int, Dict[int, int]] = {}  # day -> user_id -> bitmap
+        self._dirty: Set[Tuple[int, int]] = set()
+        LedgerRow.__table__.create(engine, checkfirst=True)
+
+    def _load_day(self, day: int) -> Dict[int, int]:
+        """Get the in-memory bitmaps for a day, loading them from the database once"""
+        bitmaps = self._days.get(day)
+        if bitmaps is None:
+            session = get_session()
+            try:
+                rows = session.query(LedgerRow.user_id, LedgerRow.sent_slots).filter(LedgerRow.day == day).all()
+                bitmaps = {user_id: sent_slots for user_id, sent_slots in rows}
+            finally:
+                close_session(session)
+            self._days[day] = bitmaps
+        return bitmaps
+
+    def was_sent(self, user_id: int, day: int, slot: int) -> bool:
+        """Check if a slot was already sent to a user on a day"""
+        return bool(self._load_day(day).get(user_id, 0) >> slot & 1)
+
+    def mark_sent(self, user_id: int, day: int, slot: int) -> None:
+        """Mark a slot as sent; persisted on the next flush()"""
+        bitmaps = self._load_day(day)
+        bitmaps[user_id] = bitmaps.get(user_id, 0) | (1 << slot)
+        self._dirty.add((user_id, day))
+
+    def flush(self) -> int:
+        """
+        Write pending marks to the database in one transaction
+
+        Returns:
+            Number of rows written
+        """
+        if not self._dirty:
+            return 0
+
+        rows = [
+            {'user_id': user_id, 'day': day, 'sent_slots': self._days[day][user_id]}
+            for user_id, day in self._dirty
+            if day in self._days
+        ]
+        session = get_session()
+        try:
+            # Marks of other instances (e.g. before a lease moved) are OR-ed, never overwritten
+            upsert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(engine.dialect.name)
+            if upsert is not None:
+                statement = upsert(LedgerRow)
+                session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=['user_id', 'day'],
+                        set_={'sent_slots': LedgerRow.sent_slots.op('|')(statement.excluded.sent_slots)}
+                    ),
+                    rows
+                )
+            else:
+                for row in rows:
+                    stored = session.query(LedgerRow).filter(
+                        LedgerRow.user_id == row['user_id'], LedgerRow.day == row['day']
+                    ).with_for_update().first()
+                    if stored is not None:
+                        stored.sent_slots = stored.sent_slots | row['sent_slots']
+                    else:
+                        session.add(LedgerRow(**row))
+            session.commit()
+            self._dirty.clear()
+        except Exception as e:
+            logger.error(f"Failed to flush notification ledger: {e}")
+            session.rollback()
+            return 0
+        finally:
+            close_session(session)
+
+        return len(rows)
+
+    def reset(self) -> None:
+        """Write pending marks and drop the in-memory days so they are reloaded from the database"""
+        self.flush()
+        # Days with marks that failed to flush stay until they are written
+        dirty_days = {day for _, day in self._dirty}
+        self._days = {day: bitmaps for day, bitmaps in self._days.items() if day in dirty_days}
+
+    def purge_expired(self, now: datetime = None) -> int:
+        """
+        Drop ledger days older than RETENTION_DAYS from memory and the database
+
+        Returns:
+            Number of database rows removed
+        """
+        cutoff = day_key((now or datetime.now()) - timedelta(days=RETENTION_DAYS))
+        for day in [day for day in self._days if day < cutoff]:
+            del self._days[day]
+        self._dirty = {(user_id, day) for user_id, day in self._dirty if day >= cutoff}
+
+        session = get_session()
+        try:
+            removed = session.query(LedgerRow).filter(LedgerRow.day < cutoff).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Failed to purge notification ledger: {e}")
+            session.rollback()
+            return 0
+        finally:
+            close_session(session)
+
+        return removed
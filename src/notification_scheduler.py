@@ -8,13 +8,21 @@ import os
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 from dotenv import load_dotenv
 from aiogram import Bot
 from src.database.session import get_session, close_session
 from src.database.models import User, TherapySession
 from src.timezone_utils import SERVER_UTC_OFFSET
 from src.activity_tracker import is_user_actively_interacting
+from src.broadcast import BroadcastSender
+from src.scheduler_lease import PartitionLeases
+from src.notification_ledger import (
+    NotificationLedger, SLOT_WEEKLY_MOTIVATION, SLOT_WEEKLY_REFLECTION, day_key, reminder_slot
+)
+from src.schedule_index import (
+    NOTIFICATION_TIMES, WEEKLY_MOTIVATION, WEEKLY_REFLECTION, schedule_index, chunked
+)
 
 load_dotenv()
 
@@ -32,13 +40,13 @@ bot = Bot(token=TELEGRAM_BOT_TOKEN)
 class NotificationScheduler:
     def __init__(self):
         self.running = False
-        self.notification_times = {
-            1: ["16:00"],  # 1 time per day - noon
-            2: ["12:00", "17:00"],  # 2 times per day - morning and evening
-            4: ["12:00", "15:00", "17:00", "20:00"],  # 4 times per day
-            6: ["11:00", "13:00", "15:00", "17:00", "19:00", "21:00"]  # 6 times per day
-        }
-        self.sent_today = {}  # Track sent notifications per user per day
+        self.notification_times = NOTIFICATION_TIMES
+        self.schedule_index = schedule_index  # UTC minute -> users due a reminder
+        self.sender = BroadcastSender(bot)  # Rate-limited concurrent delivery
+        self.ledger = NotificationLedger()  # Persistent (user_id, day) -> sent slots bitmap
+        self.ledger_purged_day = None
+        self.leases = PartitionLeases()  # Partitions of users this instance may send to
+        self.partitions_held: Set[int] = set()
     
     async def send_emotion_diary_reminder(self, user: User) -> bool:
         """Send emotion diary reminder to a specific user"""
@@ -70,7 +78,7 @@ class NotificationScheduler:
                 f"💡 Помни: отслеживание эмоций помогает лучше понимать себя!"
             )
             
-            await bot.send_message(
+            await self.sender.send_message(
                 chat_id=user.telegram_id,
                 text=message_text
             )
@@ -96,7 +104,7 @@ class NotificationScheduler:
             import random
             message_text = random.choice(motivational_messages)
             
-            await bot.send_message(
+            await self.sender.send_message(
                 chat_id=user.telegram_id,
                 text=message_text
             )
@@ -123,7 +131,7 @@ class NotificationScheduler:
                 f"💡 Рефлексия поможет лучше усвоить полученные инсайты и подготовиться к следующей встрече."
             )
             
-            await bot.send_message(
+            await self.sender.send_message(
                 chat_id=user.telegram_id,
                 text=message_text
             )
@@ -156,7 +164,7 @@ class NotificationScheduler:
                 f"что принесло вам радость и благодарность."
             )
             
-            await bot.send_message(
+            await self.sender.send_message(
                 chat_id=user.telegram_id,
                 text=message_text,
                 reply_markup=keyboard
@@ -190,10 +198,7 @@ class NotificationScheduler:
             return False
         
         # Check if we already sent notification to this user today at this time (in user's timezone)
-        user_today = user_local_time.strftime("%Y-%m-%d")
-        user_key = f"{user.telegram_id}_{user_today}_{user_time_str}"
-        
-        if user_key in self.sent_today:
+        if self.ledger.was_sent(user.id, day_key(user_local_time), reminder_slot(user_local_time)):
             return False
         
         return True
@@ -203,128 +208,184 @@ class NotificationScheduler:
         timezone_offset = getattr(user, 'timezone_offset', 0) or 0
         server_utc_time = server_time - timedelta(hours=SERVER_UTC_OFFSET)  # Convert server time to UTC
         user_local_time = server_utc_time + timedelta(hours=timezone_offset)
-        user_today = user_local_time.strftime("%Y-%m-%d")
-        user_time_str = user_local_time.strftime("%H:%M")
-        user_key = f"{user.telegram_id}_{user_today}_{user_time_str}"
-        self.sent_today[user_key] = True
+        self.ledger.mark_sent(user.id, day_key(user_local_time), reminder_slot(user_local_time))
     
     def cleanup_old_tracking(self):
-        """Remove tracking data older than 2 days"""
-        cutoff_date = (datetime.now() - timedelta(days=2)).strftime("%Y-%m-%d")
-        keys_to_remove = []
+        """Remove tracking data older than the ledger retention, once per day"""
+        today = day_key(datetime.now())
+        if self.ledger_purged_day == today:
+            return
+        removed = self.ledger.purge_expired()
+        self.ledger_purged_day = today
+        logger.info(f"Cleaned up old notification tracking data ({removed} rows)")
+    
+    def lease_lost(self, user_id: int, partitions: Optional[Set[int]]) -> bool:
+        """Check if the lease on a user's partition ran out during the tick (another instance may send now)"""
+        if partitions is None or self.leases.holds(self.leases.partition_of(user_id)):
+            return False
+        logger.warning(f"Lease on partition {self.leases.partition_of(user_id)} lost, not sending to user {user_id}")
+        return True
+    
+    async def send_due_reminders(self, user: User, server_time: datetime, send_daily: bool,
+                                 send_motivation: bool, send_weekly_reflection: bool,
+                                 partitions: Optional[Set[int]] = None) -> tuple:
+        """Send a user's due reminders in order and return (notifications, motivations, reflections) sent"""
+        notifications_sent = motivations_sent = reflections_sent = 0
+        
+        # Calculate user's local time for logging
+        timezone_offset = getattr(user, 'timezone_offset', 0) or 0
+        server_utc_time = server_time - timedelta(hours=SERVER_UTC_OFFSET)  # Convert server time to UTC
+        user_local_time = server_utc_time + timedelta(hours=timezone_offset)
+        user_timezone = getattr(user, 'user_timezone', 'UTC+0') or 'UTC+0'
+        user_day = day_key(user_local_time)
         
-        for key in self.sent_today:
-            if key.split("_")[1] < cutoff_date:
-                keys_to_remove.append(key)
+        # Send regular emotion diary reminders
+        if send_daily and self.should_send_notification(user, server_time):
+            if self.lease_lost(user.id, partitions):
+                return notifications_sent, motivations_sent, reflections_sent
+            success = await self.send_emotion_diary_reminder(user)
+            if success:
+                self.mark_notification_sent(user, server_time)
+                notifications_sent += 1
+                logger.info(f"Sent notification to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
         
-        for key in keys_to_remove:
-            del self.sent_today[key]
+        # Send weekly motivational message on Sundays at 10:00 (user's local time)
+        if send_motivation:
+            if not self.ledger.was_sent(user.id, user_day, SLOT_WEEKLY_MOTIVATION):
+                if self.lease_lost(user.id, partitions):
+                    return notifications_sent, motivations_sent, reflections_sent
+                success = await self.send_weekly_motivation(user)
+                if success:
+                    self.ledger.mark_sent(user.id, user_day, SLOT_WEEKLY_MOTIVATION)
+                    motivations_sent += 1
+                    logger.info(f"Sent weekly motivation to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
+        
+        # Send weekly reflection message on Sundays at 17:00 (user's local time)
+        if send_weekly_reflection:
+            if not self.ledger.was_sent(user.id, user_day, SLOT_WEEKLY_REFLECTION):
+                if self.lease_lost(user.id, partitions):
+                    return notifications_sent, motivations_sent, reflections_sent
+                success = await self.send_weekly_reflection_reminder(user)
+                if success:
+                    self.ledger.mark_sent(user.id, user_day, SLOT_WEEKLY_REFLECTION)
+                    reflections_sent += 1
+                    logger.info(f"Sent weekly reflection reminder to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
+        
+        return notifications_sent, motivations_sent, reflections_sent
     
-    async def check_and_send_notifications(self):
-        """Check all users and send notifications if needed"""
+    async def check_and_send_notifications(self, partitions: Optional[Set[int]] = None):
+        """
+        Check users and send notifications if needed
+
+        Args:
+            partitions: User partitions to handle (see PartitionLeases), None for all users
+        """
         server_time = datetime.now()
         current_time = server_time.strftime("%H:%M")
         current_day = server_time.strftime("%A")  # Get day of week
         logger.info(f"Checking notifications for server time: {current_time} on {current_day}")
         
-        # Check and update expired trials
-        from src.trial_manager import check_and_update_expired_trials
-        expired_count = check_and_update_expired_trials()
-        if expired_count > 0:
-            logger.info(f"Updated {expired_count} expired trials")
+        # Check and update expired trials (global job, done by the holder of partition 0)
+        if partitions is None or 0 in partitions:
+            from src.trial_manager import check_and_update_expired_trials
+            expired_count = check_and_update_expired_trials()
+            if expired_count > 0:
+                logger.info(f"Updated {expired_count} expired trials")
+        
+        self.sender.start_tick()
+        
+        # Look up only the users due in this UTC minute instead of scanning all users
+        if self.schedule_index.needs_rebuild(server_time):
+            self.schedule_index.rebuild()
+        else:
+            # Settings written by handlers in other processes
+            self.schedule_index.sync_changes()
+        server_utc_time = server_time - timedelta(hours=SERVER_UTC_OFFSET)  # Convert server time to UTC
+        due_daily, due_weekly = self.schedule_index.due_users(server_utc_time)
+        due_motivation = due_weekly.get(WEEKLY_MOTIVATION, set())
+        due_weekly_reflection = due_weekly.get(WEEKLY_REFLECTION, set())
+        due_ids = due_daily | due_motivation | due_weekly_reflection
+        if partitions is not None:
+            due_ids = {user_id for user_id in due_ids if self.leases.partition_of(user_id) in partitions}
         
-        session = get_session()
         try:
-            # Get all registered users with notifications enabled and valid access
-            users = session.query(User).filter(
-                User.registration_complete == True,
-                User.full_name.isnot(None),
-                User.notification_frequency.isnot(None),
-                User.notification_frequency > 0,  # Only users with notifications enabled
-                User.trial_expired == False  # Exclude users with expired trials
-            ).all()
-            
-            notifications_sent = 0
-            motivations_sent = 0
-            reflections_sent = 0
+            # Load everything the sends need up front: the session is not held while sending
+            session = get_session()
+            try:
+                # Get due registered users with notifications enabled and valid access
+                users = []
+                for ids in chunked(due_ids):
+                    users.extend(session.query(User).filter(
+                        User.id.in_(ids),
+                        User.registration_complete == True,
+                        User.full_name.isnot(None),
+                        User.notification_frequency.isnot(None),
+                        User.notification_frequency > 0,  # Only users with notifications enabled
+                        User.trial_expired == False  # Exclude users with expired trials
+                    ).all())
+                
+                # Check for reflection reminders (separate query for efficiency)
+                # Look for therapy sessions where reflection_datetime has passed but reflection_sent is False
+                pending_query = session.query(TherapySession, User).join(
+                    User, User.id == TherapySession.user_id
+                ).filter(
+                    TherapySession.reflection_datetime <= server_time,
+                    TherapySession.reflection_sent == False,
+                    User.registration_complete == True
+                )
+                if partitions is not None:
+                    pending_query = pending_query.filter(
+                        (TherapySession.user_id % self.leases.partitions).in_(sorted(partitions))
+                    )
+                pending_reflections = pending_query.all()
+            finally:
+                # Loaded rows stay readable once detached
+                close_session(session)
             
+            # Send each due user's reminders concurrently; the sender enforces Telegram's limits
+            jobs = []
             for user in users:
-                # Calculate user's local time for logging
-                timezone_offset = getattr(user, 'timezone_offset', 0) or 0
-                server_utc_time = server_time - timedelta(hours=SERVER_UTC_OFFSET)  # Convert server time to UTC
-                user_local_time = server_utc_time + timedelta(hours=timezone_offset)
-                user_timezone = getattr(user, 'user_timezone', 'UTC+0') or 'UTC+0'
-                
                 # Check if user is actively interacting before sending emotion diary reminders
                 if is_user_actively_interacting(user):
                     logger.debug(f"Skipping notification for {user.full_name} - user is actively interacting")
                     continue
                 
-                # Send regular emotion diary reminders
-                if self.should_send_notification(user, server_time):
-                    success = await self.send_emotion_diary_reminder(user)
-                    if success:
-                        self.mark_notification_sent(user, server_time)
-                        notifications_sent += 1
-                        logger.info(f"Sent notification to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
-                    
-                    # Small delay between messages to avoid rate limiting
-                    await asyncio.sleep(0.5)
-                
-                # Send weekly motivational message on Sundays at 10:00 (user's local time)
-                user_day = user_local_time.strftime("%A")
-                user_time_str = user_local_time.strftime("%H:%M")
-                
-                if user_day == "Sunday" and user_time_str == "10:00":
-                    user_today = user_local_time.strftime("%Y-%m-%d")
-                    motivation_key = f"{user.telegram_id}_motivation_{user_today}"
-                    
-                    if motivation_key not in self.sent_today:
-                        success = await self.send_weekly_motivation(user)
-                        if success:
-                            self.sent_today[motivation_key] = True
-                            motivations_sent += 1
-                            logger.info(f"Sent weekly motivation to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
-                        
-                        # Small delay between messages
-                        await asyncio.sleep(0.5)
-                
-                # Send weekly reflection message on Sundays at 17:00 (user's local time)
-                if user_day == "Sunday" and user_time_str == "17:00":
-                    user_today = user_local_time.strftime("%Y-%m-%d")
-                    reflection_key = f"{user.telegram_id}_weekly_reflection_{user_today}"
-                    
-                    if reflection_key not in self.sent_today:
-                        success = await self.send_weekly_reflection_reminder(user)
-                        if success:
-                            self.sent_today[reflection_key] = True
-                            reflections_sent += 1
-                            logger.info(f"Sent weekly reflection reminder to {user.full_name} (local time: {user_local_time.strftime('%H:%M')} {user_timezone})")
-                        
-                        # Small delay between messages
-                        await asyncio.sleep(0.5)
+                jobs.append(self.send_due_reminders(
+                    user,
+                    server_time,
+                    send_daily=user.id in due_daily,
+                    send_motivation=user.id in due_motivation,
+                    send_weekly_reflection=user.id in due_weekly_reflection,
+                    partitions=partitions
+                ))
+            
+            results = await asyncio.gather(*jobs)
+            self.ledger.flush()
+            notifications_sent = sum(result[0] for result in results)
+            motivations_sent = sum(result[1] for result in results)
+            reflections_sent = sum(result[2] for result in results)
             
-            # Check for reflection reminders (separate query for efficiency)
-            # Look for therapy sessions where reflection_datetime has passed but reflection_sent is False
-            pending_reflections = session.query(TherapySession).filter(
-                TherapySession.reflection_datetime <= server_time,
-                TherapySession.reflection_sent == False
-            ).all()
+            async def send_reflection(therapy_session: TherapySession, user: User) -> bool:
+                if self.lease_lost(user.id, partitions):
+                    return False
+                return await self.send_reflection_reminder(user, therapy_session)
             
-            for therapy_session in pending_reflections:
-                # Get the user for this session
-                user = session.query(User).filter(User.id == therapy_session.user_id).first()
-                if user and user.registration_complete:
-                    success = await self.send_reflection_reminder(user, therapy_session)
-                    if success:
-                        # Mark reflection as sent
-                        therapy_session.reflection_sent = True
+            if pending_reflections:
+                results = await asyncio.gather(*(
+                    send_reflection(therapy_session, user) for therapy_session, user in pending_reflections
+                ))
+                sent_ids = [therapy_session.id for (therapy_session, _), success in zip(pending_reflections, results) if success]
+                if sent_ids:
+                    # Mark reflections as sent
+                    session = get_session()
+                    try:
+                        session.query(TherapySession).filter(TherapySession.id.in_(sent_ids)).update(
+                            {TherapySession.reflection_sent: True}, synchronize_session=False
+                        )
                         session.commit()
-                        reflections_sent += 1
-                        logger.info(f"Sent reflection reminder to {user.full_name} for session at {therapy_session.session_datetime}")
-                    
-                    # Small delay between messages
-                    await asyncio.sleep(0.5)
+                    finally:
+                        close_session(session)
+                    reflections_sent += len(sent_ids)
             
             if notifications_sent > 0:
                 logger.info(f"Sent {notifications_sent} emotion diary notifications at server time {current_time}")
@@ -335,34 +396,50 @@ class NotificationScheduler:
             if reflections_sent > 0:
                 logger.info(f"Sent {reflections_sent} reflection reminders at server time {current_time}")
             
+            self.sender.log_metrics(f"Broadcast at server time {current_time}")
+            
         except Exception as e:
             logger.error(f"Error in check_and_send_notifications: {e}")
-        finally:
-            close_session(session)
+    
+    async def refresh_partitions(self) -> Set[int]:
+        """Renew this instance's leases and return the user partitions it may send to"""
+        partitions = await asyncio.to_thread(self.leases.refresh)
+        if partitions - self.partitions_held:
+            # Taking over from another instance: its sends and profile changes are only in the database
+            self.ledger.reset()
+            self.schedule_index.last_built = None
+        self.partitions_held = partitions
+        return partitions
     
     async def run_scheduler(self):
-        """Main scheduler loop"""
-        logger.info("🚀 Notification Scheduler started")
+        """Main scheduler loop; sends only for the user partitions this instance holds a lease on"""
+        logger.info(f"🚀 Notification Scheduler started ({self.leases.holder})")
         self.running = True
+        self.leases.start()
         
-        while self.running:
-            try:
-                await self.check_and_send_notifications()
-                
-                # Cleanup old tracking data once per day at midnight
-                if datetime.now().strftime("%H:%M") == "00:00":
-                    self.cleanup_old_tracking()
-                    logger.info("Cleaned up old notification tracking data")
-                
-                # Wait 1 minute before next check
-                await asyncio.sleep(60)
-                
-            except KeyboardInterrupt:
-                logger.info("Scheduler stopped by user")
-                break
-            except Exception as e:
-                logger.error(f"Error in scheduler loop: {e}")
-                await asyncio.sleep(60)  # Wait before retrying
+        try:
+            while self.running:
+                try:
+                    partitions = await self.refresh_partitions()
+                    if partitions:
+                        await self.check_and_send_notifications(partitions)
+                        
+                        # Expire old tracking data once per day
+                        self.cleanup_old_tracking()
+                    else:
+                        logger.debug("No scheduler partition leased, standing by")
+                    
+                    # Wait until the start of the next minute so no schedule slot is skipped
+                    await asyncio.sleep(60 - datetime.now().second)
+                    
+                except KeyboardInterrupt:
+                    logger.info("Scheduler stopped by user")
+                    break
+                except Exception as e:
+                    logger.error(f"Error in scheduler loop: {e}")
+                    await asyncio.sleep(60)  # Wait before retrying
+        finally:
+            await self.leases.stop()
     
     def stop(self):
         """Stop the scheduler"""
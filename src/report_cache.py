@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Report Cache for PsyBot
+Content-addressed disk cache of rendered emotion and therapy theme PDFs
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPORT_CACHE_DIR = str((Path(__file__).parent / "database" / "report_cache").resolve())
+
+# Total size of cached reports before the least recently used ones are removed
+REPORT_CACHE_MAX_MB = int(os.getenv("REPORT_CACHE_MAX_MB", "200"))
+
+REPORT_EMOTIONS = "emotions"
+REPORT_THEMES = "themes"
+
+def data_version(rows: Iterable[Tuple]) -> str:
+    """
+    Version of the data a report is built from
+
+    Args:
+        rows: One tuple per row with the ID and every field the report shows
+
+    Returns:
+        Digest that changes whenever a row is added, removed or edited
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(repr(row).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()[:32]
+
+class ReportCache:
+    """
+    Rendered PDF reports on disk, one directory per user.
+
+    A report is stored under a hash of (user, report type, period, data
+    version), so a request whose data did not change since the last one is
+    answered with the same bytes without asking the LLM or rendering again.
+    Reading a report refreshes its mtime; once the cache outgrows its size
+    limit the oldest files are removed. New or edited data changes the
+    version and so the key; the reports it replaces are never read again
+    and age out through the same eviction. The directory may be shared by
+    the bot's worker processes.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = REPORT_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory or os.getenv("REPORT_CACHE_DIR", DEFAULT_REPORT_CACHE_DIR))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None  # Estimate, rescanned when it exceeds max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, user_id: int, report_type: str, period: str, version: str) -> str:
+        """Cache key of a report"""
+        return hashlib.sha256(f"{user_id}|{report_type}|{period}|{version}".encode("utf-8")).hexdigest()
+
+    def _path(self, user_id: int, key: str) -> Path:
+        return self.directory / str(user_id) / f"{key}.pdf"
+
+    def get(self, user_id: int, key: str) -> Optional[bytes]:
+        """Cached report bytes, or None"""
+        path = self._path(user_id, key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except OSError as e:
+            logger.error(f"Failed to read cached report {path}: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def contains(self, user_id: int, key: str) -> bool:
+        """Whether a report is cached, without reading it or counting a hit"""
+        return self._path(user_id, key).is_file()
+
+    def put(self, user_id: int, key: str, data: bytes) -> None:
+        """Store a rendered report and evict the least recently used ones if over the limit"""
+        path = self._path(user_id, key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so other processes never read a partial file
+            partial = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            partial.write_bytes(data)
+            os.replace(partial, path)
+        except OSError as e:
+            logger.error(f"Failed to cache report {path}: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop all cached reports of a user"""
+        user_dir = self.directory / str(user_id)
+        if user_dir.is_dir():
+            shutil.rmtree(user_dir, ignore_errors=True)
+
+    def _files(self):
+        if not self.directory.is_dir():
+            return []
+        return [path for path in self.directory.glob("*/*.pdf") if path.is_file()]
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self._files():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _evict(self) -> int:
+        """Remove the least recently used reports until the cache fits; returns the remaining size"""
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        if removed:
+            logger.info(f"Evicted {removed} cached reports, {total // 1024} KB left")
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": self._size or 0}
+
+# Shared cache used by the emotion analysis and therapy themes handlers
+report_cache = ReportCache()
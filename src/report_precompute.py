@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Report Precomputer for PsyBot
+Prepares active users' weekly emotion reports during the quiet hours of their timezone
+"""
+
+import os
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import or_
+from src.database.session import session_factory
+from src.database.models import User, EmotionDailyRollup
+from src.timezone_utils import SERVER_UTC_OFFSET
+from src.scheduler_lease import PartitionLeases
+from src.llm_health import health_monitor
+from src.report_cache import report_cache
+from src.handlers.emotion_analysis import (
+    AnalysisPeriod, load_analysis_period, load_period_digest, build_pdf_report, generate_therapy_topics_text
+)
+
+logger = logging.getLogger(__name__)
+
+# Run the precomputer in the bot process (leased, so one replica prepares each user's report)
+REPORT_PRECOMPUTE = os.getenv("REPORT_PRECOMPUTE", "true").lower() in ("1", "true", "yes")
+# Local hours [start, end) in which a user's report is prepared
+PRECOMPUTE_QUIET_START = int(os.getenv("PRECOMPUTE_QUIET_START", "3"))
+PRECOMPUTE_QUIET_END = int(os.getenv("PRECOMPUTE_QUIET_END", "6"))
+# Seconds between passes
+PRECOMPUTE_INTERVAL = int(os.getenv("PRECOMPUTE_INTERVAL", "600"))
+# Reports prepared at once; each makes one Gemini call and renders three charts and a PDF
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "1"))
+
+# Period of the precomputed report ("Неделя (7 дней)")
+PRECOMPUTE_PERIOD_DAYS = 7
+# Users with an emotion entry in this many days count as active
+PRECOMPUTE_ACTIVE_DAYS = 14
+# Local hour whose server date the report is prepared for (the user's day mostly falls on it)
+_REPORT_LOCAL_HOUR = 12
+
+class ReportPrecomputer:
+    """
+    Prepares the 7-day emotion report of active users while they sleep.
+
+    Every pass looks up the users whose local time is within the quiet
+    hours, loads their week the way the "Аналитика эмоций" button does and,
+    unless that exact report is already cached, asks Gemini for the therapy
+    topics and renders the charts and the PDF into the report cache. The
+    button then finds the report under the same key and sends it at once.
+    A new entry or reflection during the day changes the report's key, so
+    the user never gets stale data. Users are split into the
+    same partitions as the notification scheduler, leased per instance.
+    """
+
+    def __init__(self, interval: int = PRECOMPUTE_INTERVAL, concurrency: int = PRECOMPUTE_CONCURRENCY):
+        self.interval = interval
+        self.concurrency = max(concurrency, 1)
+        self.leases = PartitionLeases(job="report_precompute")
+        self._prepared: Dict[int, date] = {}  # user_id -> server date of the report prepared last
+        self.prepared = 0
+        self.failed = 0
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def quiet_offsets(server_time: datetime) -> List[int]:
+        """UTC offsets whose local time is within the quiet hours right now"""
+        utc_hour = (server_time - timedelta(hours=SERVER_UTC_OFFSET)).hour
+        return [offset for offset in range(-12, 15)
+                if PRECOMPUTE_QUIET_START <= (utc_hour + offset) % 24 < PRECOMPUTE_QUIET_END]
+
+    @staticmethod
+    def report_time(timezone_offset: int, server_time: datetime) -> datetime:
+        """
+        End of the period to prepare, so the key matches the requests of the user's coming day
+
+        Reports are keyed by server date. For users far from the server's
+        timezone most of the coming day falls on the next server date; the
+        period then ends at that date's midnight, which covers the same
+        entries as long as none are added.
+        """
+        local_time = server_time + timedelta(hours=timezone_offset - SERVER_UTC_OFFSET)
+        local_noon = local_time.replace(hour=_REPORT_LOCAL_HOUR, minute=0, second=0, microsecond=0)
+        report_day = (local_noon - timedelta(hours=timezone_offset - SERVER_UTC_OFFSET)).date()
+        if report_day <= server_time.date():
+            return server_time
+        return datetime.combine(report_day, datetime.min.time())
+
+    def due_users(self, partitions: Set[int], server_time: datetime) -> List[Tuple[User, datetime]]:
+        """Active users of the given partitions in their quiet hours whose report is not prepared yet"""
+        offsets = self.quiet_offsets(server_time)
+        if not offsets:
+            return []
+
+        # Own session: this runs in a worker thread
+        session = session_factory()
+        try:
+            active_ids = session.query(EmotionDailyRollup.user_id).filter(
+                EmotionDailyRollup.day >= server_time.date() - timedelta(days=PRECOMPUTE_ACTIVE_DAYS)
+            ).distinct()
+            in_quiet_hours = User.timezone_offset.in_(offsets)
+            if 0 in offsets:
+                in_quiet_hours = or_(in_quiet_hours, User.timezone_offset.is_(None))
+            users = session.query(User).filter(
+                User.id.in_(active_ids),
+                User.registration_complete == True,
+                User.full_name.isnot(None),
+                User.trial_expired == False,
+                in_quiet_hours,
+                (User.id % self.leases.partitions).in_(sorted(partitions))
+            ).all()
+            session.expunge_all()
+        finally:
+            session.close()
+
+        due = []
+        for user in users:
+            report_time = self.report_time(user.timezone_offset or 0, server_time)
+            if self._prepared.get(user.id) != report_time.date():
+                due.append((user, report_time))
+        return due
+
+    def _load_period(self, user: User, report_time: datetime):
+        session = session_factory()
+        try:
+            return load_analysis_period(session, user, PRECOMPUTE_PERIOD_DAYS, report_time)
+        finally:
+            session.close()
+
+    def _load_digest(self, period: AnalysisPeriod):
+        session = session_factory()
+        try:
+            return load_period_digest(session, period)
+        finally:
+            session.close()
+
+    async def prepare(self, user: User, report_time: datetime) -> bool:
+        """
+        Prepare one user's weekly report
+
+        Returns:
+            True if a report was rendered, False if there was nothing to do
+        """
+        period = await asyncio.to_thread(self._load_period, user, report_time)
+        if not period.entries or await asyncio.to_thread(report_cache.contains, user.id, period.cache_key):
+            self._prepared[user.id] = report_time.date()
+            return False
+
+        digest = await asyncio.to_thread(self._load_digest, period)
+        therapy_topics = await generate_therapy_topics_text(digest.topic_contexts)
+        await build_pdf_report(period, therapy_topics)
+        # Only now: a failed report is tried again on the next pass of the quiet hours
+        self._prepared[user.id] = report_time.date()
+        return True
+
+    async def run_once(self, partitions: Set[int], server_time: datetime = None) -> int:
+        """
+        Prepare the reports of the users currently in their quiet hours
+
+        Returns:
+            Number of reports rendered
+        """
+        server_time = server_time or datetime.now()
+        # Forget users whose prepared report is from an earlier day
+        self._prepared = {user_id: day for user_id, day in self._prepared.items() if day >= server_time.date()}
+
+        due = await asyncio.to_thread(self.due_users, partitions, server_time)
+        if not due:
+            return 0
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def prepare_one(user: User, report_time: datetime) -> bool:
+            async with slots:
+                # Reports without Gemini's topics would be kept all day; leave them to the request
+                if not self.running or not health_monitor.is_available("gemini"):
+                    return False
+                try:
+                    return await self.prepare(user, report_time)
+                except Exception as e:
+                    logger.error(f"Failed to precompute weekly report for user {user.id}: {e}")
+                    self.failed += 1
+                    return False
+
+        results = await asyncio.gather(*(prepare_one(user, report_time) for user, report_time in due))
+        prepared = sum(results)
+        self.prepared += prepared
+        logger.info(f"Precomputed {prepared} weekly emotion reports for {len(due)} users in quiet hours")
+        return prepared
+
+    async def run(self) -> None:
+        """Background loop; prepares reports only for the user partitions this instance holds a lease on"""
+        logger.info(f"🌙 Report precomputer started ({self.leases.holder})")
+        self.running = True
+        self.leases.start()
+        try:
+            while self.running:
+                try:
+                    partitions = await asyncio.to_thread(self.leases.refresh)
+                    if partitions:
+                        await self.run_once(partitions)
+                except Exception as e:
+                    logger.error(f"Error in report precompute loop: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            await self.leases.stop()
+
+    def start(self) -> asyncio.Task:
+        """Start the background loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop the loop and release the leases"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"prepared": self.prepared, "failed": self.failed}
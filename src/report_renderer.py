@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+Report Renderer for PsyBot
+Process pool that draws the emotion charts and builds the PDF reports off the event loop
+"""
+
+import io
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+from matplotlib import font_manager
+from matplotlib.figure import Figure
+import numpy as np
+from PIL import Image as PILImage  # For reading chart dimensions
+
+logger = logging.getLogger(__name__)
+
+# Worker processes rendering reports
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(min(os.cpu_count() or 1, 2))))
+# Reports rendered at once; further requests wait for a free slot before their timeout starts
+REPORT_MAX_CONCURRENCY = int(os.getenv("REPORT_MAX_CONCURRENCY", str(REPORT_WORKERS)))
+# Seconds one chart or PDF may take before its worker is killed
+REPORT_TIMEOUT = float(os.getenv("REPORT_TIMEOUT", "60"))
+
+CHART_DPI = 300
+
+# Fonts shipped with the bot, so reports render the same everywhere (the slim image has no Cyrillic fonts)
+FONTS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'fonts')
+REPORT_FONTS = {
+    'RussianFont': 'DejaVuSans.ttf',
+    'RussianFont-Bold': 'DejaVuSans-Bold.ttf',
+}
+# Family of the bundled fonts for matplotlib
+CHART_FONT_FAMILY = 'DejaVu Sans'
+
+_fonts_available: Optional[bool] = None
+_styles: Optional[Dict[str, ParagraphStyle]] = None
+
+# Chart bars: (label, count, is_positive)
+ChartBar = Tuple[str, int, bool]
+
+def register_report_fonts() -> bool:
+    """
+    Register the bundled Cyrillic fonts with ReportLab and matplotlib
+
+    Each face is parsed once per process; later calls return the cached
+    result. Runs when a render worker starts, so reports never probe font
+    paths or touch the network.
+
+    Returns:
+        True if the Russian fonts are available, False if reports fall back to the built-in fonts
+    """
+    global _fonts_available
+    if _fonts_available is not None:
+        return _fonts_available
+
+    try:
+        for name, filename in REPORT_FONTS.items():
+            font_path = os.path.join(FONTS_DIR, filename)
+            pdfmetrics.registerFont(TTFont(name, font_path))
+            font_manager.fontManager.addfont(font_path)
+        # Lets <b> inside paragraphs switch to the bold face
+        pdfmetrics.registerFontFamily('RussianFont', normal='RussianFont', bold='RussianFont-Bold',
+                                      italic='RussianFont', boldItalic='RussianFont-Bold')
+        _fonts_available = True
+    except Exception as e:
+        logger.error(f"Error registering report fonts from {FONTS_DIR}: {e}")
+        _fonts_available = False
+    return _fonts_available
+
+def _report_styles() -> Dict[str, ParagraphStyle]:
+    """Paragraph styles of the PDF reports, with Russian fonts when available (built once per process)"""
+    global _styles
+    if _styles is not None:
+        return _styles
+
+    styles = getSampleStyleSheet()
+
+    if not register_report_fonts():
+        # Fallback to default styles if fonts are not available
+        _styles = {
+            'title': styles['Heading1'],
+            'heading': styles['Heading2'],
+            'normal': styles['Normal'],
+            'week': styles['Heading3'],
+        }
+        return _styles
+
+    _styles = {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=30,
+            alignment=1,  # Center alignment
+            fontName='RussianFont-Bold'
+        ),
+        'heading': ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceAfter=12,
+            fontName='RussianFont-Bold'
+        ),
+        'normal': ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontSize=10,
+            fontName='RussianFont'
+        ),
+        'week': ParagraphStyle(
+            'WeekStyle',
+            parent=styles['Heading3'],
+            fontSize=12,
+            fontName='RussianFont-Bold',
+            spaceAfter=8,
+            spaceBefore=16
+        ),
+    }
+    return _styles
+
+def render_emotion_chart(bars: List[ChartBar], start_date: str, end_date: str) -> bytes:
+    """
+    Draw the emotion frequency bar chart
+
+    Args:
+        bars: (label, count, is_positive) per emotion, in display order
+        start_date: Period start as shown in the title
+        end_date: Period end as shown in the title
+
+    Returns:
+        PNG image bytes
+    """
+    # A Figure of its own instead of pyplot's global state
+    fig = Figure(figsize=(14, 7))
+    ax = fig.subplots()
+    fig.suptitle(f'Частота выбора эмоций\nПериод: {start_date} - {end_date}', fontsize=16, fontweight='bold')
+
+    labels = [label for label, _, _ in bars]
+    counts = [count for _, count, _ in bars]
+    x = np.arange(len(bars))
+
+    # Color bars by emotion valence
+    bar_colors = ['#4CAF50' if is_positive else '#FF9800' for _, _, is_positive in bars]
+
+    register_report_fonts()
+    with matplotlib.rc_context({
+        # Russian font for matplotlib
+        'font.family': [CHART_FONT_FAMILY, 'sans-serif'],
+        'axes.unicode_minus': False,
+    }):
+        rects = ax.bar(x, counts, color=bar_colors, alpha=0.8)
+
+        # Add value labels on top
+        for rect, count in zip(rects, counts):
+            height = rect.get_height()
+            ax.annotate(f'{count}',
+                        xy=(rect.get_x() + rect.get_width() / 2, height),
+                        xytext=(0, 3),
+                        textcoords="offset points",
+                        ha='center', va='bottom', fontsize=9)
+
+        # Axis formatting
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=9)
+        ax.set_ylabel('Количество')
+        ax.set_ylim(0, max(counts, default=0) + 1)
+        fig.tight_layout(rect=[0, 0, 1, 0.95])
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=CHART_DPI, bbox_inches='tight', facecolor='white')
+    return buffer.getvalue()
+
+def render_trend_chart(trend: Dict[str, Any], start_date: str, end_date: str) -> bytes:
+    """
+    Draw the daily emotion trend: positive/negative bars with rolling averages, and the valence line
+
+    Args:
+        trend: Arrays prepared from the emotion time series (days, positive, negative,
+            rolling_positive, rolling_negative, valence), valence_trend as (slope per day,
+            start value) or None, window and longest_streak
+        start_date: Period start as shown in the title
+        end_date: Period end as shown in the title
+
+    Returns:
+        PNG image bytes
+    """
+    days = trend['days']
+    x = np.arange(len(days))
+
+    fig = Figure(figsize=(14, 9))
+    ax_counts, ax_valence = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 2]})
+    fig.suptitle(f'Динамика эмоций\nПериод: {start_date} - {end_date}', fontsize=16, fontweight='bold')
+
+    register_report_fonts()
+    with matplotlib.rc_context({
+        'font.family': [CHART_FONT_FAMILY, 'sans-serif'],
+        'axes.unicode_minus': False,
+    }):
+        ax_counts.bar(x, trend['positive'], color='#4CAF50', alpha=0.6, label='Позитивные')
+        ax_counts.bar(x, trend['negative'], bottom=trend['positive'], color='#FF9800', alpha=0.6, label='Негативные')
+        ax_counts.plot(x, trend['rolling_positive'], color='#2E7D32', linewidth=2,
+                       label=f"Позитивные, среднее за {trend['window']} дн.")
+        ax_counts.plot(x, trend['rolling_negative'], color='#E65100', linewidth=2,
+                       label=f"Негативные, среднее за {trend['window']} дн.")
+        ax_counts.set_ylabel('Записей в день')
+        ax_counts.set_title(f"Самая длинная серия дней с записями: {trend['longest_streak']}", fontsize=11)
+        ax_counts.legend(loc='upper left', fontsize=9)
+
+        valence = trend['valence']
+        ax_valence.axhline(0, color='#9E9E9E', linewidth=1)
+        ax_valence.plot(x, valence, marker='o', markersize=4, color='#3F51B5', linestyle='-')
+        if trend['valence_trend'] is not None:
+            slope, intercept = trend['valence_trend']
+            ax_valence.plot(x, intercept + slope * x, color='#D32F2F', linestyle='--',
+                            label=f'Тренд: {slope * 7:+.2f} в неделю')
+            ax_valence.legend(loc='upper left', fontsize=9)
+        ax_valence.set_ylim(-1.1, 1.1)
+        ax_valence.set_ylabel('Баланс эмоций')
+
+        # At most ~15 date labels whatever the period length
+        step = max(len(days) // 15, 1)
+        ax_valence.set_xticks(x[::step])
+        ax_valence.set_xticklabels([str(day)[8:10] + '.' + str(day)[5:7] for day in days[::step]],
+                                   rotation=45, ha='right', fontsize=9)
+        fig.tight_layout(rect=[0, 0, 1, 0.94])
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=CHART_DPI, bbox_inches='tight', facecolor='white')
+    return buffer.getvalue()
+
+def render_hour_heatmap(heatmap: np.ndarray, start_date: str, end_date: str) -> bytes:
+    """
+    Draw when emotions were recorded: entries per weekday and hour of the day
+
+    Args:
+        heatmap: (7, 24) entry counts, Monday first
+        start_date: Period start as shown in the title
+        end_date: Period end as shown in the title
+
+    Returns:
+        PNG image bytes
+    """
+    fig = Figure(figsize=(14, 5))
+    ax = fig.subplots()
+    fig.suptitle(f'Когда записывались эмоции\nПериод: {start_date} - {end_date}', fontsize=16, fontweight='bold')
+
+    register_report_fonts()
+    with matplotlib.rc_context({
+        'font.family': [CHART_FONT_FAMILY, 'sans-serif'],
+        'axes.unicode_minus': False,
+    }):
+        image = ax.imshow(heatmap, aspect='auto', cmap='YlOrRd', interpolation='nearest')
+        fig.colorbar(image, ax=ax, label='Записей')
+        ax.set_xticks(np.arange(24))
+        ax.set_xticklabels([f'{hour:02d}' for hour in range(24)], fontsize=9)
+        ax.set_yticks(np.arange(7))
+        ax.set_yticklabels(['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'])
+        ax.set_xlabel('Час')
+        fig.tight_layout(rect=[0, 0, 1, 0.9])
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=CHART_DPI, bbox_inches='tight', facecolor='white')
+    return buffer.getvalue()
+
+def render_emotion_report(report: Dict[str, Any], charts: List[bytes]) -> bytes:
+    """
+    Build the emotion analysis PDF
+
+    Args:
+        report: Plain report data prepared by the emotion analysis handler
+            (period, statistics and the already formatted lines of each section)
+        charts: PNG images to embed, fit to the page width
+
+    Returns:
+        PDF bytes
+    """
+    styles = _report_styles()
+    title_style, heading_style, normal_style = styles['title'], styles['heading'], styles['normal']
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    story = []
+
+    # Title
+    story.append(Paragraph("Отчет по эмоциям", title_style))
+    story.append(Paragraph(f"Период: {report['start_date']} - {report['end_date']}", normal_style))
+    story.append(Spacer(1, 20))
+
+    # Statistics section (text instead of table)
+    stats = report['stats']
+    story.append(Paragraph("Статистика", heading_style))
+    stats_text = (
+        f"Всего записей: {stats['total']}<br/>"
+        f"Позитивных эмоций: {stats['positive']}<br/>"
+        f"Негативных эмоций: {stats['negative']}<br/>"
+        f"Дней с записями: {stats['days_with_entries']}"
+    )
+    story.append(Paragraph(stats_text, normal_style))
+    story.append(Spacer(1, 20))
+
+    # Embed emotion charts images while preserving aspect ratio (fit to page width)
+    if charts:
+        story.append(Paragraph("Графики эмоций", heading_style))
+        max_width = doc.width  # available drawing width inside page margins (in points)
+        for index, chart in enumerate(charts):
+            try:
+                # Determine original image aspect ratio
+                with PILImage.open(io.BytesIO(chart)) as _pil_img:
+                    img_w_px, img_h_px = _pil_img.size
+                aspect = img_h_px / img_w_px if img_w_px else 0.75
+
+                display_width = max_width
+                display_height = display_width * aspect
+
+                img = RLImage(io.BytesIO(chart), width=display_width, height=display_height)
+                story.append(img)
+                story.append(Spacer(1, 15))
+            except Exception as e:
+                logger.error(f"Error embedding chart {index} into PDF: {e}")
+    story.append(Spacer(1, 10))
+
+    # Top emotions (bullet list instead of table)
+    if report['top_emotions']:
+        story.append(Paragraph("Топ-3 самые частые эмоции", heading_style))
+        for emotion_name, count in report['top_emotions']:
+            story.append(Paragraph(f"• {emotion_name}: {count}", normal_style))
+        story.append(Spacer(1, 20))
+
+    # Key moments analysis section
+    story.append(Paragraph("Краткий разбор ключевых моментов", heading_style))
+
+    # Show entries with detailed context first
+    if report['context_lines']:
+        story.append(Paragraph("Подробные записи с контекстом:", normal_style))
+        for line in report['context_lines']:
+            story.append(Paragraph(f"• {line}", normal_style))
+        story.append(Spacer(1, 10))
+
+    # Show simple diary entries
+    if report['quick_lines']:
+        story.append(Paragraph("Быстрые записи эмоций:", normal_style))
+        for line in report['quick_lines']:
+            story.append(Paragraph(f"• {line}", normal_style))
+        story.append(Spacer(1, 20))
+
+    # Show message if no entries at all
+    if not report['context_lines'] and not report['quick_lines']:
+        story.append(Paragraph("Записи эмоций не найдены.", normal_style))
+        story.append(Spacer(1, 20))
+
+    # Positive moments - including weekly reflections
+    if report['positive_lines'] or report['reflections']:
+        story.append(Paragraph("Позитивные моменты", heading_style))
+
+        for line in report['positive_lines']:
+            story.append(Paragraph(f"• {line}", normal_style))
+
+        for reflection in report['reflections']:
+            story.append(Paragraph(f"Еженедельная рефлексия ({reflection['date']}):", normal_style))
+            for label, text in reflection['moments']:
+                story.append(Paragraph(f"  • {label}: {text}", normal_style))
+
+        story.append(Spacer(1, 20))
+
+    # Negative emotions analysis
+    if report['top_negative']:
+        story.append(Paragraph("Деструктивные эмоции для проработки", heading_style))
+        for i, (emotion_name, count) in enumerate(report['top_negative'], 1):
+            story.append(Paragraph(f"{i}. {emotion_name} ({count} раз)", normal_style))
+        story.append(Paragraph("Рекомендуется разобрать эти эмоции с психологом.", normal_style))
+        story.append(Spacer(1, 20))
+
+    # Therapy topics
+    story.append(Paragraph("Темы для проработки с психологом", heading_style))
+    for topic in report['therapy_topics']:
+        story.append(Paragraph(f"• {topic}", normal_style))
+    story.append(Spacer(1, 20))
+
+    # Praise section
+    story.append(Paragraph("Похвала", heading_style))
+    praise_text = f"Отлично! Ты ведешь дневник эмоций уже {report['period_days']} дней. " \
+                  "Это важный шаг к лучшему пониманию себя и своих эмоций. Продолжай в том же духе!"
+    story.append(Paragraph(praise_text, normal_style))
+
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+def render_themes_report(report: Dict[str, Any]) -> bytes:
+    """
+    Build the therapy themes PDF
+
+    Args:
+        report: Plain report data prepared by the therapy themes handler
+            (period, summary text and the weeks with their common theme and entry lines)
+
+    Returns:
+        PDF bytes
+    """
+    styles = _report_styles()
+    title_style, heading_style, normal_style, week_style = (
+        styles['title'], styles['heading'], styles['normal'], styles['week']
+    )
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    story = []
+
+    # Title
+    story.append(Paragraph("Темы для проработки с психотерапевтом", title_style))
+    story.append(Paragraph(f"Период: {report['start_date']} - {report['end_date']}", normal_style))
+    story.append(Spacer(1, 20))
+
+    # 1. General summary (2-3 sentences)
+    story.append(Paragraph("1. Общее краткое содержание", heading_style))
+    story.append(Paragraph(report['summary'], normal_style))
+    story.append(Spacer(1, 20))
+
+    # 2. Weekly breakdown
+    story.append(Paragraph("2. По неделям", heading_style))
+    for week in report['weeks']:
+        story.append(Paragraph(week['title'], week_style))
+        story.append(Paragraph(f"Общая тема: {week['common_theme']}", normal_style))
+        story.append(Spacer(1, 8))
+
+        # 3. Individual entries with date, time: brief content
+        for line in week['lines']:
+            story.append(Paragraph(line, normal_style))
+
+        story.append(Spacer(1, 12))
+
+    # Additional recommendations section
+    story.append(Paragraph("Рекомендации", heading_style))
+    recommendations = "Рекомендуется обсудить выделенные темы с психотерапевтом в порядке их актуальности. " \
+                     "Особое внимание стоит уделить повторяющимся паттернам и эмоциональным реакциям."
+    story.append(Paragraph(recommendations, normal_style))
+
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+class ReportRenderer:
+    """
+    Runs the report render functions in a pool of worker processes.
+
+    Jobs take plain data and return bytes, so nothing from the bot's
+    database session or event loop crosses the process boundary. At most
+    max_concurrency jobs are handed to the pool at once; the rest wait
+    for a slot. A job running longer than the timeout gets its pool
+    killed and replaced; the other jobs still running in it are retried
+    once in the new pool.
+    """
+
+    def __init__(self, workers: int = REPORT_WORKERS, max_concurrency: int = REPORT_MAX_CONCURRENCY,
+                 timeout: float = REPORT_TIMEOUT):
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max(max_concurrency, 1))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.rendered = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Worker pool, started on the first job"""
+        if self._executor is None:
+            # spawn: workers must not inherit the bot's event loop, DB connections or threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=register_report_fonts
+            )
+            logger.info(f"🖨️ Report renderer started with {self.workers} workers")
+        return self._executor
+
+    def _discard_pool(self, executor: ProcessPoolExecutor, kill: bool) -> None:
+        """Drop a job's pool so the next job starts a fresh one (unless it was replaced already)"""
+        if self._executor is executor:
+            self._executor = None
+        if kill:
+            # A timed out job cannot be cancelled once running; stop its worker
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, func: Callable[..., bytes], *args) -> bytes:
+        """
+        Run a render function in the pool
+
+        Args:
+            func: Module-level render function of this module
+            *args: Plain, picklable arguments
+
+        Returns:
+            The rendered bytes
+
+        Raises:
+            asyncio.TimeoutError: The job took longer than the timeout
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            # One retry when another job's timeout killed the pool this job ran in
+            for attempt in range(2):
+                executor = self._pool()
+                try:
+                    result = await asyncio.wait_for(
+                        loop.run_in_executor(executor, func, *args), self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    logger.error(f"Report job {func.__name__} timed out after {self.timeout}s, restarting the render pool")
+                    self._discard_pool(executor, kill=True)
+                    raise
+                except BrokenProcessPool:
+                    if self._executor is not executor and attempt == 0:
+                        logger.warning(f"Report render pool was restarted during {func.__name__}, retrying it")
+                        continue
+                    self.failed += 1
+                    logger.error(f"Report render pool broke during {func.__name__}, restarting it")
+                    self._discard_pool(executor, kill=False)
+                    raise
+                except Exception:
+                    self.failed += 1
+                    raise
+
+                self.rendered += 1
+                return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"rendered": self.rendered, "failed": self.failed, "timed_out": self.timed_out}
+
+    async def shutdown(self) -> None:
+        """Stop the worker processes"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+            logger.info("🖨️ Report renderer stopped")
+
+# Shared pool used by the emotion analysis and therapy themes handlers
+report_renderer = ReportRenderer()
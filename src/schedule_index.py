@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Notification Schedule Index for PsyBot
+Precomputed timing wheel that maps UTC minutes to the users due a reminder
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import func
+from src.database.models import User
+from src.database.session import get_session, close_session
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Emotion diary reminder times (user's local time) per notification frequency
+NOTIFICATION_TIMES = {
+    1: ["16:00"],  # 1 time per day - noon
+    2: ["12:00", "17:00"],  # 2 times per day - morning and evening
+    4: ["12:00", "15:00", "17:00", "20:00"],  # 4 times per day
+    6: ["11:00", "13:00", "15:00", "17:00", "19:00", "21:00"]  # 6 times per day
+}
+
+# Weekly messages: kind -> (weekday, local time), weekday as in datetime.weekday() (Monday = 0)
+WEEKLY_MOTIVATION = "motivation"
+WEEKLY_REFLECTION = "weekly_reflection"
+WEEKLY_TIMES = {
+    WEEKLY_MOTIVATION: (6, "10:00"),  # Sunday 10:00
+    WEEKLY_REFLECTION: (6, "17:00"),  # Sunday 17:00
+}
+
+# Full rebuild interval to pick up changes made outside the bot handlers (admin panel, trials)
+REBUILD_INTERVAL = timedelta(minutes=15)
+# Rows updated this long before the newest updated_at seen are read again on every sync,
+# so transactions that committed after a later one are not missed
+SYNC_OVERLAP = timedelta(minutes=1)
+
+def _minute_of_day(time_str: str) -> int:
+    """Convert HH:MM string to minute of day"""
+    hour, minute = map(int, time_str.split(':'))
+    return hour * 60 + minute
+
+def is_schedulable(user: User) -> bool:
+    """
+    Check if a user should be present in the schedule index
+
+    Args:
+        user: User object to check
+
+    Returns:
+        True if the user is registered and has notifications enabled
+    """
+    return bool(
+        getattr(user, 'registration_complete', False)
+        and user.full_name
+        and user.notification_frequency
+        and not getattr(user, 'trial_expired', False)
+    )
+
+class NotificationScheduleIndex:
+    """
+    Timing wheel of reminders keyed by UTC minute.
+
+    Daily reminders live in a minute-of-day wheel, weekly messages in a
+    minute-of-week wheel, so a scheduler tick only looks up the users due
+    in the current minute instead of scanning the whole users table.
+    """
+
+    def __init__(self, notification_times: Dict[int, List[str]] = None,
+                 weekly_times: Dict[str, Tuple[int, str]] = None):
+        self.notification_times = notification_times or NOTIFICATION_TIMES
+        self.weekly_times = weekly_times or WEEKLY_TIMES
+        self._daily: Dict[int, Set[int]] = {}
+        self._weekly: Dict[int, Dict[str, Set[int]]] = {}
+        self._user_slots: Dict[int, Tuple[List[int], List[Tuple[int, str]]]] = {}
+        self.last_built: Optional[datetime] = None
+        self.synced_until: Optional[datetime] = None  # Newest User.updated_at (database clock) applied
+
+    def __len__(self) -> int:
+        return len(self._user_slots)
+
+    def _daily_slots(self, frequency: int, timezone_offset: int) -> List[int]:
+        """UTC minutes of day at which daily reminders are due for a user"""
+        return [
+            (_minute_of_day(time_str) - timezone_offset * 60) % MINUTES_PER_DAY
+            for time_str in self.notification_times.get(frequency, [])
+        ]
+
+    def _weekly_slots(self, timezone_offset: int) -> List[Tuple[int, str]]:
+        """UTC minutes of week at which weekly messages are due for a user"""
+        return [
+            ((weekday * MINUTES_PER_DAY + _minute_of_day(time_str) - timezone_offset * 60) % MINUTES_PER_WEEK, kind)
+            for kind, (weekday, time_str) in self.weekly_times.items()
+        ]
+
+    def update_user(self, user_id: int, frequency: Optional[int], timezone_offset: Optional[int]) -> None:
+        """
+        Insert or move a user in the wheel
+
+        Args:
+            user_id: Database ID of the user
+            frequency: Notification frequency (0 or None disables notifications)
+            timezone_offset: User's UTC offset in hours
+        """
+        self.remove_user(user_id)
+        if not frequency:
+            return
+
+        timezone_offset = timezone_offset or 0
+        daily = self._daily_slots(frequency, timezone_offset)
+        weekly = self._weekly_slots(timezone_offset)
+
+        for minute in daily:
+            self._daily.setdefault(minute, set()).add(user_id)
+        for minute, kind in weekly:
+            self._weekly.setdefault(minute, {}).setdefault(kind, set()).add(user_id)
+
+        self._user_slots[user_id] = (daily, weekly)
+
+    def remove_user(self, user_id: int) -> None:
+        """Remove a user from all slots of the wheel"""
+        slots = self._user_slots.pop(user_id, None)
+        if not slots:
+            return
+
+        daily, weekly = slots
+        for minute in daily:
+            bucket = self._daily.get(minute)
+            if bucket is not None:
+                bucket.discard(user_id)
+                if not bucket:
+                    del self._daily[minute]
+        for minute, kind in weekly:
+            kinds = self._weekly.get(minute)
+            if kinds is not None and kind in kinds:
+                kinds[kind].discard(user_id)
+                if not kinds[kind]:
+                    del kinds[kind]
+                if not kinds:
+                    del self._weekly[minute]
+
+    def sync_user(self, user: User) -> None:
+        """
+        Refresh a user's slots from a User object after its profile was written
+
+        Args:
+            user: User object with the current notification settings
+        """
+        if is_schedulable(user):
+            self.update_user(user.id, user.notification_frequency, user.timezone_offset)
+        else:
+            self.remove_user(user.id)
+
+    def rebuild(self) -> int:
+        """
+        Rebuild the whole wheel from the database
+
+        Returns:
+            Number of users in the index
+        """
+        session = get_session()
+        try:
+            # Read before the rows, so a write in between is picked up by the next sync
+            synced_until = session.query(func.max(User.updated_at)).scalar()
+            rows = session.query(User.id, User.notification_frequency, User.timezone_offset).filter(
+                User.registration_complete == True,
+                User.full_name.isnot(None),
+                User.notification_frequency.isnot(None),
+                User.notification_frequency > 0,
+                User.trial_expired == False
+            ).all()
+        finally:
+            close_session(session)
+
+        self._daily.clear()
+        self._weekly.clear()
+        self._user_slots.clear()
+        for user_id, frequency, timezone_offset in rows:
+            self.update_user(user_id, frequency, timezone_offset)
+
+        self.last_built = datetime.now()
+        self.synced_until = synced_until
+        logger.info(f"Notification schedule index built for {len(self)} users")
+        return len(self)
+
+    def sync_changes(self) -> int:
+        """
+        Apply the profile writes made since the last rebuild or sync
+
+        Settings handlers update the index of their own process only; with
+        several webhook workers or a separate scheduler process the writes
+        are found here through User.updated_at, which every ORM and bulk
+        UPDATE of the users table bumps.
+
+        Returns:
+            Number of users re-synced
+        """
+        if self.synced_until is None:
+            return 0
+
+        session = get_session()
+        try:
+            synced_until = session.query(func.max(User.updated_at)).scalar()
+            rows = session.query(
+                User.id, User.registration_complete, User.full_name,
+                User.notification_frequency, User.timezone_offset, User.trial_expired
+            ).filter(User.updated_at >= self.synced_until - SYNC_OVERLAP).all()
+        finally:
+            close_session(session)
+
+        for row in rows:
+            self.sync_user(row)
+        if synced_until is not None:
+            self.synced_until = max(self.synced_until, synced_until)
+        return len(rows)
+
+    def needs_rebuild(self, now: Optional[datetime] = None) -> bool:
+        """Check if the wheel was never built or is older than REBUILD_INTERVAL"""
+        if self.last_built is None:
+            return True
+        return (now or datetime.now()) - self.last_built >= REBUILD_INTERVAL
+
+    def due_users(self, utc_time: datetime) -> Tuple[Set[int], Dict[str, Set[int]]]:
+        """
+        Get users due a reminder at the given UTC minute
+
+        Args:
+            utc_time: Current time in UTC
+
+        Returns:
+            Tuple of (user IDs due a daily reminder, {weekly kind: user IDs})
+        """
+        minute_of_day = utc_time.hour * 60 + utc_time.minute
+        minute_of_week = utc_time.weekday() * MINUTES_PER_DAY + minute_of_day
+        daily = set(self._daily.get(minute_of_day, ()))
+        weekly = {kind: set(ids) for kind, ids in self._weekly.get(minute_of_week, {}).items()}
+        return daily, weekly
+
+def chunked(ids: Iterable[int], size: int = 500) -> Iterable[List[int]]:
+    """Split IDs into chunks that fit into an SQL IN clause"""
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+# Shared index used by the scheduler and updated by the settings handlers
+schedule_index = NotificationScheduleIndex()
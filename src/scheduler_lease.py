@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Scheduler Leases for PsyBot
+Database-backed leases so exactly one scheduler instance sends each partition of users
+"""
+
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Set
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from src.database.models import SchedulerLease as LeaseRow
+from src.database.session import engine, session_factory
+
+logger = logging.getLogger(__name__)
+
+# Number of user partitions (id modulo N); run up to this many scheduler workers.
+# Every scheduler instance must use the same value.
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "1"))
+# Seconds a lease stays valid without renewal (failover time after a crash)
+SCHEDULER_LEASE_TTL = int(os.getenv("SCHEDULER_LEASE_TTL", "60"))
+
+# Leases released on clean shutdown expire at this time, so standbys take over at once
+RELEASED = datetime(1970, 1, 1)
+
+class PartitionLeases:
+    """
+    Leases on the hash partitions of a scheduled job, one row per partition.
+
+    An instance renews the partitions it holds every TTL/3 seconds. An idle
+    instance (holding none) claims the first expired partition, so N workers
+    spread over N partitions and extra instances wait as standbys. A busy
+    instance also adopts partitions left expired for a whole TTL, so the
+    users of a crashed worker are not skipped while nobody is standing by.
+    Claims are conditional UPDATEs, so two instances never hold one lease.
+    """
+
+    def __init__(self, job: str = "notifications", partitions: int = SCHEDULER_WORKERS,
+                 ttl: int = SCHEDULER_LEASE_TTL):
+        self.job = job
+        self.partitions = max(partitions, 1)
+        self.ttl = timedelta(seconds=ttl)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held: Set[int] = set()
+        self.valid_until: Optional[datetime] = None  # Expiry written by the last successful renewal
+        self.started_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        LeaseRow.__table__.create(engine, checkfirst=True)
+
+    def lease_name(self, partition: int) -> str:
+        return f"{self.job}:{partition}/{self.partitions}"
+
+    def partition_of(self, user_id: int) -> int:
+        """Partition a user belongs to"""
+        return user_id % self.partitions
+
+    def holds(self, partition: int, now: datetime = None) -> bool:
+        """Whether this instance still holds a partition's lease (renewed and not expired since)"""
+        return (partition in self.held and self.valid_until is not None
+                and (now or datetime.now()) < self.valid_until)
+
+    def _acquire(self, session, partition: int, now: datetime, expired_before: datetime, create: bool) -> bool:
+        """Take or renew a lease if we hold it or it expired before the given time (or create it if allowed)"""
+        name = self.lease_name(partition)
+        updated = session.query(LeaseRow).filter(
+            LeaseRow.name == name,
+            or_(LeaseRow.holder == self.holder, LeaseRow.expires_at < expired_before)
+        ).update({LeaseRow.holder: self.holder, LeaseRow.expires_at: now + self.ttl}, synchronize_session=False)
+        session.commit()
+        if updated:
+            return True
+
+        if not create or session.query(LeaseRow.name).filter(LeaseRow.name == name).first() is not None:
+            return False
+        try:
+            session.add(LeaseRow(name=name, holder=self.holder, expires_at=now + self.ttl))
+            session.commit()
+            return True
+        except IntegrityError:
+            # Another instance created it first
+            session.rollback()
+            return False
+
+    def refresh(self, now: datetime = None) -> Set[int]:
+        """
+        Renew held leases and claim free ones
+
+        Returns:
+            Partitions this instance may send right now
+        """
+        with self._lock:
+            now = now or datetime.now()
+            self.started_at = self.started_at or now
+            # Own session: the scheduler tick may be holding the thread's scoped session
+            session = session_factory()
+            held = set()
+            try:
+                for partition in range(self.partitions):
+                    if partition in self.held or (not held and not self.held):
+                        expired_before = now
+                    else:
+                        expired_before = now - self.ttl
+                    # A partition nobody ever leased counts as expired since we started
+                    create = self.started_at <= expired_before
+                    if self._acquire(session, partition, now, expired_before, create):
+                        held.add(partition)
+            except Exception as e:
+                # Without a renewal we cannot tell whether another instance took over
+                logger.error(f"Failed to refresh scheduler leases: {e}")
+                session.rollback()
+                held = set()
+            finally:
+                session.close()
+
+            if held != self.held:
+                logger.info(f"Scheduler {self.holder} now holds {self.job} partitions "
+                            f"{sorted(held)} of {self.partitions}")
+            self.held = held
+            self.valid_until = now + self.ttl if held else None
+            return set(held)
+
+    def release(self) -> None:
+        """Give up all held leases so a standby can take over immediately"""
+        with self._lock:
+            if not self.held:
+                return
+            session = session_factory()
+            try:
+                session.query(LeaseRow).filter(LeaseRow.holder == self.holder).update(
+                    {LeaseRow.expires_at: RELEASED}, synchronize_session=False
+                )
+                session.commit()
+                logger.info(f"Scheduler {self.holder} released {self.job} partitions {sorted(self.held)}")
+            except Exception as e:
+                logger.error(f"Failed to release scheduler leases: {e}")
+                session.rollback()
+            finally:
+                session.close()
+            self.held = set()
+            self.valid_until = None
+
+    async def run(self) -> None:
+        """Background renewal loop"""
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.ttl.total_seconds() / 3)
+            await asyncio.to_thread(self.refresh)
+
+    def start(self) -> asyncio.Task:
+        """Start the background loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop renewing and release the leases"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.release)
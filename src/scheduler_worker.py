@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Standalone Notification Scheduler Worker for PsyBot
+Runs the leased notification scheduler in its own process, away from the bot's handlers
+
+Start one or more workers with the same SCHEDULER_WORKERS value and set
+SCHEDULER_EMBEDDED=false for the bot so it does not run a scheduler itself.
+
+Usage:
+    python -m src.scheduler_worker
+"""
+
+import signal
+import asyncio
+import logging
+from src.notification_scheduler import NotificationScheduler, bot
+
+logger = logging.getLogger(__name__)
+
+async def main():
+    scheduler = NotificationScheduler()
+    task = asyncio.create_task(scheduler.run_scheduler())
+
+    # Release the leases on SIGTERM too (docker stop), so a standby takes over at once
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        logger.info("Notification scheduler worker stopped")
+    finally:
+        await bot.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -9,8 +9,11 @@ import logging
 from functools import wraps
 from aiogram import types
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import update
 from src.database.models import User
 from src.database.session import get_session, close_session
+from src.database.async_session import db_session
+from src.user_cache import user_cache
 from src.freemium_config import (
     TRIAL_DURATION, TRIAL_FEATURES, PREMIUM_FEATURES, EXPIRED_FEATURES,
     TRIAL_EXPIRED_MESSAGE, TRIAL_WARNING_3_DAYS, TRIAL_WARNING_1_DAY,
@@ -32,27 +35,22 @@ def require_trial_access(feature: str):
     def decorator(func):
         @wraps(func)
         async def wrapper(callback: types.CallbackQuery, state: FSMContext, *args, **kwargs):
-            # Get user from database
-            session = get_session()
-            try:
-                db_user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-                
-                if not db_user or not getattr(db_user, 'registration_complete', False):
-                    await callback.answer()
-                    await callback.message.answer("Пожалуйста, завершите регистрацию с помощью /start")
-                    return
-                
-                # Check trial access
-                if not has_feature_access(db_user, feature):
-                    await callback.answer()
-                    await callback.message.answer(get_access_denied_message(feature))
-                    return
-                
-                # If access is granted, proceed with the original function
-                return await func(callback, state, *args, **kwargs)
-                
-            finally:
-                close_session(session)
+            # Get user profile (cached)
+            db_user = await user_cache.get(callback.from_user.id)
+            
+            if not db_user or not getattr(db_user, 'registration_complete', False):
+                await callback.answer()
+                await callback.message.answer("Пожалуйста, завершите регистрацию с помощью /start")
+                return
+            
+            # Check trial access
+            if not await has_feature_access_async(db_user, feature):
+                await callback.answer()
+                await callback.message.answer(get_access_denied_message(feature))
+                return
+            
+            # If access is granted, proceed with the original function
+            return await func(callback, state, *args, **kwargs)
         
         return wrapper
     return decorator
@@ -71,6 +69,22 @@ def start_trial_period(user: User) -> None:
     user.trial_expired = False
     logger.info(f"Started trial period for user {user.telegram_id}: {user.trial_start_date} - {user.trial_end_date}")
 
+def _evaluate_trial(user: User) -> Tuple[str, int]:
+    """Trial status and days remaining, without touching the database"""
+    if user.is_premium:
+        return 'premium', -1
+    
+    if not user.trial_start_date or not user.trial_end_date:
+        return 'no_trial', 0
+    
+    now = datetime.now()
+    
+    if now > user.trial_end_date:
+        return 'trial_expired', 0
+    
+    days_remaining = (user.trial_end_date - now).days
+    return 'trial_active', days_remaining
+
 def check_trial_status(user: User) -> Tuple[str, int]:
     """
     Check user's trial status and return status and days remaining
@@ -85,35 +99,53 @@ def check_trial_status(user: User) -> Tuple[str, int]:
         - 'trial_expired': Trial has expired
         - 'no_trial': No trial set (shouldn't happen for registered users)
     """
-    if user.is_premium:
-        return 'premium', -1
+    status, days_remaining = _evaluate_trial(user)
     
-    if not user.trial_start_date or not user.trial_end_date:
-        return 'no_trial', 0
+    if status == 'trial_expired' and not user.trial_expired:
+        # Mark as expired in database
+        session = get_session()
+        try:
+            db_user = session.query(User).filter(User.telegram_id == user.telegram_id).first()
+            if db_user:
+                db_user.trial_expired = True
+                session.commit()
+                # Update the passed user object too
+                user.trial_expired = True
+                logger.info(f"Marked trial as expired for user {user.telegram_id}")
+        except Exception as e:
+            logger.error(f"Failed to update trial_expired status: {e}")
+            session.rollback()
+        finally:
+            close_session(session)
     
-    now = datetime.now()
+    return status, days_remaining
+
+async def check_trial_status_async(user: User) -> Tuple[str, int]:
+    """
+    Async variant of check_trial_status for handlers (does not block the event loop)
     
-    if now > user.trial_end_date:
-        if not user.trial_expired:
-            # Mark as expired in database
-            session = get_session()
-            try:
-                db_user = session.query(User).filter(User.telegram_id == user.telegram_id).first()
-                if db_user:
-                    db_user.trial_expired = True
-                    session.commit()
-                    # Update the passed user object too
-                    user.trial_expired = True
-                    logger.info(f"Marked trial as expired for user {user.telegram_id}")
-            except Exception as e:
-                logger.error(f"Failed to update trial_expired status: {e}")
-                session.rollback()
-            finally:
-                close_session(session)
-        return 'trial_expired', 0
+    Args:
+        user: User or cached UserSnapshot to check
     
-    days_remaining = (user.trial_end_date - now).days
-    return 'trial_active', days_remaining
+    Returns:
+        Same (status, days_remaining) tuple as check_trial_status
+    """
+    status, days_remaining = _evaluate_trial(user)
+    
+    if status == 'trial_expired' and not user.trial_expired:
+        # Mark as expired in database
+        try:
+            async with db_session() as session:
+                await session.execute(
+                    update(User).where(User.telegram_id == user.telegram_id).values(trial_expired=True)
+                )
+                await session.commit()
+            user_cache.invalidate(user.telegram_id)  # Bulk UPDATE bypasses the mapper events
+            logger.info(f"Marked trial as expired for user {user.telegram_id}")
+        except Exception as e:
+            logger.error(f"Failed to update trial_expired status: {e}")
+    
+    return status, days_remaining
 
 def has_feature_access(user: User, feature: str) -> bool:
     """
@@ -135,6 +167,26 @@ def has_feature_access(user: User, feature: str) -> bool:
     else:  # trial_expired or no_trial
         return EXPIRED_FEATURES.get(feature, False)
 
+async def has_feature_access_async(user: User, feature: str) -> bool:
+    """
+    Async variant of has_feature_access for handlers
+    
+    Args:
+        user: User object to check
+        feature: Feature name to check access for
+        
+    Returns:
+        Boolean indicating if user has access
+    """
+    status, _ = await check_trial_status_async(user)
+    
+    if status == 'premium':
+        return PREMIUM_FEATURES.get(feature, False)
+    elif status == 'trial_active':
+        return TRIAL_FEATURES.get(feature, False)
+    else:  # trial_expired or no_trial
+        return EXPIRED_FEATURES.get(feature, False)
+
 def get_trial_warning_message(user: User) -> Optional[str]:
     """
     Get appropriate warning message based on trial status
@@ -184,6 +236,8 @@ def upgrade_to_premium(user_telegram_id: int) -> bool:
             user.is_premium = True
             user.trial_expired = False
             session.commit()
+            from src.schedule_index import schedule_index
+            schedule_index.sync_user(user)
             logger.info(f"Upgraded user {user_telegram_id} to premium")
             return True
         return False
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+User Profile Cache for PsyBot
+Bounded LRU/TTL cache of immutable user snapshots keyed by telegram_id
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event, func, inspect, select
+from src.database.models import User
+from src.database.async_session import db_session, get_user_by_telegram_id
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of cached profiles
+USER_CACHE_SIZE = 10000
+# Seconds a snapshot is served before it is reloaded
+USER_CACHE_TTL = 300
+# Seconds an unregistered telegram_id is remembered as absent (registering drops it at once)
+USER_CACHE_ABSENT_TTL = 30
+# Seconds between checks for users written by other processes (webhook workers, scheduler, admin panel)
+USER_CACHE_SYNC_INTERVAL = 5
+# Rows updated this long before the newest updated_at seen are read again on every sync
+SYNC_OVERLAP = timedelta(minutes=1)
+
+# Columns whose writes do not change the snapshot (no invalidation needed)
+VOLATILE_COLUMNS = {"last_activity", "updated_at"}
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Read-only copy of the profile fields handlers check on every update"""
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    full_name: Optional[str]
+    registration_complete: bool
+    time_format: Optional[str]
+    timezone_offset: int
+    user_timezone: Optional[str]
+    notification_frequency: int
+    trial_start_date: Optional[datetime]
+    trial_end_date: Optional[datetime]
+    is_premium: bool
+    trial_expired: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(**{field.name: getattr(user, field.name) for field in fields(cls)})
+
+class UserProfileCache:
+    """
+    telegram_id -> UserSnapshot, least recently used evicted first.
+
+    Snapshots are invalidated by SQLAlchemy mapper events whenever a User
+    row is inserted, updated (outside VOLATILE_COLUMNS) or deleted through
+    the ORM; bulk UPDATE statements must call invalidate() themselves.
+    Unknown IDs are cached as None for absent_ttl seconds, so updates from
+    people who never registered do not query the database every time.
+    Writes by other processes do not fire these events; every
+    sync_interval seconds get() reloads the cached users whose
+    User.updated_at moved, so e.g. a premium upgrade made in another
+    webhook worker is seen within seconds instead of after the TTL.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL,
+                 absent_ttl: float = USER_CACHE_ABSENT_TTL, sync_interval: float = USER_CACHE_SYNC_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.absent_ttl = absent_ttl
+        self.sync_interval = sync_interval
+        self._synced_at = float("-inf")
+        self._synced_until: Optional[datetime] = None  # Newest User.updated_at (database clock) seen
+        self._entries: "OrderedDict[int, Tuple[Optional[UserSnapshot], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.refreshes = 0
+
+    def _lookup(self, telegram_id: int) -> Tuple[bool, Optional[UserSnapshot]]:
+        """(found, snapshot); a found None means the user is known not to be registered"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            snapshot, expires_at = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return True, snapshot
+            del self._entries[telegram_id]
+        self.misses += 1
+        return False, None
+
+    def _store(self, telegram_id: int, snapshot: Optional[UserSnapshot], ttl: float) -> None:
+        self._entries[telegram_id] = (snapshot, time.monotonic() + ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, user: User) -> UserSnapshot:
+        """Cache a snapshot of a loaded User row"""
+        snapshot = UserSnapshot.from_user(user)
+        self._store(user.telegram_id, snapshot, self.ttl)
+        return snapshot
+
+    async def sync_changes(self) -> int:
+        """
+        Reload cached snapshots of users written since the last sync (at most once per sync_interval)
+
+        Returns:
+            Number of cached snapshots replaced
+        """
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return 0
+        self._synced_at = now
+
+        columns = [getattr(User, field.name) for field in fields(UserSnapshot)]
+        try:
+            async with db_session() as session:
+                synced_until = await session.scalar(select(func.max(User.updated_at)))
+                rows = []
+                if self._synced_until is not None:
+                    rows = (await session.execute(
+                        select(*columns).where(User.updated_at >= self._synced_until - SYNC_OVERLAP)
+                    )).all()
+        except Exception as e:
+            logger.error(f"Failed to sync user cache: {e}")
+            return 0
+
+        refreshed = 0
+        for row in rows:
+            snapshot = UserSnapshot(**row._mapping)
+            entry = self._entries.get(snapshot.telegram_id)
+            if entry is not None and entry[0] != snapshot:
+                self._entries[snapshot.telegram_id] = (snapshot, entry[1] if entry[0] else time.monotonic() + self.ttl)
+                refreshed += 1
+        if synced_until is not None:
+            self._synced_until = max(self._synced_until or synced_until, synced_until)
+        self.refreshes += refreshed
+        return refreshed
+
+    async def get(self, telegram_id: int) -> Optional[UserSnapshot]:
+        """Get a user's snapshot, loading it with the async session on a miss (None if not registered)"""
+        await self.sync_changes()
+        found, snapshot = self._lookup(telegram_id)
+        if found:
+            return snapshot
+
+        async with db_session() as session:
+            user = await get_user_by_telegram_id(session, telegram_id)
+        if user is None:
+            self._store(telegram_id, None, self.absent_ttl)
+            return None
+        return self.put(user)
+
+    def invalidate(self, telegram_id: int) -> None:
+        if self._entries.pop(telegram_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "refreshes": self.refreshes,
+        }
+
+# Shared cache used by handlers, middleware and the trial checks
+user_cache = UserProfileCache()
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    user_cache.invalidate(target.telegram_id)
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    changed = {attr.key for attr in inspect(target).attrs if attr.history.has_changes()}
+    if changed - VOLATILE_COLUMNS:
+        user_cache.invalidate(target.telegram_id)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Webhook Mode for PsyBot
+aiohttp webhook server that fans updates out to chat-partitioned worker processes
+"""
+
+import os
+import hmac
+import queue
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS base URL Telegram delivers updates to (e.g. https://bot.example.com)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8012"))
+# Worker processes; every chat is always handled by the same worker
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Updates waiting per worker before the server answers 503 and Telegram redelivers later
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Updates a worker handles concurrently (updates of one chat still run one after another)
+WEBHOOK_WORKER_CONCURRENCY = int(os.getenv("WEBHOOK_WORKER_CONCURRENCY", "32"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+SUPERVISE_INTERVAL = 5
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """
+    Chat an update belongs to, as used for the FSM key
+
+    Args:
+        update: Raw update JSON from Telegram
+
+    Returns:
+        Chat ID (or user ID for updates without a chat, 0 if neither)
+    """
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        if isinstance(payload.get("chat"), dict):
+            return payload["chat"]["id"]
+        message = payload.get("message")
+        if isinstance(message, dict) and isinstance(message.get("chat"), dict):
+            return message["chat"]["id"]
+        for key in ("from", "user"):
+            if isinstance(payload.get(key), dict):
+                return payload[key]["id"]
+    return 0
+
+async def _handle_updates(worker_index: int, updates: multiprocessing.Queue):
+    from src.main import bot, dp
+    from src.llm_health import health_monitor
+    from src.activity_tracker import activity_buffer
+    from src.database.async_session import dispose_async_engine
+    from src.report_renderer import report_renderer
+
+    health_monitor.start()
+    activity_buffer.start()
+    await dp.emit_startup(bot=bot)
+    logger.info(f"🧵 Webhook worker {worker_index} started")
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(WEBHOOK_WORKER_CONCURRENCY)
+    # Last task per chat: the next update of a chat waits for it
+    tails: Dict[int, asyncio.Task] = {}
+
+    async def process(update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Error handling update {update.get('update_id')}: {e}")
+
+    def finished(chat_id: int, task: asyncio.Task):
+        slots.release()
+        if tails.get(chat_id) is task:
+            del tails[chat_id]
+
+    try:
+        while True:
+            await slots.acquire()
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                slots.release()
+                break
+            chat_id = update_chat_id(update)
+            task = asyncio.create_task(process(update, tails.get(chat_id)))
+            tails[chat_id] = task
+            task.add_done_callback(lambda done, chat_id=chat_id: finished(chat_id, done))
+
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await health_monitor.stop()
+        await activity_buffer.stop()
+        await report_renderer.shutdown()
+        await bot.session.close()
+        await dispose_async_engine()
+        logger.info(f"🧵 Webhook worker {worker_index} stopped")
+
+def worker_main(worker_index: int, updates: multiprocessing.Queue):
+    """Entry point of a worker process: feed queued updates to the dispatcher until a None sentinel"""
+    asyncio.run(_handle_updates(worker_index, updates))
+
+class WebhookServer:
+    """
+    Receives Telegram updates over HTTP and partitions them by chat ID.
+
+    Each worker process owns a bounded queue and runs its own Dispatcher,
+    so all updates of a chat reach the same process in arrival order and
+    its FSM state and caches stay process-local.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self.dp = dp
+        self.workers = max(workers, 1)
+        # spawn: workers must not inherit the server's event loop, DB connections or threads
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = [self._context.Queue(queue_size) for _ in range(self.workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self.received = 0
+        self.rejected = 0
+
+    def _start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=worker_main, args=(index, self._queues[index]), name=f"psybot-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=401)
+
+        update = await request.json()
+        partition = update_chat_id(update) % self.workers
+        try:
+            self._queues[partition].put_nowait(update)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning(f"Webhook queue of worker {partition} is full, update {update.get('update_id')} deferred")
+            return web.Response(status=503)
+
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        workers = []
+        for index, process in enumerate(self._processes):
+            try:
+                queued = self._queues[index].qsize()
+            except NotImplementedError:
+                queued = None
+            workers.append({"alive": bool(process and process.is_alive()), "queued": queued})
+
+        healthy = all(worker["alive"] for worker in workers)
+        return web.json_response(
+            {"status": "ok" if healthy else "degraded", "received": self.received,
+             "rejected": self.rejected, "workers": workers},
+            status=200 if healthy else 503
+        )
+
+    async def _supervise(self) -> None:
+        """Restart workers that died; their queues are kept so pending updates are not lost"""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Webhook worker {index} exited with code {process.exitcode}, restarting")
+                    self._start_worker(index)
+
+    async def run(self) -> None:
+        """Serve until cancelled, then drain the workers"""
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL must be set to run in webhook mode")
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+        await self.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=self.dp.resolve_used_update_types(),
+        )
+        logger.info(f"🌐 Webhook server on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} with {self.workers} workers")
+
+        supervisor = asyncio.create_task(self._supervise())
+        try:
+            await asyncio.Event().wait()
+        finally:
+            supervisor.cancel()
+            # Stop accepting updates first; Telegram keeps undelivered ones until we are back
+            await runner.cleanup()
+            loop = asyncio.get_running_loop()
+            for updates in self._queues:
+                try:
+                    await loop.run_in_executor(None, updates.put, None, True, 30)
+                except queue.Full:
+                    pass
+            for process in self._processes:
+                if process is not None:
+                    await loop.run_in_executor(None, process.join, 30)
+                    if process.is_alive():
+                        process.terminate()
+            logger.info("🌐 Webhook server stopped")
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Run the bot in webhook mode (BOT_MODE=webhook)"""
+    await WebhookServer(bot, dp).run()